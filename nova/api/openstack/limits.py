@@ -18,6 +18,7 @@ Module dedicated functions/classes dealing with rate limiting requests.
 """
 
 import copy
+import hashlib
 import httplib
 import json
 import math
@@ -27,10 +28,9 @@ import urllib
 import webob.exc
 from xml.dom import minidom
 
-from collections import defaultdict
-
 from webob.dec import wsgify
 
+from nova import flags
 from nova import quota
 from nova import utils
 from nova import wsgi as base_wsgi
@@ -40,6 +40,9 @@ from nova.api.openstack.views import limits as limits_views
 from nova.api.openstack import wsgi
 
 
+FLAGS = flags.FLAGS
+
+
 # Convenience constants for the limits dictionary passed to Limiter().
 PER_SECOND = 1
 PER_MINUTE = 60
@@ -191,6 +194,9 @@ class Limit(object):
         self.verb = verb
         self.uri = uri
         self.regex = regex
+        self._pattern = re.compile(regex)
+        self.key = hashlib.md5("%s %s %s %s" % (verb, regex, value,
+                                                unit)).hexdigest()
         self.value = int(value)
         self.unit = unit
         self.unit_string = self.display_unit().lower()
@@ -215,7 +221,7 @@ class Limit(object):
         @param verb: string http verb (POST, GET, etc.)
         @param url: string URL
         """
-        if self.verb != verb or not re.match(self.regex, url):
+        if not self.matches(verb, url):
             return
 
         now = self._get_time()
@@ -245,10 +251,46 @@ class Limit(object):
         self.remaining = math.floor(((cap - water) / cap) * val)
         self.next_request = now
 
+    def matches(self, verb, url):
+        """Return whether the limit applies to the verb and URL."""
+        return self.verb == verb and self._pattern.match(url) is not None
+
     def _get_time(self):
         """Retrieve the current time. Broken out for testability."""
         return time.time()
 
+    def __deepcopy__(self, memo):
+        """
+        Copy the limit and its state.  The state is all immutable values,
+        so a shallow copy will do, and the compiled pattern is shared.
+        """
+        result = copy.copy(self)
+        memo[id(self)] = result
+        return result
+
+    def is_idle(self):
+        """
+        Return whether the bucket has drained since the last request, in
+        which case the limit is in the same state as a new one.
+        """
+        if self.last_request is None:
+            return True
+        return self._get_time() - self.last_request >= self.water_level
+
+    def get_state(self):
+        """Return the state of the bucket as a string."""
+        return "%r %r" % (self.water_level, self.last_request)
+
+    def set_state(self, state):
+        """Restore the state of the bucket from `get_state()`."""
+        if state is None:
+            self.water_level = 0
+            self.last_request = None
+            return
+        water_level, last_request = state.split()
+        self.water_level = float(water_level)
+        self.last_request = float(last_request)
+
     def display_unit(self):
         """Display the string name of the unit."""
         return self.UNITS.get(self.unit, "UNKNOWN")
@@ -342,8 +384,15 @@ class RateLimitingMiddleware(base_wsgi.Middleware):
 class Limiter(object):
     """
     Rate-limit checking class which handles limits in memory.
+
+    The limits of each verb are indexed so that a request only checks the
+    limits of its verb.  The state of a user's limits is dropped once every
+    bucket has drained, as it is then the same as a new copy of the limits.
     """
 
+    # Minimum number of seconds between sweeps for idle users.
+    sweep_interval = 60
+
     def __init__(self, limits, **kwargs):
         """
         Initialize the new `Limiter`.
@@ -351,19 +400,62 @@ class Limiter(object):
         @param limits: List of `Limit` objects
         """
         self.limits = copy.deepcopy(limits)
-        self.levels = defaultdict(lambda: copy.deepcopy(limits))
+        self.levels = {}
+        self.user_limits = {}
+        self._verb_index = self._index_by_verb(self.limits)
+        self._user_verb_index = {}
+        self._next_sweep = time.time() + self.sweep_interval
 
         # Pick up any per-user limit information
         for key, value in kwargs.items():
             if key.startswith('user:'):
                 username = key[5:]
-                self.levels[username] = self.parse_limits(value)
+                self.user_limits[username] = self.parse_limits(value)
+                self._user_verb_index[username] = self._index_by_verb(
+                        self.user_limits[username])
+                self.levels[username] = copy.deepcopy(
+                        self.user_limits[username])
+
+    @staticmethod
+    def _index_by_verb(limits):
+        """Map each verb to the positions of its limits in the list."""
+        index = {}
+        for position, limit in enumerate(limits):
+            index.setdefault(limit.verb, []).append(position)
+        return index
+
+    def _get_levels(self, username):
+        """Return the limits of the user, with the state of each."""
+        try:
+            return self.levels[username]
+        except KeyError:
+            levels = copy.deepcopy(self.user_limits.get(username,
+                                                        self.limits))
+            self.levels[username] = levels
+            return levels
+
+    def _get_verb_limits(self, username, verb):
+        """Return the user's limits on the verb, with their positions."""
+        levels = self._get_levels(username)
+        index = self._user_verb_index.get(username, self._verb_index)
+        return [(position, levels[position])
+                for position in index.get(verb, ())]
+
+    def _sweep(self):
+        """Drop the state of the users whose buckets have all drained."""
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        for username, levels in self.levels.items():
+            if all(limit.is_idle() for limit in levels):
+                del self.levels[username]
 
     def get_limits(self, username=None):
         """
         Return the limits for a given user.
         """
-        return [limit.display() for limit in self.levels[username]]
+        return [limit.display() for limit in self._get_levels(username)]
 
     def check_for_delay(self, verb, url, username=None):
         """
@@ -373,11 +465,13 @@ class Limiter(object):
         """
         delays = []
 
-        for limit in self.levels[username]:
+        for _position, limit in self._get_verb_limits(username, verb):
             delay = limit(verb, url)
             if delay:
                 delays.append((delay, limit.error_message))
 
+        self._sweep()
+
         if delays:
             delays.sort()
             return delays[0]
@@ -445,6 +539,57 @@ class Limiter(object):
         return result
 
 
+class MemcacheLimiter(Limiter):
+    """
+    Rate-limit checking class which keeps the state of the limits in
+    memcached, so that every API worker pointed at the same servers shares
+    the same buckets without a round trip to a `WsgiLimiter`.
+
+    Uses memcached if the memcached_servers flag is set, otherwise it uses
+    a very simple in-process cache.  The state of a bucket is read and
+    written back without a lock, so simultaneous requests from different
+    workers may let a request or two more through than the limit allows.
+    """
+
+    def __init__(self, limits, **kwargs):
+        super(MemcacheLimiter, self).__init__(limits, **kwargs)
+        if FLAGS.memcached_servers:
+            import memcache
+        else:
+            from nova import fakememcache as memcache
+        self.mc = memcache.Client(FLAGS.memcached_servers, debug=0)
+
+    def check_for_delay(self, verb, url, username=None):
+        """
+        Check the given verb/user/user triplet for limit, using the state
+        of the limits kept in memcached.
+
+        @return: Tuple of delay (in seconds) and error message (or None, None)
+        """
+        delays = []
+
+        for _position, limit in self._get_verb_limits(username, verb):
+            if not limit.matches(verb, url):
+                continue
+            key = "ratelimit-%s-%s" % (urllib.quote(username or ""),
+                                       limit.key)
+            limit.set_state(self.mc.get(key))
+            delay = limit(verb, url)
+            # The bucket has drained once a unit has passed, so the state
+            # can expire then.
+            self.mc.set(key, limit.get_state(), time=limit.unit)
+            if delay:
+                delays.append((delay, limit.error_message))
+
+        self._sweep()
+
+        if delays:
+            delays.sort()
+            return delays[0]
+
+        return None, None
+
+
 class WsgiLimiter(object):
     """
     Rate-limit checking from a WSGI application. Uses an in-memory `Limiter`.
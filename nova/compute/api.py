@@ -1252,6 +1252,17 @@ class API(base.Base):
         return self._call_compute_message_for_host("host_power_action",
                 context, host=host, params={"action": action})
 
+    def prefetch_image(self, context, image_ref, instance_type, count=1):
+        """Asks the scheduler to cache the image on the hosts the next count
+        instances of the type are likely to be placed on, so that they do
+        not wait on the download."""
+        rpc.cast(context, FLAGS.scheduler_topic,
+                 {'method': 'prefetch_image',
+                  'args': {'topic': FLAGS.compute_topic,
+                           'image_ref': image_ref,
+                           'memory_mb': instance_type['memory_mb'],
+                           'count': count}})
+
     @scheduler_api.reroute_compute("diagnostics")
     def get_diagnostics(self, context, instance_id):
         """Retrieve diagnostics for the given instance."""
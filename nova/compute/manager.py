@@ -83,6 +83,14 @@ flags.DEFINE_integer("rescue_timeout", 0,
                      " Set to 0 to disable.")
 flags.DEFINE_integer('host_state_interval', 120,
                      'Interval in seconds for querying the host status')
+flags.DEFINE_bool('power_state_sync_incremental', False,
+                  'Only sync the power state of instances whose state on the'
+                  ' hypervisor changed since the last periodic task, plus'
+                  ' a slice of the rest of the instances on the host')
+flags.DEFINE_integer('power_state_sync_slices', 1,
+                     'Number of periodic tasks the incremental power state'
+                     ' sync spreads a check of every instance on the host'
+                     ' over')
 
 LOG = logging.getLogger('nova.compute.manager')
 
@@ -145,6 +153,16 @@ class ComputeManager(manager.SchedulerDependentManager):
         self.network_manager = utils.import_object(FLAGS.network_manager)
         self.volume_manager = utils.import_object(FLAGS.volume_manager)
         self._last_host_check = 0
+        # The power states last seen on the hypervisor, keyed by name, and
+        # the ids of the instances, for the incremental power state sync.
+        self._vm_power_states = None
+        self._vm_instance_ids = {}
+        self._power_state_sync_ticks = 0
+        self.power_state_sync_stats = {'ticks': 0,
+                                       'duration': 0.0,
+                                       'checked': 0,
+                                       'drifted': 0,
+                                       'total_drifted': 0}
         super(ComputeManager, self).__init__(service_name="compute",
                                              *args, **kwargs)
 
@@ -1116,6 +1134,15 @@ class ComputeManager(manager.SchedulerDependentManager):
         """Sets the specified host's ability to accept new instances."""
         return self.driver.set_host_enabled(host, enabled)
 
+    @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
+    def prefetch_image(self, context, image_ref, **_kwargs):
+        """Fetches an image into the image cache of this host."""
+        LOG.audit(_("Prefetching image %s"), image_ref, context=context)
+        try:
+            self.driver.prefetch_image(context, image_ref)
+        except NotImplementedError:
+            LOG.debug(_("Hypervisor driver does not support image prefetch"))
+
     @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
     def get_diagnostics(self, context, instance_id):
         """Retrieve diagnostics for an instance on this host."""
@@ -1673,7 +1700,10 @@ class ComputeManager(manager.SchedulerDependentManager):
             error_list.append(ex)
 
         try:
-            self._sync_power_states(context)
+            if FLAGS.power_state_sync_incremental:
+                self._sync_power_states_incremental(context)
+            else:
+                self._sync_power_states(context)
         except Exception as ex:
             LOG.warning(_("Error during power_state sync: %s"), unicode(ex))
             error_list.append(ex)
@@ -1700,9 +1730,11 @@ class ComputeManager(manager.SchedulerDependentManager):
         on the hypervisor.
 
         """
+        started_at = time.time()
         vm_instances = self.driver.list_instances_detail()
         vm_instances = dict((vm.name, vm) for vm in vm_instances)
         db_instances = self.db.instance_get_all_by_host(context, self.host)
+        drifted = 0
 
         num_vm_instances = len(vm_instances)
         num_db_instances = len(db_instances)
@@ -1724,6 +1756,77 @@ class ComputeManager(manager.SchedulerDependentManager):
             if vm_power_state == db_power_state:
                 continue
 
+            drifted += 1
             self._instance_update(context,
                                   db_instance["id"],
                                   power_state=vm_power_state)
+
+        self._record_power_state_sync(started_at, num_db_instances, drifted)
+
+    def _sync_power_states_incremental(self, context):
+        """Align power states, only checking what may have changed.
+
+        The power states last seen on the hypervisor are kept, and each
+        periodic task only checks the instances whose state on the
+        hypervisor changed since, plus one of power_state_sync_slices
+        slices of the rest of the instances on the host, to catch changes
+        made to the database. Only the ids and power states are read from
+        the database, and the changes are written in a single update.
+
+        """
+        started_at = time.time()
+        vm_power_states = dict((vm.name, vm.state)
+                               for vm in self.driver.list_instances_detail())
+
+        if self._vm_power_states is None:
+            # Nothing has been seen yet, so check every instance.
+            slices = 1
+            changed_ids = []
+        else:
+            slices = max(1, FLAGS.power_state_sync_slices)
+            last_power_states = self._vm_power_states
+            changed = [name for name in set(vm_power_states) |
+                                        set(last_power_states)
+                       if vm_power_states.get(name) !=
+                          last_power_states.get(name)]
+            changed_ids = [self._vm_instance_ids[name] for name in changed
+                           if name in self._vm_instance_ids]
+        index = self._power_state_sync_ticks % slices
+        db_power_states = self.db.instance_get_power_states_by_host(
+                context, self.host, slices, index, changed_ids)
+
+        updates = {}
+        for instance_id, db_power_state in db_power_states.iteritems():
+            name = FLAGS.instance_name_template % instance_id
+            self._vm_instance_ids[name] = instance_id
+            vm_power_state = vm_power_states.get(name, power_state.NOSTATE)
+            if vm_power_state != db_power_state:
+                updates[instance_id] = vm_power_state
+        if updates:
+            self.db.instance_update_power_states(context, updates)
+
+        # Only remember the states once they are saved, so that changes
+        # which failed to save are checked again by the next task.
+        for name in set(self._vm_instance_ids) - set(vm_power_states):
+            if self._vm_instance_ids[name] not in db_power_states:
+                del self._vm_instance_ids[name]
+        self._vm_power_states = vm_power_states
+        self._power_state_sync_ticks += 1
+        self._record_power_state_sync(started_at, len(db_power_states),
+                                      len(updates))
+
+    def _record_power_state_sync(self, started_at, checked, drifted):
+        stats = self.power_state_sync_stats
+        stats['ticks'] += 1
+        stats['duration'] = time.time() - started_at
+        stats['checked'] = checked
+        stats['drifted'] = drifted
+        stats['total_drifted'] += drifted
+        LOG.debug(_("Power state sync checked %(checked)d instances in "
+                    "%(duration).3fs and found %(drifted)d out of sync.")
+                  % stats)
+
+    def get_power_state_sync_stats(self, context=None):
+        """Returns the duration and drift counts of the last power state
+        sync, to help size the periodic task interval."""
+        return self.power_state_sync_stats
@@ -155,6 +155,26 @@ def service_update(context, service_id, values):
     return IMPL.service_update(context, service_id, values)
 
 
+def service_heartbeat(context, service_id):
+    """Increment the report count of a service and set its updated_at.
+
+    Raises NotFound if service does not exist.
+
+    """
+    return IMPL.service_heartbeat(context, service_id)
+
+
+def service_heartbeat_many(context, heartbeats):
+    """Record the heartbeats of many services in a single update.
+
+    :param heartbeats: maps service ids to a (report count increment,
+                       updated_at) pair.
+    :returns: the ids of the services which do not exist.
+
+    """
+    return IMPL.service_heartbeat_many(context, heartbeats)
+
+
 ###################
 
 
@@ -510,6 +530,18 @@ def instance_get_all_by_filters(context, filters):
     return IMPL.instance_get_all_by_filters(context, filters)
 
 
+def instance_get_page_by_filters(context, filters, joins=None, marker=None,
+                                 limit=None):
+    """Get a page of the instances that match all filters, newest first.
+
+    Only the relations named in joins are loaded. Raises InvalidInput for
+    filters which can't be done in the database.
+
+    """
+    return IMPL.instance_get_page_by_filters(context, filters, joins,
+                                             marker, limit)
+
+
 def instance_get_active_by_window(context, begin, end=None, project_id=None):
     """Get instances active during a certain time window.
 
@@ -541,6 +573,32 @@ def instance_get_all_by_host(context, host):
     return IMPL.instance_get_all_by_host(context, host)
 
 
+def instance_get_power_states(context, instance_ids):
+    """Get a dict of the power state of each of the instances."""
+    return IMPL.instance_get_power_states(context, instance_ids)
+
+
+def instance_get_power_states_by_host(context, host, slices=1, index=0,
+                                      instance_ids=None):
+    """Get a dict of the power state of each instance on the host.
+
+    If slices is more than one, only the instances whose id modulo slices
+    is index are included, along with any of the given instance_ids.
+
+    """
+    return IMPL.instance_get_power_states_by_host(context, host, slices,
+                                                  index, instance_ids)
+
+
+def instance_update_power_states(context, power_states):
+    """Set the power state of many instances in a single update.
+
+    :param power_states: maps instance ids to their new power state.
+
+    """
+    return IMPL.instance_update_power_states(context, power_states)
+
+
 def instance_get_all_by_reservation(context, reservation_id):
     """Get all instances belonging to a reservation."""
     return IMPL.instance_get_all_by_reservation(context, reservation_id)
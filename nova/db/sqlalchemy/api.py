@@ -31,11 +31,13 @@ from nova import log as logging
 from nova.compute import vm_states
 from nova.db.sqlalchemy import models
 from nova.db.sqlalchemy.session import get_session
+from sqlalchemy import and_
 from sqlalchemy import or_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
 from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import case
 from sqlalchemy.sql.expression import desc
 from sqlalchemy.sql.expression import literal_column
 
@@ -346,6 +348,51 @@ def service_update(context, service_id, values):
         service_ref.save(session=session)
 
 
+@require_admin_context
+def service_heartbeat(context, service_id):
+    session = get_session()
+    with session.begin():
+        report_count = models.Service.report_count + 1
+        updated = session.query(models.Service).\
+                          filter_by(id=service_id).\
+                          filter_by(deleted=False).\
+                          update({'report_count': report_count,
+                                  'updated_at': utils.utcnow()},
+                                 synchronize_session=False)
+    if not updated:
+        raise exception.ServiceNotFound(service_id=service_id)
+
+
+@require_admin_context
+def service_heartbeat_many(context, heartbeats):
+    if not heartbeats:
+        return []
+    increments = [(service_id, count)
+                  for service_id, (count, _updated_at) in heartbeats.items()]
+    updated_ats = [(service_id, updated_at)
+                   for service_id, (_count, updated_at) in heartbeats.items()]
+    session = get_session()
+    with session.begin():
+        updated = session.query(models.Service).\
+                          filter(models.Service.id.in_(heartbeats.keys())).\
+                          filter_by(deleted=False).\
+                          update({'report_count': models.Service.report_count +
+                                      case(increments,
+                                           value=models.Service.id),
+                                  'updated_at': case(updated_ats,
+                                                     value=models.Service.id)},
+                                 synchronize_session=False)
+        if updated == len(heartbeats):
+            return []
+        rows = session.query(models.Service.id).\
+                       filter(models.Service.id.in_(heartbeats.keys())).\
+                       filter_by(deleted=False).\
+                       all()
+    found = set(row[0] for row in rows)
+    return [service_id for service_id in heartbeats
+            if service_id not in found]
+
+
 ###################
 
 
@@ -1345,6 +1392,80 @@ def instance_get_all_by_filters(context, filters):
     return instances
 
 
+# Filters instance_get_page_by_filters matches exactly and by prefix.
+INSTANCE_EXACT_MATCH_FILTERS = ['project_id', 'user_id', 'image_ref',
+                                'vm_state', 'instance_type_id', 'deleted',
+                                'uuid', 'host', 'reservation_id']
+INSTANCE_PREFIX_FILTERS = ['display_name']
+_REGEXP_SPECIAL_CHARACTERS = set('.^$*+?{}[]\\|()')
+
+
+@require_context
+def instance_get_page_by_filters(context, filters, joins=None, marker=None,
+                                 limit=None):
+    """Return the page of instances after the marker that match all
+    filters, newest first.
+
+    Unlike instance_get_all_by_filters, only the relations named in joins
+    are loaded, and the filters, marker and limit are all done in SQL.
+    Filters that are plain strings match by prefix, the same as the
+    regular expressions of instance_get_all_by_filters. Other filters raise
+    InvalidInput.
+
+    """
+    session = get_session()
+    query = session.query(models.Instance)
+    for join in joins or []:
+        query = query.options(joinedload_all(join))
+
+    filters = filters.copy()
+    if 'changes-since' in filters:
+        query = query.filter(models.Instance.updated_at >
+                             filters.pop('changes-since'))
+
+    if not context.is_admin:
+        if context.project_id:
+            filters['project_id'] = context.project_id
+        else:
+            filters['user_id'] = context.user_id
+
+    for filter_name, value in filters.iteritems():
+        if filter_name in INSTANCE_EXACT_MATCH_FILTERS:
+            column = getattr(models.Instance, filter_name)
+            if isinstance(value, list):
+                query = query.filter(column.in_(value))
+            else:
+                query = query.filter(column == value)
+        elif (filter_name in INSTANCE_PREFIX_FILTERS and
+              not _REGEXP_SPECIAL_CHARACTERS.intersection(value)):
+            # A backslash escape needs doubling in MySQL string literals, so
+            # '!' is used instead.
+            prefix = value.replace('!', '!!').replace('%', '!%').\
+                           replace('_', '!_')
+            column = getattr(models.Instance, filter_name)
+            query = query.filter(column.like(prefix + '%', escape='!'))
+        else:
+            reason = _("%s can not be filtered in the database") % filter_name
+            raise exception.InvalidInput(reason=reason)
+
+    if marker is not None:
+        marker_ref = session.query(models.Instance.created_at).\
+                             filter_by(id=marker).\
+                             first()
+        if marker_ref is None:
+            raise exception.InstanceNotFound(instance_id=marker)
+        created_at = marker_ref[0]
+        query = query.filter(or_(models.Instance.created_at < created_at,
+                                 and_(models.Instance.created_at == created_at,
+                                      models.Instance.id < marker)))
+
+    query = query.order_by(desc(models.Instance.created_at),
+                           desc(models.Instance.id))
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
 @require_context
 def instance_get_active_by_window(context, begin, end=None, project_id=None):
     """Return instances that were continuously active over window."""
@@ -1412,6 +1533,47 @@ def instance_get_all_by_host(context, host):
                    all()
 
 
+@require_admin_context
+def instance_get_power_states(context, instance_ids):
+    if not instance_ids:
+        return {}
+    session = get_session()
+    rows = session.query(models.Instance.id, models.Instance.power_state).\
+                   filter(models.Instance.id.in_(instance_ids)).\
+                   filter_by(deleted=can_read_deleted(context)).\
+                   all()
+    return dict(rows)
+
+
+@require_admin_context
+def instance_get_power_states_by_host(context, host, slices=1, index=0,
+                                      instance_ids=None):
+    session = get_session()
+    query = session.query(models.Instance.id, models.Instance.power_state).\
+                    filter_by(host=host).\
+                    filter_by(deleted=can_read_deleted(context))
+    if slices > 1:
+        in_slice = models.Instance.id % slices == index
+        if instance_ids:
+            in_slice = or_(in_slice, models.Instance.id.in_(instance_ids))
+        query = query.filter(in_slice)
+    return dict(query.all())
+
+
+@require_admin_context
+def instance_update_power_states(context, power_states):
+    if not power_states:
+        return
+    session = get_session()
+    with session.begin():
+        session.query(models.Instance).\
+                filter(models.Instance.id.in_(power_states.keys())).\
+                update({'power_state': case(power_states.items(),
+                                            value=models.Instance.id),
+                        'updated_at': utils.utcnow()},
+                       synchronize_session=False)
+
+
 @require_context
 def instance_get_all_by_project(context, project_id):
     authorize_project_context(context, project_id)
@@ -19,7 +19,9 @@
 """Session Handling for SQLAlchemy backend."""
 
 import sqlalchemy.exc
+import sqlalchemy.interfaces
 import sqlalchemy.orm
+import sys
 import time
 
 import nova.exception
@@ -33,6 +35,23 @@ LOG = logging.getLogger("nova.db.sqlalchemy.session")
 _ENGINE = None
 _MAKER = None
 
+# Statements are counted against the outermost function of these modules
+# on the stack, or else the innermost of the sqlalchemy backend.
+DB_API_MODULES = ('nova.db.api', 'reddwarf.db.api')
+DB_BACKEND_MODULE = 'nova.db.sqlalchemy.api'
+
+
+class Session(sqlalchemy.orm.session.Session):
+    """Session which raises DBError for errors in queries and flushes."""
+
+    @nova.exception.wrap_db_error
+    def query(self, *args, **kwargs):
+        return super(Session, self).query(*args, **kwargs)
+
+    @nova.exception.wrap_db_error
+    def flush(self, *args, **kwargs):
+        return super(Session, self).flush(*args, **kwargs)
+
 
 def get_session(autocommit=True, expire_on_commit=False):
     """Return a SQLAlchemy session."""
@@ -42,10 +61,7 @@ def get_session(autocommit=True, expire_on_commit=False):
         _ENGINE = get_engine()
         _MAKER = get_maker(_ENGINE, autocommit, expire_on_commit)
 
-    session = _MAKER()
-    session.query = nova.exception.wrap_db_error(session.query)
-    session.flush = nova.exception.wrap_db_error(session.flush)
-    return session
+    return _MAKER()
 
 
 def get_engine():
@@ -59,6 +75,15 @@ def get_engine():
 
     if "sqlite" in connection_dict.drivername:
         engine_args["poolclass"] = sqlalchemy.pool.NullPool
+    else:
+        engine_args["pool_size"] = FLAGS.sql_max_pool_size
+        engine_args["max_overflow"] = FLAGS.sql_max_overflow
+        engine_args["pool_timeout"] = FLAGS.sql_pool_timeout
+        if FLAGS.sql_pool_pre_ping:
+            engine_args["listeners"] = [PingListener()]
+
+    if FLAGS.sql_instrument:
+        engine_args["proxy"] = InstrumentedProxy()
 
     engine = sqlalchemy.create_engine(FLAGS.sql_connection, **engine_args)
     ensure_connection(engine)
@@ -85,5 +110,95 @@ def ensure_connection(engine):
 def get_maker(engine, autocommit=True, expire_on_commit=False):
     """Return a SQLAlchemy sessionmaker using the given engine."""
     return sqlalchemy.orm.sessionmaker(bind=engine,
+                                       class_=Session,
                                        autocommit=autocommit,
                                        expire_on_commit=expire_on_commit)
+
+
+class PingListener(sqlalchemy.interfaces.PoolListener):
+    """Replaces pooled connections which the server has closed.
+
+    The pool tries another connection when a checkout raises
+    DisconnectionError.
+
+    """
+
+    def checkout(self, dbapi_con, con_record, con_proxy):
+        cursor = dbapi_con.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        except Exception:
+            LOG.info(_('Replacing a disconnected SQL connection.'))
+            raise sqlalchemy.exc.DisconnectionError()
+        finally:
+            cursor.close()
+
+
+class QueryStats(object):
+    """Counts the statements, their time and rows per db api function."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.functions = {}
+        self.slow_queries = 0
+
+    def record(self, function, elapsed, rows, statement):
+        stats = self.functions.get(function)
+        if stats is None:
+            stats = {'count': 0, 'time': 0.0, 'max_time': 0.0, 'rows': 0}
+            self.functions[function] = stats
+        stats['count'] += 1
+        stats['time'] += elapsed
+        stats['max_time'] = max(stats['max_time'], elapsed)
+        stats['rows'] += rows
+        if FLAGS.sql_slow_query_time and elapsed >= FLAGS.sql_slow_query_time:
+            self.slow_queries += 1
+            LOG.warning(_('Slow query in %(function)s took %(elapsed).3fs '
+                          'for %(rows)d rows: %(statement)s') % locals())
+
+    def get_stats(self):
+        return {'slow_queries': self.slow_queries,
+                'functions': dict((function, dict(stats)) for
+                                  function, stats in self.functions.items())}
+
+
+QUERY_STATS = QueryStats()
+
+
+def get_query_stats():
+    """Return the statement counters recorded while sql_instrument is set."""
+    return QUERY_STATS.get_stats()
+
+
+def reset_query_stats():
+    QUERY_STATS.reset()
+
+
+def _db_api_function():
+    """Return the name of the db api function running the statement."""
+    frame = sys._getframe(1)
+    function = None
+    backend_function = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__')
+        if module in DB_API_MODULES:
+            function = '%s.%s' % (module, frame.f_code.co_name)
+        elif module == DB_BACKEND_MODULE and backend_function is None:
+            backend_function = '%s.%s' % (module, frame.f_code.co_name)
+        frame = frame.f_back
+    return function or backend_function or 'unknown'
+
+
+class InstrumentedProxy(sqlalchemy.interfaces.ConnectionProxy):
+    """Records the time and row count of every statement in QUERY_STATS."""
+
+    def cursor_execute(self, execute, cursor, statement, parameters,
+                       context, executemany):
+        start = time.time()
+        try:
+            return execute(cursor, statement, parameters, context)
+        finally:
+            QUERY_STATS.record(_db_api_function(), time.time() - start,
+                               max(cursor.rowcount, 0), statement)
@@ -283,6 +283,8 @@ DEFINE_string('console_topic', 'console',
 DEFINE_string('scheduler_topic', 'scheduler',
               'the topic scheduler nodes listen on')
 DEFINE_string('volume_topic', 'volume', 'the topic volume nodes listen on')
+DEFINE_string('heartbeat_topic', 'heartbeat',
+              'the topic heartbeat collector nodes listen on')
 DEFINE_string('network_topic', 'network', 'the topic network nodes listen on')
 DEFINE_string('ajax_console_proxy_topic', 'ajax_proxy',
               'the topic ajax proxy nodes listen on')
@@ -359,6 +361,22 @@ DEFINE_integer('sql_idle_timeout',
               'timeout for idle sql database connections')
 DEFINE_integer('sql_max_retries', 12, 'sql connection attempts')
 DEFINE_integer('sql_retry_interval', 10, 'sql connection retry interval')
+DEFINE_integer('sql_max_pool_size', 5,
+               'maximum number of connections kept open in the sql pool')
+DEFINE_integer('sql_max_overflow', 10,
+               'number of connections opened beyond sql_max_pool_size when '
+               'the pool is exhausted')
+DEFINE_integer('sql_pool_timeout', 30,
+               'seconds to wait for a connection from the sql pool')
+DEFINE_bool('sql_pool_pre_ping', False,
+            'test sql connections when taken from the pool, replacing the '
+            'ones closed by the server')
+DEFINE_bool('sql_instrument', False,
+            'count the sql statements, their time and rows per db api '
+            'function')
+DEFINE_float('sql_slow_query_time', 1.0,
+             'log sql statements slower than this many seconds when '
+             'sql_instrument is set, 0 to disable')
 
 DEFINE_string('compute_manager', 'nova.compute.manager.ComputeManager',
               'Manager for compute')
@@ -41,17 +41,27 @@ def create_connection(new=True):
     return get_impl().create_connection(new=new)
 
 
-def call(context, topic, msg):
-    return get_impl().call(context, topic, msg)
+def call(context, topic, msg, timeout=None):
+    # Only pass the timeout on when it is given, as not every backend
+    # takes one.
+    if timeout is None:
+        return get_impl().call(context, topic, msg)
+    return get_impl().call(context, topic, msg, timeout)
 
 
 def cast(context, topic, msg):
     return get_impl().cast(context, topic, msg)
 
 
+def cast_many(context, messages, confirm=False):
+    return get_impl().cast_many(context, messages, confirm)
+
+
 def fanout_cast(context, topic, msg):
     return get_impl().fanout_cast(context, topic, msg)
 
 
-def multicall(context, topic, msg):
-    return get_impl().multicall(context, topic, msg)
+def multicall(context, topic, msg, timeout=None):
+    if timeout is None:
+        return get_impl().multicall(context, topic, msg)
+    return get_impl().multicall(context, topic, msg, timeout)
@@ -27,3 +27,8 @@ class RemoteError(exception.Error):
         super(RemoteError, self).__init__('%s %s\n%s' % (exc_type,
                                                          value,
                                                          traceback))
+
+
+class Timeout(exception.Error):
+    """Signifies that a reply to an rpc.call was not received in time."""
+    pass
@@ -600,6 +600,26 @@ def cast(context, topic, msg):
         publisher.close()
 
 
+def cast_many(context, messages, confirm=False):
+    """Sends each (topic, msg) pair without waiting for responses, all over
+    one connection.
+
+    Confirms are not supported by carrot and are ignored.
+
+    """
+    LOG.debug(_('Making %d asynchronous casts...'), len(messages))
+    with ConnectionPool.item() as conn:
+        publishers = {}
+        for topic, msg in messages:
+            _pack_context(msg, context)
+            if topic not in publishers:
+                publishers[topic] = TopicPublisher(connection=conn,
+                                                   topic=topic)
+            publishers[topic].send(msg)
+        for publisher in publishers.values():
+            publisher.close()
+
+
 def fanout_cast(context, topic, msg):
     """Sends a message on a fanout exchange without waiting for a response."""
     LOG.debug(_('Making asynchronous fanout cast...'))
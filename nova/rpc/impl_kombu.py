@@ -28,17 +28,37 @@ import uuid
 import eventlet
 from eventlet import greenpool
 from eventlet import pools
+from eventlet import queue
+from eventlet import semaphore
 import greenlet
 
 from nova import context
 from nova import exception
 from nova import flags
-from nova.rpc.common import RemoteError, LOG
+from nova.rpc.common import RemoteError, Timeout, LOG
 
 # Needed for tests
 eventlet.monkey_patch()
 
 FLAGS = flags.FLAGS
+flags.DEFINE_boolean('rpc_shared_reply_queue', False,
+                     'Receive the replies to all calls made by a process on '
+                     'one long lived queue, instead of declaring a queue for '
+                     'every call. Only set this once every service being '
+                     'called, guest agents included, replies to the queue '
+                     'named in the call, or calls to the others hang until '
+                     'rpc_response_timeout.')
+flags.DEFINE_integer('rpc_publisher_cache_size', 64,
+                     'Number of publishers each connection keeps to reuse '
+                     'for later messages to the same exchange. 0 disables '
+                     'the cache.')
+flags.DEFINE_integer('rpc_cast_many_window', 100,
+                     'Maximum number of messages cast_many publishes in one '
+                     'transaction before waiting for the broker to accept '
+                     'them, when confirms are requested.')
+flags.DEFINE_integer('rpc_response_timeout', 10 * 60,
+                     'Time in seconds to wait for each reply to a call on '
+                     'the shared reply queue.')
 
 
 class ConsumerBase(object):
@@ -289,11 +309,16 @@ class FanoutPublisher(Publisher):
                 **options)
 
 
+# Number of times a connection of this process reconnected to the broker.
+RECONNECTS = 0
+
+
 class Connection(object):
     """Connection object."""
 
     def __init__(self):
         self.consumers = []
+        self.publishers = {}
         self.consumer_thread = None
         self.max_retries = FLAGS.rabbit_max_retries
         # Try forever?
@@ -320,7 +345,9 @@ class Connection(object):
 
     def reconnect(self):
         """Handles reconnecting and re-estblishing queues"""
+        global RECONNECTS
         if self.connection:
+            RECONNECTS += 1
             try:
                 self.connection.close()
             except self.connection.connection_errors:
@@ -352,6 +379,7 @@ class Connection(object):
         # work around 'memory' transport bug in 1.1.3
         if self.memory_transport:
             self.channel._new_queue('ae.undeliver')
+        self.publishers = {}
         for consumer in self.consumers:
             consumer.reconnect(self.channel)
         if self.consumers:
@@ -379,12 +407,25 @@ class Connection(object):
     def reset(self):
         """Reset a connection so it can be used again"""
         self.cancel_consumer_thread()
-        self.channel.close()
+        if not self.consumers:
+            # Keep the channel, and the publishers declared on it. Should
+            # the broker have closed it, publisher_send opens a new one.
+            return
+        self.reopen_channel()
+        self.consumers = []
+
+    def reopen_channel(self):
+        """Replace the channel, dropping the publishers declared on it."""
+        try:
+            self.channel.close()
+        except (self.connection.connection_errors +
+                self.connection.channel_errors):
+            pass
         self.channel = self.connection.channel()
         # work around 'memory' transport bug in 1.1.3
         if self.memory_transport:
             self.channel._new_queue('ae.undeliver')
-        self.consumers = []
+        self.publishers = {}
 
     def declare_consumer(self, consumer_cls, topic, callback):
         """Create a Consumer using the class that was passed in and
@@ -424,22 +465,44 @@ class Connection(object):
                 pass
             self.consumer_thread = None
 
+    def get_publisher(self, cls, topic):
+        """Return a publisher for the topic, reusing one if it was already
+        declared on the current channel.
+        """
+        key = (cls, topic)
+        publisher = self.publishers.get(key)
+        if publisher is None:
+            publisher = cls(self.channel, topic)
+            if FLAGS.rpc_publisher_cache_size > 0:
+                if len(self.publishers) >= FLAGS.rpc_publisher_cache_size:
+                    self.publishers = {}
+                self.publishers[key] = publisher
+        return publisher
+
     def publisher_send(self, cls, topic, msg):
         """Send to a publisher based on the publisher class"""
+        channel_reopened = False
         while True:
-            publisher = None
             try:
-                publisher = cls(self.channel, topic)
-                publisher.send(msg)
+                self.get_publisher(cls, topic).send(msg)
                 return
             except self.connection.connection_errors, e:
                 LOG.exception(_('Failed to publish message %s' % str(e)))
                 try:
+                    # This also drops the publishers of the old channel.
                     self.reconnect()
-                    if publisher:
-                        publisher.reconnect(self.channel)
                 except self.connection.connection_errors, e:
                     pass
+            except self.connection.channel_errors, e:
+                # The broker closed the channel but kept the connection,
+                # so a new channel will do. Only try that once, as the
+                # error may come from the message rather than the channel.
+                if channel_reopened:
+                    raise
+                LOG.exception(_('Channel closed while publishing message '
+                                '%s' % str(e)))
+                self.reopen_channel()
+                channel_reopened = True
 
     def declare_direct_consumer(self, topic, callback):
         """Create a 'direct' queue.
@@ -468,6 +531,47 @@ class Connection(object):
         """Send a 'fanout' message"""
         self.publisher_send(FanoutPublisher, topic, msg)
 
+    def topic_send_many(self, messages, confirm=False):
+        """Send a list of (topic, msg) pairs over this connection.
+
+        With confirm set the messages are sent in transactions of at most
+        rpc_cast_many_window messages, each committed before the next is
+        started, so they are known to have reached the broker.
+        """
+        if not confirm or self.memory_transport:
+            # The memory transport has no transactions.
+            for topic, msg in messages:
+                self.topic_send(topic, msg)
+            return
+        window = max(FLAGS.rpc_cast_many_window, 1)
+        for start in xrange(0, len(messages), window):
+            self.topic_send_transaction(messages[start:start + window])
+
+    def topic_send_transaction(self, messages):
+        """Send the (topic, msg) pairs in one transaction, retrying all of
+        them if the connection fails before the commit.
+        """
+        while True:
+            # A channel can't leave transaction mode, so use a new one
+            # instead of the channel shared with the cached publishers.
+            channel = self.connection.channel()
+            try:
+                channel.tx_select()
+                publishers = {}
+                for topic, msg in messages:
+                    if topic not in publishers:
+                        publishers[topic] = TopicPublisher(channel, topic)
+                    publishers[topic].send(msg)
+                channel.tx_commit()
+                channel.close()
+                return
+            except self.connection.connection_errors, e:
+                LOG.exception(_('Failed to publish messages %s' % str(e)))
+                try:
+                    self.reconnect()
+                except self.connection.connection_errors, e:
+                    pass
+
     def consume(self, limit=None):
         """Consume from all queues/consumers"""
         it = self.iterconsume(limit=limit)
@@ -643,6 +747,7 @@ def _unpack_context(msg):
             value = msg.pop(key)
             context_dict[key[9:]] = value
     context_dict['msg_id'] = msg.pop('_msg_id', None)
+    context_dict['reply_q'] = msg.pop('_reply_q', None)
     LOG.debug(_('unpacked context: %s'), context_dict)
     return RpcContext.from_dict(context_dict)
 
@@ -666,11 +771,12 @@ class RpcContext(context.RequestContext):
     def __init__(self, *args, **kwargs):
         msg_id = kwargs.pop('msg_id', None)
         self.msg_id = msg_id
+        self.reply_q = kwargs.pop('reply_q', None)
         super(RpcContext, self).__init__(*args, **kwargs)
 
     def reply(self, *args, **kwargs):
         if self.msg_id:
-            msg_reply(self.msg_id, *args, **kwargs)
+            msg_reply(self.msg_id, *args, reply_q=self.reply_q, **kwargs)
 
 
 class MulticallWaiter(object):
@@ -709,23 +815,162 @@ class MulticallWaiter(object):
             yield result
 
 
+class ReplyQueue(object):
+    """A long lived queue receiving the replies to every call of a process.
+
+    A greenthread consumes the queue and hands each reply to the waiter of
+    the call with the reply's msg_id.
+
+    """
+
+    def __init__(self):
+        self.name = 'reply_%s' % uuid.uuid4().hex
+        self.waiters = {}
+        self.calls = 0
+        self.timeouts = 0
+        self.orphaned_replies = 0
+        self.connection = Connection()
+        self.connection.declare_direct_consumer(self.name, self._dispatch)
+        self.connection.consume_in_thread()
+
+    def _dispatch(self, data):
+        """The consume() callback will call this.  Route the reply."""
+        msg_id = data.pop('_msg_id', None)
+        waiter = self.waiters.get(msg_id)
+        if waiter is None:
+            # The call most likely timed out.
+            LOG.warn(_('No call waiting for reply to %s') % msg_id)
+            self.orphaned_replies += 1
+            return
+        waiter.put(data)
+
+    def wait_for(self, msg_id, timeout):
+        """Return an iterator of the replies to the call with the msg_id.
+
+        This must be called before the call is sent so no reply is missed.
+
+        """
+        self.calls += 1
+        self.waiters[msg_id] = queue.LightQueue()
+        return ReplyWaiter(self, msg_id, timeout)
+
+    def forget(self, msg_id):
+        """Stop waiting for replies to the call with the msg_id."""
+        self.waiters.pop(msg_id, None)
+
+    def get_metrics(self):
+        """Return the counts of outstanding and total calls, timeouts and
+        replies received after their call gave up."""
+        return {'outstanding': len(self.waiters),
+                'calls': self.calls,
+                'timeouts': self.timeouts,
+                'orphaned_replies': self.orphaned_replies}
+
+
+class ReplyWaiter(object):
+    """Iterates over the replies to one call on the shared reply queue.
+
+    The call is forgotten once the last reply arrives or on an error, and
+    otherwise when the waiter is closed or garbage collected, so a caller
+    that never iterates does not leave the call waiting forever.
+
+    """
+
+    def __init__(self, reply_queue, msg_id, timeout):
+        self._reply_queue = reply_queue
+        self._msg_id = msg_id
+        self._timeout = timeout
+        self._queue = reply_queue.waiters[msg_id]
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """Return a result until we get a 'None' response."""
+        if self._done:
+            raise StopIteration
+        try:
+            data = self._queue.get(timeout=self._timeout)
+        except queue.Empty:
+            self._reply_queue.timeouts += 1
+            self.close()
+            raise Timeout(_('Timed out waiting for a reply to %s')
+                          % self._msg_id)
+        if data['failure']:
+            self.close()
+            raise RemoteError(*data['failure'])
+        if data['result'] is None:
+            self.close()
+            raise StopIteration
+        return data['result']
+
+    def close(self):
+        if not self._done:
+            self._done = True
+            self._reply_queue.forget(self._msg_id)
+
+    def __del__(self):
+        self.close()
+
+
+# Created on the first call made with rpc_shared_reply_queue set.
+REPLY_QUEUE = None
+_REPLY_QUEUE_LOCK = semaphore.Semaphore()
+
+
+def _get_reply_queue():
+    global REPLY_QUEUE
+    with _REPLY_QUEUE_LOCK:
+        if REPLY_QUEUE is None:
+            REPLY_QUEUE = ReplyQueue()
+    return REPLY_QUEUE
+
+
+def get_reply_queue_metrics():
+    """Return the metrics of the shared reply queue, if it was created."""
+    if REPLY_QUEUE is None:
+        return None
+    return REPLY_QUEUE.get_metrics()
+
+
 def create_connection(new=True):
     """Create a connection"""
     return ConnectionContext(pooled=not new)
 
 
-def multicall(context, topic, msg):
-    """Make a call that returns multiple times."""
-    # Can't use 'with' for multicall, as it returns an iterator
-    # that will continue to use the connection.  When it's done,
-    # connection.close() will get called which will put it back into
-    # the pool
+def multicall(context, topic, msg, timeout=None):
+    """Make a call that returns multiple times.
+
+    With rpc_shared_reply_queue set, each reply must arrive within timeout
+    seconds, rpc_response_timeout by default, or Timeout is raised.
+
+    """
     LOG.debug(_('Making asynchronous call on %s ...'), topic)
     msg_id = uuid.uuid4().hex
     msg.update({'_msg_id': msg_id})
     LOG.debug(_('MSG_ID is %s') % (msg_id))
-    _pack_context(msg, context)
 
+    if FLAGS.rpc_shared_reply_queue:
+        reply_queue = _get_reply_queue()
+        msg.update({'_reply_q': reply_queue.name})
+        _pack_context(msg, context)
+        if timeout is None:
+            timeout = FLAGS.rpc_response_timeout
+        wait_msg = reply_queue.wait_for(msg_id, timeout)
+        try:
+            with ConnectionContext() as conn:
+                conn.topic_send(topic, msg)
+        except Exception:
+            wait_msg.close()
+            raise
+        return wait_msg
+
+    _pack_context(msg, context)
+    # Can't use 'with' for multicall, as it returns an iterator
+    # that will continue to use the connection.  When it's done,
+    # connection.close() will get called which will put it back into
+    # the pool
     conn = ConnectionContext()
     wait_msg = MulticallWaiter(conn)
     conn.declare_direct_consumer(msg_id, wait_msg)
@@ -734,9 +979,9 @@ def multicall(context, topic, msg):
     return wait_msg
 
 
-def call(context, topic, msg):
+def call(context, topic, msg, timeout=None):
     """Sends a message on a topic and wait for a response."""
-    rv = multicall(context, topic, msg)
+    rv = multicall(context, topic, msg, timeout)
     # NOTE(vish): return the last result from the multicall
     rv = list(rv)
     if not rv:
@@ -752,6 +997,21 @@ def cast(context, topic, msg):
         conn.topic_send(topic, msg)
 
 
+def cast_many(context, messages, confirm=False):
+    """Sends each (topic, msg) pair without waiting for responses, all over
+    one connection.
+
+    With confirm set, this only returns once the broker has accepted every
+    message.
+
+    """
+    LOG.debug(_('Making %d asynchronous casts...'), len(messages))
+    for topic, msg in messages:
+        _pack_context(msg, context)
+    with ConnectionContext() as conn:
+        conn.topic_send_many(messages, confirm)
+
+
 def fanout_cast(context, topic, msg):
     """Sends a message on a fanout exchange without waiting for a response."""
     LOG.debug(_('Making asynchronous fanout cast...'))
@@ -760,9 +1020,12 @@ def fanout_cast(context, topic, msg):
         conn.fanout_send(topic, msg)
 
 
-def msg_reply(msg_id, reply=None, failure=None):
+def msg_reply(msg_id, reply=None, failure=None, reply_q=None):
     """Sends a reply or an error on the channel signified by msg_id.
 
+    If the caller named a reply_q, the reply is sent there instead, tagged
+    with the msg_id.
+
     Failure should be a sys.exc_info() tuple.
 
     """
@@ -780,4 +1043,8 @@ def msg_reply(msg_id, reply=None, failure=None):
             msg = {'result': dict((k, repr(v))
                             for k, v in reply.__dict__.iteritems()),
                     'failure': failure}
-        conn.direct_send(msg_id, msg)
+        if reply_q:
+            msg['_msg_id'] = msg_id
+            conn.direct_send(reply_q, msg)
+        else:
+            conn.direct_send(msg_id, msg)
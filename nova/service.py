@@ -21,6 +21,7 @@
 
 import inspect
 import os
+import random
 
 import eventlet
 import greenlet
@@ -45,6 +46,16 @@ flags.DEFINE_integer('report_interval', 10,
 flags.DEFINE_integer('periodic_interval', 60,
                      'seconds between running periodic tasks',
                      lower_bound=1)
+flags.DEFINE_string('report_mode', 'atomic',
+                    'how nodes report state: "atomic" increments the report '
+                    'count in a single update, "collector" casts the report '
+                    'to the heartbeat collector which writes them in bulk, '
+                    'and "read_modify_write" reads the service first')
+flags.DEFINE_integer('report_jitter', 0,
+                     'up to this many seconds are randomly waited before '
+                     'each report so nodes started together do not report '
+                     'at once. report_interval plus report_jitter must stay '
+                     'below service_down_time')
 flags.DEFINE_string('ec2_listen', "0.0.0.0",
                     'IP address for EC2 API to listen')
 flags.DEFINE_integer('ec2_listen_port', 8773, 'port for ec2 api to listen')
@@ -252,19 +263,28 @@ class Service(object):
 
     def report_state(self):
         """Update the state of this service in the datastore."""
+        if FLAGS.report_jitter:
+            eventlet.sleep(random.uniform(0, FLAGS.report_jitter))
         ctxt = context.get_admin_context()
         try:
-            try:
-                service_ref = db.service_get(ctxt, self.service_id)
-            except exception.NotFound:
-                logging.debug(_('The service database object disappeared, '
-                                'Recreating it.'))
-                self._create_service_ref(ctxt)
-                service_ref = db.service_get(ctxt, self.service_id)
-
-            db.service_update(ctxt,
-                             self.service_id,
-                             {'report_count': service_ref['report_count'] + 1})
+            if FLAGS.report_mode == 'collector':
+                # The collector casts service_missing back to the node
+                # topic if the service row is gone.
+                rpc.cast(ctxt, FLAGS.heartbeat_topic,
+                         {'method': 'service_heartbeat',
+                          'args': {'service_id': self.service_id,
+                                   'topic': self.topic,
+                                   'host': self.host}})
+            elif FLAGS.report_mode == 'atomic':
+                try:
+                    db.service_heartbeat(ctxt, self.service_id)
+                except exception.NotFound:
+                    logging.debug(_('The service database object '
+                                    'disappeared, Recreating it.'))
+                    self._create_service_ref(ctxt)
+                    db.service_heartbeat(ctxt, self.service_id)
+            else:
+                self._read_modify_write_report_count(ctxt)
 
             # TODO(termie): make this pattern be more elegant.
             if getattr(self, 'model_disconnected', False):
@@ -277,6 +297,32 @@ class Service(object):
                 self.model_disconnected = True
                 logging.exception(_('model server went away'))
 
+    def service_missing(self, context, service_id):
+        """Recreates the service row the heartbeat collector found missing.
+
+        Heartbeats sent before the row was recreated still carry the old
+        id, so reports about it are ignored once it changed.
+
+        """
+        if service_id != self.service_id:
+            return
+        logging.debug(_('The service database object disappeared, '
+                        'Recreating it.'))
+        self._create_service_ref(context)
+
+    def _read_modify_write_report_count(self, ctxt):
+        try:
+            service_ref = db.service_get(ctxt, self.service_id)
+        except exception.NotFound:
+            logging.debug(_('The service database object disappeared, '
+                            'Recreating it.'))
+            self._create_service_ref(ctxt)
+            service_ref = db.service_get(ctxt, self.service_id)
+
+        db.service_update(ctxt,
+                         self.service_id,
+                         {'report_count': service_ref['report_count'] + 1})
+
 
 class WSGIService(object):
     """Provides ability to launch API from a 'paste' configuration."""
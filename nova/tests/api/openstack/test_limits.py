@@ -721,6 +721,81 @@ class LimiterTest(BaseLimitTestSuite):
         results = list(self._check(5, "PUT", "/anything", "user2"))
         self.assertEqual(expected, results)
 
+    def test_idle_users_are_evicted(self):
+        """
+        Ensure the state of a user is dropped once their buckets drain.
+        """
+        self.limiter.sweep_interval = 0
+        self.limiter.check_for_delay("PUT", "/anything", "user1")
+        self.assertTrue("user1" in self.limiter.levels)
+
+        self.time += 6.0
+        self.limiter.check_for_delay("PUT", "/anything", "user2")
+        self.assertFalse("user1" in self.limiter.levels)
+        self.assertTrue("user2" in self.limiter.levels)
+
+    def test_limited_users_are_kept(self):
+        """
+        Ensure the state of a user is kept while they are limited.
+        """
+        self.limiter.sweep_interval = 0
+        list(self._check(11, "PUT", "/anything", "user1"))
+        self.time += 1.0
+        self.limiter.check_for_delay("GET", "/anything", "user2")
+        self.assertTrue("user1" in self.limiter.levels)
+        self.assertEqual(5.0, self._check_sum(1, "PUT", "/anything", "user1"))
+
+    def test_user_limits_come_back_after_eviction(self):
+        """
+        Ensure an evicted user with their own limits gets them back.
+        """
+        self.limiter.sweep_interval = 0
+        self.limiter.check_for_delay("PUT", "/anything", "user1")
+        self.assertFalse("user3" in self.limiter.levels)
+        expected = [None] * 20
+        results = list(self._check(20, "PUT", "/anything", "user3"))
+        self.assertEqual(expected, results)
+
+
+class MemcacheLimiterTest(BaseLimitTestSuite):
+    """
+    Tests for the `limits.MemcacheLimiter` class.
+    """
+
+    def setUp(self):
+        """Run before each test."""
+        BaseLimitTestSuite.setUp(self)
+        self.limiter1 = limits.MemcacheLimiter(TEST_LIMITS)
+        self.limiter2 = limits.MemcacheLimiter(TEST_LIMITS)
+        # Both workers talk to the same cache.
+        self.limiter2.mc = self.limiter1.mc
+
+    def test_workers_share_limits(self):
+        """
+        Ensure the 11th PUT is delayed when the first 10 are spread over
+        two workers.
+        """
+        for i in xrange(5):
+            self.assertEqual((None, None),
+                             self.limiter1.check_for_delay("PUT", "/a"))
+            self.assertEqual((None, None),
+                             self.limiter2.check_for_delay("PUT", "/a"))
+        delay, error = self.limiter1.check_for_delay("PUT", "/a")
+        self.assertEqual(6.0, delay)
+
+        self.time += 6.0
+        self.assertEqual((None, None),
+                         self.limiter2.check_for_delay("PUT", "/a"))
+
+    def test_users_are_limited_separately(self):
+        self.limiter1.check_for_delay("GET", "/delayed", "user1")
+        delay, error = self.limiter2.check_for_delay("GET", "/delayed",
+                                                     "user1")
+        self.assertEqual(60.0, delay)
+        delay, error = self.limiter2.check_for_delay("GET", "/delayed",
+                                                     "user2")
+        self.assertEqual(None, delay)
+
 
 class WsgiLimiterTest(BaseLimitTestSuite):
     """
@@ -1051,3 +1126,60 @@ class LimitsXMLSerializationTest(test.TestCase):
         """.replace("  ", ""))
 
         self.assertEqual(expected.toxml(), actual.toxml())
+
+
+class CountingLimit(limits.Limit):
+    """A `limits.Limit` which counts the times it is checked."""
+
+    calls = 0
+
+    def __call__(self, verb, url):
+        CountingLimit.calls += 1
+        return limits.Limit.__call__(self, verb, url)
+
+
+class ScanningLimiter(limits.Limiter):
+    """Checks every limit on each request, as before they were indexed."""
+
+    def _get_verb_limits(self, username, verb):
+        return list(enumerate(self._get_levels(username)))
+
+
+class LimitMiddlewareCheckCountTest(BaseLimitTestSuite):
+    """
+    Counts the limits `limits.RateLimitingMiddleware` checks per request
+    with a hundred limits spread over four verbs.
+    """
+
+    @webob.dec.wsgify
+    def _empty_app(self, request):
+        """Do-nothing WSGI app."""
+        pass
+
+    def _limits(self):
+        return [CountingLimit(verb, "/path%d" % i, "^/path%d" % i, 100000,
+                              limits.PER_MINUTE)
+                for i in xrange(25)
+                for verb in ("GET", "POST", "PUT", "DELETE")]
+
+    def _run(self, limiter, requests=2000):
+        app = limits.RateLimitingMiddleware(self._empty_app)
+        app._limiter = limiter
+        CountingLimit.calls = 0
+        for i in xrange(requests):
+            request = webob.Request.blank("/path%d" % (i % 25))
+            request.environ["nova.context"] = nova.context.RequestContext(
+                    "user%d" % (i % 50), "project")
+            response = request.get_response(app)
+            self.assertEqual(200, response.status_int)
+        return CountingLimit.calls / requests
+
+    def test_scanning_checks_every_limit(self):
+        self.assertEqual(100, self._run(ScanningLimiter(self._limits())))
+
+    def test_index_checks_limits_of_the_verb(self):
+        self.assertEqual(25, self._run(limits.Limiter(self._limits())))
+
+    def test_memcache_checks_limits_of_the_verb(self):
+        limiter = limits.MemcacheLimiter(self._limits())
+        self.assertEqual(1, self._run(limiter))
@@ -965,6 +965,54 @@ class ComputeTestCase(test.TestCase):
         self.assertEqual(len(instances), 1)
         self.assertEqual(power_state.NOSTATE, instances[0]['power_state'])
 
+    def test_prefetch_image_asks_the_scheduler(self):
+        """Prefetching an image is cast to the scheduler"""
+        self.mox.StubOutWithMock(rpc, 'cast')
+        rpc.cast(self.context, FLAGS.scheduler_topic,
+                 {'method': 'prefetch_image',
+                  'args': {'topic': FLAGS.compute_topic,
+                           'image_ref': 1,
+                           'memory_mb': 512,
+                           'count': 3}})
+        self.mox.ReplayAll()
+        self.compute_api.prefetch_image(self.context, 1, {'memory_mb': 512},
+                                        count=3)
+
+    def test_incremental_power_state_sync(self):
+        """Changed instances are synced at once and the rest by slice"""
+        self.flags(power_state_sync_incremental=True,
+                   power_state_sync_slices=2)
+        c = context.get_admin_context()
+        instance_id = self._create_instance({'id': 20})
+        self.compute.run_instance(self.context, instance_id)
+        stats = self.compute.power_state_sync_stats
+
+        # The first sync checks every instance.
+        self.compute._sync_power_states_incremental(c)
+        self.assertEqual(1, stats['checked'])
+        self.assertEqual(0, stats['drifted'])
+
+        # A change made in the database waits for the instance's slice.
+        db.instance_update(c, instance_id,
+                           {'power_state': power_state.SHUTDOWN})
+        self.compute._sync_power_states_incremental(c)
+        self.assertEqual(0, stats['checked'])
+        self.assertEqual(power_state.SHUTDOWN,
+                         db.instance_get(c, instance_id)['power_state'])
+        self.compute._sync_power_states_incremental(c)
+        self.assertEqual(1, stats['drifted'])
+        self.assertEqual(power_state.RUNNING,
+                         db.instance_get(c, instance_id)['power_state'])
+
+        # A change on the hypervisor is synced by the next task.
+        instance_name = db.instance_get(c, instance_id)['name']
+        self.compute.driver.test_remove_vm(instance_name)
+        self.compute._sync_power_states_incremental(c)
+        self.assertEqual(1, stats['drifted'])
+        self.assertEqual(2, stats['total_drifted'])
+        self.assertEqual(power_state.NOSTATE,
+                         db.instance_get(c, instance_id)['power_state'])
+
     def test_get_all_by_name_regexp(self):
         """Test searching instances by name (display_name)"""
         c = context.get_admin_context()
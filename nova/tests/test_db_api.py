@@ -21,7 +21,9 @@
 from nova import test
 from nova import context
 from nova import db
+from nova import exception
 from nova import flags
+from nova import utils
 
 FLAGS = flags.FLAGS
 
@@ -96,6 +98,52 @@ class DbApiTestCase(test.TestCase):
         self.assertEqual(result[1].id, inst1.id)
         self.assertTrue(result[1].deleted)
 
+    def test_instance_get_page_by_filters(self):
+        args = {'reservation_id': 'a', 'image_ref': 1, 'host': 'host1'}
+        inst1 = db.instance_create(self.context, args)
+        inst2 = db.instance_create(self.context, args)
+        inst3 = db.instance_create(self.context, args)
+        result = db.instance_get_page_by_filters(self.context, {}, limit=2)
+        self.assertEqual([inst3.id, inst2.id], [i.id for i in result])
+        result = db.instance_get_page_by_filters(self.context, {},
+                                                 marker=inst2.id)
+        self.assertEqual([inst1.id], [i.id for i in result])
+
+    def test_instance_get_page_by_filters_prefix(self):
+        db.instance_create(self.context, {'display_name': 'web_1'})
+        db.instance_create(self.context, {'display_name': 'webby'})
+        db.instance_create(self.context, {'display_name': 'db'})
+        result = db.instance_get_page_by_filters(self.context,
+                                                 {'display_name': 'web'})
+        self.assertEqual(2, len(result))
+        result = db.instance_get_page_by_filters(self.context,
+                                                 {'display_name': 'web_'})
+        self.assertEqual(['web_1'], [i.display_name for i in result])
+
+    def test_instance_get_page_by_filters_prefix_escapes(self):
+        db.instance_create(self.context, {'display_name': 'a!%b'})
+        db.instance_create(self.context, {'display_name': 'a!xb'})
+        db.instance_create(self.context, {'display_name': u'caf\xe9 1'})
+        result = db.instance_get_page_by_filters(self.context,
+                                                 {'display_name': 'a!%'})
+        self.assertEqual(['a!%b'], [i.display_name for i in result])
+        result = db.instance_get_page_by_filters(self.context,
+                                                 {'display_name': u'caf\xe9'})
+        self.assertEqual([u'caf\xe9 1'], [i.display_name for i in result])
+
+    def test_instance_get_page_by_filters_invalid(self):
+        self.assertRaises(exception.InvalidInput,
+                          db.instance_get_page_by_filters,
+                          self.context, {'display_name': 'web.*'})
+        self.assertRaises(exception.InvalidInput,
+                          db.instance_get_page_by_filters,
+                          self.context, {'ip': '10.0.0.1'})
+
+    def test_instance_get_page_by_filters_bad_marker(self):
+        self.assertRaises(exception.InstanceNotFound,
+                          db.instance_get_page_by_filters,
+                          self.context, {}, marker=12345)
+
     def test_network_create_safe(self):
         ctxt = context.get_admin_context()
         values = {'host': 'localhost', 'project_id': 'project1'}
@@ -104,3 +152,55 @@ class DbApiTestCase(test.TestCase):
         self.assertEqual(36, len(network.uuid))
         db_network = db.network_get(ctxt, network.id)
         self.assertEqual(network.uuid, db_network.uuid)
+
+
+class ServiceHeartbeatTestCase(test.TestCase):
+    def setUp(self):
+        super(ServiceHeartbeatTestCase, self).setUp()
+        self.context = context.get_admin_context()
+
+    def _create_service(self, host):
+        return db.service_create(self.context, {'host': host,
+                                                'binary': 'nova-fake',
+                                                'topic': 'fake',
+                                                'report_count': 0})
+
+    def test_service_heartbeat(self):
+        service = self._create_service('host1')
+        db.service_heartbeat(self.context, service['id'])
+        db.service_heartbeat(self.context, service['id'])
+        service = db.service_get(self.context, service['id'])
+        self.assertEqual(2, service['report_count'])
+        self.assertNotEqual(None, service['updated_at'])
+
+    def test_service_heartbeat_missing_service(self):
+        self.assertRaises(exception.ServiceNotFound,
+                          db.service_heartbeat, self.context, 99)
+
+    def test_service_heartbeat_many(self):
+        service1 = self._create_service('host1')
+        service2 = self._create_service('host2')
+        received1 = utils.parse_strtime("2012-01-01T00:00:01.000000")
+        received2 = utils.parse_strtime("2012-01-01T00:00:02.000000")
+        db.service_heartbeat_many(self.context,
+                                  {service1['id']: (3, received1),
+                                   service2['id']: (1, received2)})
+        service1 = db.service_get(self.context, service1['id'])
+        service2 = db.service_get(self.context, service2['id'])
+        self.assertEqual(3, service1['report_count'])
+        self.assertEqual(received1, service1['updated_at'])
+        self.assertEqual(1, service2['report_count'])
+        self.assertEqual(received2, service2['updated_at'])
+
+    def test_service_heartbeat_many_missing_services(self):
+        service1 = self._create_service('host1')
+        service2 = self._create_service('host2')
+        db.service_destroy(self.context, service2['id'])
+        received = utils.parse_strtime("2012-01-01T00:00:01.000000")
+        missing = db.service_heartbeat_many(self.context,
+                                            {service1['id']: (1, received),
+                                             service2['id']: (1, received),
+                                             99: (1, received)})
+        self.assertEqual(set([service2['id'], 99]), set(missing))
+        service1 = db.service_get(self.context, service1['id'])
+        self.assertEqual(1, service1['report_count'])
@@ -0,0 +1,96 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2010 United States Government as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Unit tests for the SQLAlchemy session handling"""
+
+from nova import context
+from nova import db
+from nova import exception
+from nova import test
+from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy import session
+
+
+class SessionTestCase(test.TestCase):
+
+    def test_query_errors_are_wrapped(self):
+        db_session = session.get_session()
+        self.assertRaises(exception.DBError, db_session.query, object())
+
+    def test_sessions_share_the_session_class(self):
+        self.assertTrue(isinstance(session.get_session(), session.Session))
+
+
+class QueryStatsTestCase(test.TestCase):
+
+    def setUp(self):
+        super(QueryStatsTestCase, self).setUp()
+        self.flags(sql_slow_query_time=1.0)
+        self.stats = session.QueryStats()
+
+    def test_record(self):
+        self.stats.record('nova.db.api.f', 0.5, 2, 'SELECT 1')
+        self.stats.record('nova.db.api.f', 0.25, 1, 'SELECT 1')
+        self.assertEqual({'slow_queries': 0,
+                          'functions': {'nova.db.api.f': {'count': 2,
+                                                          'time': 0.75,
+                                                          'max_time': 0.5,
+                                                          'rows': 3}}},
+                         self.stats.get_stats())
+
+    def test_slow_queries_are_counted(self):
+        self.stats.record('nova.db.api.f', 2.0, 0, 'SELECT 1')
+        self.assertEqual(1, self.stats.get_stats()['slow_queries'])
+
+    def test_slow_query_log_can_be_disabled(self):
+        self.flags(sql_slow_query_time=0)
+        self.stats.record('nova.db.api.f', 2.0, 0, 'SELECT 1')
+        self.assertEqual(0, self.stats.get_stats()['slow_queries'])
+
+    def test_reset(self):
+        self.stats.record('nova.db.api.f', 2.0, 0, 'SELECT 1')
+        self.stats.reset()
+        self.assertEqual({'slow_queries': 0, 'functions': {}},
+                         self.stats.get_stats())
+
+
+class InstrumentationTestCase(test.TestCase):
+
+    def setUp(self):
+        super(InstrumentationTestCase, self).setUp()
+        self.flags(sql_instrument=True)
+        engine = session.get_engine()
+        self.stubs.Set(session, '_ENGINE', engine)
+        self.stubs.Set(session, '_MAKER', session.get_maker(engine))
+        self.stubs.Set(session, 'QUERY_STATS', session.QueryStats())
+        self.context = context.get_admin_context()
+
+    def test_statements_are_counted_per_db_api_function(self):
+        db.service_create(self.context, {'host': 'host1',
+                                         'binary': 'nova-fake',
+                                         'topic': 'fake'})
+        db.service_get_all(self.context)
+        functions = session.get_query_stats()['functions']
+        self.assertEqual(1, functions['nova.db.api.service_get_all']['count'])
+        self.assertTrue('nova.db.api.service_create' in functions)
+
+    def test_statements_outside_the_db_api_are_unknown(self):
+        db_session = session.get_session()
+        db_session.query(models.Service).all()
+        functions = session.get_query_stats()['functions']
+        self.assertEqual(['unknown'], functions.keys())
@@ -15,8 +15,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
 import mox
+import os
+import shutil
+import tempfile
 import __builtin__
+from nova import context
 from nova import exception
 from nova import flags
 from nova import test
@@ -50,6 +55,12 @@ VZLIST = "\t1001\n\t%d\n\t1003\n\t1004\n" % (INSTANCE['id'],)
 
 VZNAME = """\tinstance-00001001\n"""
 
+VZINFO = """      1001 instance-00001001 stopped          -         -   -
+      %d %s running        100    131072   2
+      1003 instance-00001003 running         10        -   -
+      1004 -                 running         10        -   -
+""" % (INSTANCE['id'], INSTANCE['name'])
+
 VZNAMES = """\tinstance-00001001\n\t%s
               \tinstance-00001003\n\tinstance-00001004\n""" % (
     INSTANCE['name'],)
@@ -283,6 +294,8 @@ MEM_PAGES = 131072
 
 VCPUS = 2
 
+SETTINGS = mox.IsA(openvz_conn.OVZSettings)
+
 class OpenVzConnTestCase(test.TestCase):
     def setUp(self):
         super(OpenVzConnTestCase, self).setUp()
@@ -300,29 +313,52 @@ class OpenVzConnTestCase(test.TestCase):
 
     def test_list_instances_detail_success(self):
         # Testing happy path of OpenVzConnection.list_instances()
-        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
-        openvz_conn.utils.execute('vzlist', '--all', '-o', 'name', '-H',
-                                  run_as_root=True).AndReturn((VZNAMES, None))
         conn = openvz_conn.OpenVzConnection(False)
-        self.mox.StubOutWithMock(conn, 'get_info')
-        conn.get_info(mox.IgnoreArg()).MultipleTimes().AndReturn(GOODSTATUS)
+        self.mox.StubOutWithMock(conn, 'get_info_all')
+        conn.get_info_all().AndReturn({INSTANCE['name']: GOODSTATUS})
 
         # Start test
         self.mox.ReplayAll()
 
         vzs = conn.list_instances_detail()
         self.assertEqual(vzs.__class__, list)
+        self.assertEqual(INSTANCE['name'], vzs[0].name)
+        self.assertEqual(power_state.RUNNING, vzs[0].state)
 
-    def test_list_instances_detail_failure(self):
+    def test_get_info_all_success(self):
+        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
+        openvz_conn.utils.execute('vzlist', '--all', '-H', '-o',
+                                  openvz_conn.VZLIST_INFO_FIELDS,
+                                  run_as_root=True).AndReturn((VZINFO, None))
+        self.mox.StubOutWithMock(openvz_conn.db, 'instance_get_power_states')
+        openvz_conn.db.instance_get_power_states(mox.IgnoreArg(),
+                                                 [1001, INSTANCE['id'], 1003])\
+            .AndReturn({1001: power_state.RUNNING,
+                        INSTANCE['id']: power_state.RUNNING})
+        conn = openvz_conn.OpenVzConnection(False)
+        self.mox.ReplayAll()
+        infos = conn.get_info_all()
+        self.assertEqual(['instance-00001001', INSTANCE['name']],
+                         sorted(infos.keys()))
+        self.assertEqual(power_state.SHUTDOWN,
+                         infos['instance-00001001']['state'])
+        self.assertEqual({'state': power_state.RUNNING,
+                          'max_mem': MEMORYMB * 1024,
+                          'mem': 100 * 4,
+                          'num_cpu': VCPUS,
+                          'cpu_time': 0}, infos[INSTANCE['name']])
+
+    def test_get_info_all_failure(self):
         self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
-        openvz_conn.utils.execute('vzlist', '--all', '-o', 'name', '-H',
-                                   run_as_root=True) \
+        openvz_conn.utils.execute('vzlist', '--all', '-H', '-o',
+                                  openvz_conn.VZLIST_INFO_FIELDS,
+                                  run_as_root=True) \
                                   .AndRaise(exception.ProcessExecutionError)
         conn = openvz_conn.OpenVzConnection(False)
 
         self.mox.ReplayAll()
 
-        self.assertRaises(exception.Error, conn.list_instances_detail)
+        self.assertRaises(exception.Error, conn.get_info_all)
 
     def test_start_success(self):
         # Testing happy path :-D
@@ -355,7 +391,7 @@ class OpenVzConnTestCase(test.TestCase):
     def test_set_onboot_success(self):
         self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
         openvz_conn.utils.execute('vzctl', 'set', INSTANCE['id'],
-                                  '--onboot', 'no', '--save',
+                                  '--save', '--onboot', 'no',
                                   run_as_root=True)\
                                   .AndReturn(('', ''))
         self.mox.ReplayAll()
@@ -365,7 +401,7 @@ class OpenVzConnTestCase(test.TestCase):
     def test_set_onboot_failure(self):
         self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
         openvz_conn.utils.execute('vzctl', 'set', INSTANCE['id'],
-                                  '--onboot', 'no', '--save',
+                                  '--save', '--onboot', 'no',
                                   run_as_root=True)\
                                   .AndRaise(exception.ProcessExecutionError)
         self.mox.ReplayAll()
@@ -552,22 +588,23 @@ class OpenVzConnTestCase(test.TestCase):
         conn._percent_of_resource(FAKE_INST_TYPE['memory_mb'])\
             .AndReturn(RES_PERCENT)
         self.mox.StubOutWithMock(conn, '_set_vmguarpages')
-        conn._set_vmguarpages(INSTANCE, MEM_PAGES)
+        conn._set_vmguarpages(INSTANCE, MEM_PAGES, SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_privvmpages')
-        conn._set_privvmpages(INSTANCE, MEM_PAGES)
+        conn._set_privvmpages(INSTANCE, MEM_PAGES, SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_kmemsize')
         conn._set_kmemsize(INSTANCE,
-            ((FAKE_INST_TYPE['memory_mb'] * 1024) * 1024))
+            ((FAKE_INST_TYPE['memory_mb'] * 1024) * 1024), SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_cpuunits')
-        conn._set_cpuunits(INSTANCE, RES_PERCENT)
+        conn._set_cpuunits(INSTANCE, RES_PERCENT, SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_cpulimit')
-        conn._set_cpulimit(INSTANCE, RES_PERCENT)
+        conn._set_cpulimit(INSTANCE, RES_PERCENT, SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_cpus')
-        conn._set_cpus(INSTANCE, FAKE_INST_TYPE['vcpus'])
+        conn._set_cpus(INSTANCE, FAKE_INST_TYPE['vcpus'],
+                      settings=SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_ioprio')
-        conn._set_ioprio(INSTANCE, RES_PERCENT)
+        conn._set_ioprio(INSTANCE, RES_PERCENT, SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_diskspace')
-        conn._set_diskspace(INSTANCE, FAKE_INST_TYPE)
+        conn._set_diskspace(INSTANCE, FAKE_INST_TYPE, SETTINGS)
         self.mox.ReplayAll()
         conn._set_instance_size(INSTANCE)
 
@@ -583,25 +620,112 @@ class OpenVzConnTestCase(test.TestCase):
         conn._percent_of_resource(FAKE_INST_TYPE['memory_mb'])\
         .AndReturn(RES_PERCENT)
         self.mox.StubOutWithMock(conn, '_set_vmguarpages')
-        conn._set_vmguarpages(INSTANCE, MEM_PAGES)
+        conn._set_vmguarpages(INSTANCE, MEM_PAGES, SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_privvmpages')
-        conn._set_privvmpages(INSTANCE, MEM_PAGES)
+        conn._set_privvmpages(INSTANCE, MEM_PAGES, SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_kmemsize')
         conn._set_kmemsize(INSTANCE,
-            ((FAKE_INST_TYPE['memory_mb'] * 1024) * 1024))
+            ((FAKE_INST_TYPE['memory_mb'] * 1024) * 1024), SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_cpuunits')
-        conn._set_cpuunits(INSTANCE, RES_PERCENT)
+        conn._set_cpuunits(INSTANCE, RES_PERCENT, SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_cpulimit')
-        conn._set_cpulimit(INSTANCE, RES_PERCENT)
+        conn._set_cpulimit(INSTANCE, RES_PERCENT, SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_cpus')
-        conn._set_cpus(INSTANCE, FAKE_INST_TYPE['vcpus'])
+        conn._set_cpus(INSTANCE, FAKE_INST_TYPE['vcpus'],
+                      settings=SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_ioprio')
-        conn._set_ioprio(INSTANCE, RES_PERCENT)
+        conn._set_ioprio(INSTANCE, RES_PERCENT, SETTINGS)
         self.mox.StubOutWithMock(conn, '_set_diskspace')
-        conn._set_diskspace(INSTANCE, FAKE_INST_TYPE)
+        conn._set_diskspace(INSTANCE, FAKE_INST_TYPE, SETTINGS)
         self.mox.ReplayAll()
         conn._set_instance_size(INSTANCE, FAKE_INST_TYPE['id'])
 
+    def test_set_instance_size_in_one_command(self):
+        self.mox.StubOutWithMock(openvz_conn.instance_types,
+                                 'get_instance_type')
+        openvz_conn.instance_types.get_instance_type(
+            INSTANCE['instance_type_id']).AndReturn(FAKE_INST_TYPE)
+        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
+        openvz_conn.utils.execute('vzctl', 'set', INSTANCE['id'], '--save',
+                                  '--vmguarpages', mox.IgnoreArg(),
+                                  '--privvmpages', mox.IgnoreArg(),
+                                  '--kmemsize', mox.IgnoreArg(),
+                                  '--cpuunits', mox.IgnoreArg(),
+                                  '--cpulimit', mox.IgnoreArg(),
+                                  '--cpus', mox.IgnoreArg(),
+                                  '--ioprio', mox.IgnoreArg(),
+                                  '--diskspace', '40G:44G',
+                                  run_as_root=True).AndReturn(('', None))
+        conn = openvz_conn.OpenVzConnection(False)
+        conn.utility = UTILITY
+        self.mox.StubOutWithMock(conn, '_percent_of_resource')
+        conn._percent_of_resource(FAKE_INST_TYPE['memory_mb'])\
+            .AndReturn(RES_PERCENT)
+        self.mox.ReplayAll()
+        conn._set_instance_size(INSTANCE)
+
+    def test_settings_apply_in_one_command(self):
+        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
+        openvz_conn.utils.execute('vzctl', 'set', INSTANCE['id'], '--save',
+                                  '--name', INSTANCE['name'],
+                                  '--onboot', 'no',
+                                  run_as_root=True).AndReturn(('', None))
+        self.mox.ReplayAll()
+        settings = openvz_conn.OVZSettings(INSTANCE['id'])
+        settings.set('--name', 'old-name')
+        settings.set('--onboot', 'no')
+        settings.set('--name', INSTANCE['name'])
+        settings.apply()
+        # Nothing is left to save.
+        settings.apply()
+
+    def test_settings_apply_failure(self):
+        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
+        openvz_conn.utils.execute('vzctl', 'set', INSTANCE['id'], '--save',
+                                  '--cpus', VCPUS, '--ioprio', 3,
+                                  run_as_root=True)\
+                                  .AndRaise(exception.ProcessExecutionError)
+        self.mox.ReplayAll()
+        settings = openvz_conn.OVZSettings(INSTANCE['id'])
+        settings.set('--cpus', VCPUS, 'Unable to set cpus')
+        settings.set('--ioprio', 3, 'Unable to set IO priority')
+        try:
+            settings.apply()
+            self.fail('The settings were applied')
+        except exception.Error as err:
+            self.assertTrue('Unable to set cpus' in str(err))
+            self.assertTrue('Unable to set IO priority' in str(err))
+
+    def test_spawn_settings_retry_without_onboot(self):
+        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
+        openvz_conn.utils.execute('vzctl', 'set', INSTANCE['id'], '--save',
+                                  '--name', INSTANCE['name'],
+                                  '--onboot', 'no',
+                                  run_as_root=True)\
+                                  .AndRaise(exception.ProcessExecutionError)
+        openvz_conn.utils.execute('vzctl', 'set', INSTANCE['id'], '--save',
+                                  '--name', INSTANCE['name'],
+                                  run_as_root=True).AndReturn(('', None))
+        self.mox.ReplayAll()
+        conn = openvz_conn.OpenVzConnection(False)
+        settings = openvz_conn.OVZSettings(INSTANCE['id'])
+        settings.set('--name', INSTANCE['name'])
+        settings.set('--onboot', 'no')
+        conn._apply_spawn_settings(INSTANCE, settings)
+
+    def test_spawn_settings_failure_without_onboot(self):
+        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
+        openvz_conn.utils.execute('vzctl', 'set', INSTANCE['id'], '--save',
+                                  '--name', INSTANCE['name'],
+                                  run_as_root=True)\
+                                  .AndRaise(exception.ProcessExecutionError)
+        self.mox.ReplayAll()
+        conn = openvz_conn.OpenVzConnection(False)
+        settings = openvz_conn.OVZSettings(INSTANCE['id'])
+        settings.set('--name', INSTANCE['name'])
+        self.assertRaises(exception.Error, conn._apply_spawn_settings,
+                          INSTANCE, settings)
+
     def test_set_vmguarpages_success(self):
         self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
         openvz_conn.utils.execute('vzctl', 'set', INSTANCE['id'], '--save',
@@ -1046,10 +1170,25 @@ class OpenVzConnTestCase(test.TestCase):
         ifaces._add_netif(INTERFACEINFO[0]['id'],
                           mox.IgnoreArg(),
                           mox.IgnoreArg(),
-                          mox.IgnoreArg()).MultipleTimes()
+                          mox.IgnoreArg(),
+                          SETTINGS).MultipleTimes()
         self.mox.StubOutWithMock(ifaces, '_set_nameserver')
-        ifaces._set_nameserver(INTERFACEINFO[0]['id'], INTERFACEINFO[0]['dns'])
+        ifaces._set_nameserver(INTERFACEINFO[0]['id'], INTERFACEINFO[0]['dns'],
+                               SETTINGS)
+        self.mox.ReplayAll()
+        ifaces.add()
+
+    def test_ovz_network_interfaces_add_in_one_command(self):
+        self.flags(ovz_use_veth_devs=False)
+        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
+        openvz_conn.utils.execute('vzctl', 'set', INTERFACEINFO[0]['id'],
+                                  '--save',
+                                  '--ipadd', INTERFACEINFO[0]['address'],
+                                  '--ipadd', INTERFACEINFO[1]['address'],
+                                  '--nameserver', INTERFACEINFO[1]['dns'],
+                                  run_as_root=True).AndReturn(('', ''))
         self.mox.ReplayAll()
+        ifaces = openvz_conn.OVZNetworkInterfaces(INTERFACEINFO)
         ifaces.add()
 
     def test_ovz_network_interfaces_add_ip_success(self):
@@ -1119,3 +1258,164 @@ class OpenVzConnTestCase(test.TestCase):
         ifaces = openvz_conn.OVZNetworkInterfaces(INTERFACEINFO)
         self.assertRaises(exception.Error, ifaces._set_nameserver,
                           INTERFACEINFO[0]['id'], INTERFACEINFO[0]['dns'])
+
+
+class FakeImageService(object):
+    """Writes fake templates of the given size, counting the downloads."""
+
+    def __init__(self, size=16, checksum=None):
+        self.size = size
+        self.checksum = checksum
+        self.downloads = 0
+
+    def fetch(self, context, image_ref, path, user_id, project_id):
+        self.downloads += 1
+        data = 'x' * self.size
+        with open(path, 'wb') as image_file:
+            image_file.write(data)
+        return {'checksum': self.checksum or hashlib.md5(data).hexdigest()}
+
+
+class OVZImageCacheTestCase(test.TestCase):
+    def setUp(self):
+        super(OVZImageCacheTestCase, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.images = FakeImageService()
+        self.stubs.Set(openvz_conn.images, 'fetch', self.images.fetch)
+        self.context = context.RequestContext('fake', 'fake')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super(OVZImageCacheTestCase, self).tearDown()
+
+    def _age(self, cache, image_ref, mtime):
+        os.utime(cache.path(image_ref), (mtime, mtime))
+
+    def _templates(self):
+        return sorted(name for name in os.listdir(self.cache_dir)
+                      if not name.startswith('.'))
+
+    def test_image_is_downloaded_once(self):
+        cache = openvz_conn.OVZImageCache(self.cache_dir, 0)
+        self.assertTrue(cache.fetch(self.context, 1))
+        self.assertFalse(cache.fetch(self.context, 1))
+        self.assertEqual(1, self.images.downloads)
+        self.assertEqual({'hits': 1, 'misses': 1, 'evictions': 0},
+                         cache.get_stats())
+        self.assertEqual(['1.tar.gz'], self._templates())
+
+    def test_bad_checksum_leaves_nothing_behind(self):
+        self.images.checksum = 'bad'
+        cache = openvz_conn.OVZImageCache(self.cache_dir, 0)
+        self.assertRaises(exception.ImageUnacceptable,
+                          cache.fetch, self.context, 1, pin=True)
+        self.assertEqual([], self._templates())
+        self.assertEqual({}, cache.pins)
+
+    def test_least_recently_used_image_is_evicted(self):
+        cache = openvz_conn.OVZImageCache(self.cache_dir, 32)
+        cache.fetch(self.context, 1)
+        self._age(cache, 1, 100)
+        cache.fetch(self.context, 2)
+        self._age(cache, 2, 200)
+        cache.fetch(self.context, 3)
+        self.assertEqual(['2.tar.gz', '3.tar.gz'],
+                         self._templates())
+        self.assertEqual(1, cache.get_stats()['evictions'])
+
+    def test_pinned_image_is_not_evicted(self):
+        cache = openvz_conn.OVZImageCache(self.cache_dir, 16)
+        cache.fetch(self.context, 1, pin=True)
+        self._age(cache, 1, 100)
+        cache.fetch(self.context, 2)
+        self.assertEqual(['1.tar.gz'], self._templates())
+        cache.release(1)
+        cache.fetch(self.context, 3)
+        self.assertEqual(['3.tar.gz'], self._templates())
+
+    def test_unmanaged_templates_are_not_evicted(self):
+        open(os.path.join(self.cache_dir, 'stock.tar.gz'), 'w').close()
+        cache = openvz_conn.OVZImageCache(self.cache_dir, 1)
+        cache.fetch(self.context, 1)
+        self.assertEqual(['stock.tar.gz'], self._templates())
+
+    def test_unmanaged_template_hit_is_not_managed(self):
+        open(os.path.join(self.cache_dir, '1.tar.gz'), 'w').close()
+        cache = openvz_conn.OVZImageCache(self.cache_dir, 1)
+        self.assertFalse(cache.fetch(self.context, 1))
+        self.assertEqual(0, self.images.downloads)
+        self.assertEqual(set(), cache.entries)
+        cache.fetch(self.context, 2)
+        self.assertEqual(['1.tar.gz'], self._templates())
+
+    def test_templates_are_evicted_after_a_restart(self):
+        cache = openvz_conn.OVZImageCache(self.cache_dir, 0)
+        cache.fetch(self.context, 1)
+        self._age(cache, 1, 100)
+        cache.fetch(self.context, 2)
+        cache = openvz_conn.OVZImageCache(self.cache_dir, 16)
+        self.assertEqual(['2.tar.gz'], self._templates())
+        self.assertEqual(set(['2']), cache.entries)
+
+    def test_partial_downloads_are_removed_on_start(self):
+        open(os.path.join(self.cache_dir, '1.tar.gz.part'), 'w').close()
+        openvz_conn.OVZImageCache(self.cache_dir, 0)
+        self.assertEqual([], self._templates())
+
+
+class FakeVzHost(object):
+    """Stands in for vzlist and the database on a host with the given
+    number of running containers, counting the commands and queries run."""
+
+    def __init__(self, containers):
+        self.ids = range(1, containers + 1)
+        self.commands = 0
+        self.queries = 0
+
+    def execute(self, *cmd, **kwargs):
+        self.commands += 1
+        if '--name' in cmd:
+            ctid = int(cmd[-1].split('-')[1], 16)
+            return ('%d 10 running 10.0.0.1 %s' % (ctid, cmd[-1]), None)
+        lines = ['%d instance-%08x running 100 131072 2' % (ctid, ctid)
+                 for ctid in self.ids]
+        return ('\n'.join(lines), None)
+
+    def instance_get(self, context, instance_id):
+        self.queries += 1
+        return {'id': instance_id, 'power_state': power_state.RUNNING}
+
+    def instance_get_power_states(self, context, instance_ids):
+        self.queries += 1
+        return dict((instance_id, power_state.RUNNING)
+                    for instance_id in instance_ids)
+
+
+class OpenVzInfoTestCase(test.TestCase):
+    """Compares the commands and queries per tick of getting the state of
+    every container one at a time with get_info and all at once with
+    get_info_all."""
+
+    def _run(self, containers, get_all):
+        host = FakeVzHost(containers)
+        self.stubs.Set(openvz_conn.utils, 'execute', host.execute)
+        self.stubs.Set(openvz_conn.db, 'instance_get', host.instance_get)
+        self.stubs.Set(openvz_conn.db, 'instance_get_power_states',
+                       host.instance_get_power_states)
+        conn = openvz_conn.OpenVzConnection(False)
+        if get_all:
+            infos = conn.get_info_all()
+        else:
+            infos = dict(('instance-%08x' % ctid,
+                          conn.get_info('instance-%08x' % ctid))
+                         for ctid in host.ids)
+        self.assertEqual(containers, len(infos))
+        return host.commands, host.queries
+
+    def test_get_info_each_scales_with_containers(self):
+        self.assertEqual((10, 10), self._run(10, get_all=False))
+        self.assertEqual((200, 200), self._run(200, get_all=False))
+
+    def test_get_info_all_is_flat(self):
+        self.assertEqual((1, 1), self._run(10, get_all=True))
+        self.assertEqual((1, 1), self._run(200, get_all=True))
@@ -23,6 +23,7 @@ from nova import context
 from nova import log as logging
 from nova import test
 from nova.rpc import impl_kombu
+from nova.rpc.common import Timeout
 from nova.tests import test_rpc_common
 
 
@@ -47,6 +48,29 @@ class RpcKombuTestCase(test_rpc_common._BaseRpcTestCase):
         conn_context.close()
         self.assertEqual(conn1, conn2)
 
+    def test_send_reopens_a_closed_channel(self):
+        """Test a pooled connection recovers when its channel is closed."""
+
+        class ChannelClosed(Exception):
+            pass
+
+        with self.rpc.ConnectionContext() as conn:
+            conn.topic_send('a_topic', 'first message')
+            publisher = conn.publishers[(self.rpc.TopicPublisher, 'a_topic')]
+            old_channel = conn.channel
+
+        def closed(*args, **kwargs):
+            raise ChannelClosed()
+
+        self.stubs.Set(publisher, 'send', closed)
+        with self.rpc.ConnectionContext() as conn:
+            self.stubs.Set(conn.connection.transport, 'channel_errors',
+                           (ChannelClosed,))
+            conn.topic_send('a_topic', 'second message')
+            self.assertNotEqual(old_channel, conn.channel)
+            self.assertNotEqual(publisher,
+                conn.publishers[(self.rpc.TopicPublisher, 'a_topic')])
+
     def test_topic_send_receive(self):
         """Test sending to a topic exchange/queue"""
 
@@ -82,6 +106,71 @@ class RpcKombuTestCase(test_rpc_common._BaseRpcTestCase):
 
         self.assertEqual(self.received_message, message)
 
+    def test_call_uses_shared_reply_queue(self):
+        self.flags(rpc_shared_reply_queue=True)
+        self.rpc.call(self.context, 'test', {"method": "echo",
+                                             "args": {"value": 42}})
+        metrics = self.rpc.get_reply_queue_metrics()
+        calls = metrics['calls']
+        result = self.rpc.call(self.context, 'test', {"method": "echo",
+                                                      "args": {"value": 7}})
+        self.assertEqual(7, result)
+        metrics = self.rpc.get_reply_queue_metrics()
+        self.assertEqual(calls + 1, metrics['calls'])
+        self.assertEqual(0, metrics['outstanding'])
+
+    def test_call_times_out(self):
+        self.flags(rpc_shared_reply_queue=True)
+        timeouts = self.rpc._get_reply_queue().timeouts
+        self.assertRaises(Timeout, self.rpc.call, self.context,
+                          'no_such_topic', {"method": "echo",
+                                            "args": {"value": 42}},
+                          timeout=0.1)
+        metrics = self.rpc.get_reply_queue_metrics()
+        self.assertEqual(timeouts + 1, metrics['timeouts'])
+        self.assertEqual(0, metrics['outstanding'])
+
+    def test_failed_send_forgets_the_call(self):
+        self.flags(rpc_shared_reply_queue=True)
+        outstanding = len(self.rpc._get_reply_queue().waiters)
+
+        def fail(*args, **kwargs):
+            raise IOError("broker is down")
+
+        self.stubs.Set(self.rpc.Connection, 'topic_send', fail)
+        self.assertRaises(IOError, self.rpc.multicall, self.context, 'test',
+                          {"method": "echo", "args": {"value": 42}})
+        self.assertEqual(outstanding,
+                         self.rpc.get_reply_queue_metrics()['outstanding'])
+
+    def test_unread_multicall_forgets_the_call(self):
+        self.flags(rpc_shared_reply_queue=True)
+        outstanding = len(self.rpc._get_reply_queue().waiters)
+        self.rpc.multicall(self.context, 'test',
+                           {"method": "echo", "args": {"value": 42}})
+        self.assertEqual(outstanding,
+                         self.rpc.get_reply_queue_metrics()['outstanding'])
+
+    def test_call_with_reply_queue_per_call(self):
+        self.flags(rpc_shared_reply_queue=False)
+        result = self.rpc.call(self.context, 'test', {"method": "echo",
+                                                      "args": {"value": 42}})
+        self.assertEqual(42, result)
+
+    def test_cast_many(self):
+        """Test sending a batch of casts over one connection"""
+        conn = self.rpc.create_connection()
+        self.received_messages = []
+        conn.declare_topic_consumer('a_batch_topic',
+                                    self.received_messages.append)
+        messages = [('a_batch_topic', {'value': i}) for i in range(3)]
+        self.rpc.cast_many(self.context, messages, confirm=True)
+        conn.consume(limit=3)
+        conn.close()
+
+        self.assertEqual([0, 1, 2], [message['value']
+                                     for message in self.received_messages])
+
     @test.skip_test("kombu memory transport seems buggy with fanout queues "
             "as this test passes when you use rabbit (fake_rabbit=False)")
     def test_fanout_send_receive(self):
@@ -108,3 +197,38 @@ class RpcKombuTestCase(test_rpc_common._BaseRpcTestCase):
         conn2.consume(limit=1)
         conn2.close()
         self.assertEqual(self.received_message, message)
+
+
+class RpcKombuPublisherCacheTest(test.TestCase):
+    """Checks pooled connections reuse their publishers over the
+    fake_rabbit memory transport."""
+
+    def setUp(self):
+        super(RpcKombuPublisherCacheTest, self).setUp()
+        self.context = context.get_admin_context()
+        self.created = []
+        original_init = impl_kombu.TopicPublisher.__init__
+
+        def counting_init(publisher, channel, topic, **kwargs):
+            self.created.append(topic)
+            original_init(publisher, channel, topic, **kwargs)
+
+        self.stubs.Set(impl_kombu.TopicPublisher, '__init__', counting_init)
+
+    def _cast(self, count):
+        for i in xrange(count):
+            impl_kombu.cast(self.context, 'benchmark', {"method": "echo",
+                                                        "args": {"value": i}})
+
+    def test_publishers_are_reused(self):
+        self.flags(rpc_publisher_cache_size=0)
+        self._cast(5)
+        self.assertEqual(5, len(self.created))
+        self.flags(rpc_publisher_cache_size=64)
+        self.created = []
+        self._cast(5)
+        self.assertEqual(1, len(self.created))
+        with impl_kombu.ConnectionContext() as conn:
+            publishers = conn.publishers
+        self.assertTrue((impl_kombu.TopicPublisher, 'benchmark')
+                        in publishers)
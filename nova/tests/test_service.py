@@ -33,6 +33,7 @@ from nova import manager
 from nova import wsgi
 from nova.compute import manager as compute_manager
 
+FLAGS = flags.FLAGS
 flags.DEFINE_string("fake_manager", "nova.tests.test_service.FakeManager",
                     "Manager for testing")
 
@@ -111,6 +112,7 @@ class ServiceTestCase(test.TestCase):
         self.assert_(app)
 
     def test_report_state_newly_disconnected(self):
+        self.flags(report_mode='read_modify_write')
         host = 'foo'
         binary = 'bar'
         topic = 'test'
@@ -144,6 +146,7 @@ class ServiceTestCase(test.TestCase):
         self.assert_(serv.model_disconnected)
 
     def test_report_state_newly_connected(self):
+        self.flags(report_mode='read_modify_write')
         host = 'foo'
         binary = 'bar'
         topic = 'test'
@@ -180,6 +183,81 @@ class ServiceTestCase(test.TestCase):
 
         self.assert_(not serv.model_disconnected)
 
+    def _start_service(self):
+        service_ref = {'host': 'foo',
+                       'binary': 'bar',
+                       'topic': 'test',
+                       'report_count': 0,
+                       'availability_zone': 'nova',
+                       'id': 1}
+        service.db.service_get_by_args(mox.IgnoreArg(), 'foo',
+                                       'bar').AndReturn(service_ref)
+        return service_ref
+
+    def test_report_state_atomic(self):
+        self.flags(report_mode='atomic')
+        service_ref = self._start_service()
+        service.db.service_heartbeat(mox.IgnoreArg(), service_ref['id'])
+
+        self.mox.ReplayAll()
+        serv = service.Service('foo', 'bar', 'test',
+                               'nova.tests.test_service.FakeManager')
+        serv.start()
+        serv.report_state()
+        self.assert_(not serv.model_disconnected)
+
+    def test_report_state_atomic_recreates_service(self):
+        self.flags(report_mode='atomic')
+        service_ref = self._start_service()
+        service.db.service_heartbeat(mox.IgnoreArg(), service_ref['id']).\
+                AndRaise(exception.ServiceNotFound(service_id=1))
+        service.db.service_create(mox.IgnoreArg(),
+                                  mox.IgnoreArg()).AndReturn(
+                                      dict(service_ref, id=2))
+        service.db.service_heartbeat(mox.IgnoreArg(), 2)
+
+        self.mox.ReplayAll()
+        serv = service.Service('foo', 'bar', 'test',
+                               'nova.tests.test_service.FakeManager')
+        serv.start()
+        serv.report_state()
+        self.assertEqual(2, serv.service_id)
+        self.assert_(not serv.model_disconnected)
+
+    def test_report_state_to_collector(self):
+        self.flags(report_mode='collector')
+        self._start_service()
+        casts = []
+        self.stubs.Set(rpc, 'cast',
+                       lambda context, topic, msg: casts.append((topic, msg)))
+
+        self.mox.ReplayAll()
+        serv = service.Service('foo', 'bar', 'test',
+                               'nova.tests.test_service.FakeManager')
+        serv.start()
+        serv.report_state()
+        self.assertEqual([(FLAGS.heartbeat_topic,
+                           {'method': 'service_heartbeat',
+                            'args': {'service_id': 1,
+                                     'topic': 'test',
+                                     'host': 'foo'}})], casts)
+
+    def test_service_missing_recreates_service(self):
+        service_ref = self._start_service()
+        service.db.service_create(mox.IgnoreArg(),
+                                  mox.IgnoreArg()).AndReturn(
+                                      dict(service_ref, id=2))
+
+        self.mox.ReplayAll()
+        serv = service.Service('foo', 'bar', 'test',
+                               'nova.tests.test_service.FakeManager')
+        serv.start()
+        serv.service_missing(context.get_admin_context(), 1)
+        self.assertEqual(2, serv.service_id)
+        # A report about the old row is ignored once it was recreated.
+        serv.service_missing(context.get_admin_context(), 1)
+        self.assertEqual(2, serv.service_id)
+
 
 class TestWSGIService(test.TestCase):
 
@@ -490,6 +490,13 @@ class ComputeDriver(object):
         """Return currently known host stats"""
         raise NotImplementedError()
 
+    def prefetch_image(self, context, image_ref):
+        """Fetch the image into the local image cache ahead of use.
+
+        This method is optional.
+        """
+        raise NotImplementedError()
+
     def list_disks(self, instance_name):
         """
         Return the IDs of all the virtual disks attached to the specified
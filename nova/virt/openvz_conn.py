@@ -22,6 +22,7 @@ is sketchy at best.
 
 import os
 import fnmatch
+import hashlib
 import socket
 import json
 from nova import db
@@ -30,7 +31,6 @@ from nova import flags
 from nova import log as logging
 from nova import utils
 from nova import context
-from nova.auth import manager
 from nova.network import linux_net
 from nova.compute import power_state
 from nova.compute import instance_types
@@ -112,9 +112,21 @@ flags.DEFINE_integer('ovz_kmemsize_barrier_differential',
 flags.DEFINE_bool('ovz_use_bind_mount',
                   False,
                   'Use bind mounting instead of simfs')
+flags.DEFINE_integer('ovz_image_cache_max_bytes',
+                     0,
+                     'Most bytes of templates the image cache keeps before '
+                     'evicting the least recently used, or 0 for no limit')
+flags.DEFINE_bool('ovz_image_cache_verify_checksum',
+                  True,
+                  'Verify downloaded templates against the image checksum')
 
 LOG = logging.getLogger('nova.virt.openvz')
 
+# The vzlist fields get_info_all reads, in order.
+VZLIST_INFO_FIELDS = 'ctid,name,status,privvmpages,privvmpages.l,cpus'
+# Size in bytes of the pages vzlist counts memory in.
+VZ_PAGE_SIZE = 4096
+
 
 def get_connection(read_only):
     return OpenVzConnection(read_only)
@@ -134,6 +146,7 @@ class OpenVzConnection(driver.ComputeDriver):
             }
         self.read_only = read_only
         self.vif_driver = utils.import_object(FLAGS.ovz_vif_driver)
+        self.image_cache = OVZImageCache()
         LOG.debug(_('__init__ complete in OpenVzConnection'))
 
     @classmethod
@@ -203,40 +216,106 @@ class OpenVzConnection(driver.ComputeDriver):
         This fascilitates the regular status polls that happen within the
         manager code.
 
+        The states come from get_info_all, so a single vzlist command and
+        a single database query are run however many containers there are.
+        """
+        infos = self.get_info_all()
+        return [driver.InstanceInfo(name, info['state'])
+                for name, info in infos.iteritems()]
+
+    def get_info_all(self):
+        """
+        Get the get_info block of every container on the host, keyed by
+        the instance name.
+
         I execute the command:
 
-        vzlist --all -o name -H
+        vzlist --all -H -o ctid,name,status,privvmpages,privvmpages.l,cpus
 
         If I fail to run an exception is raised because a failure to run is
         disruptive to the driver's ability to support the instances on
         the host through nova's interface.
         """
-
-        # TODO(imsplitbit): need to ask around if this is the best way to do
-        # this.  This causes some redundant vzlist commands as get_info is run
-        # on every item returned from this command but it didn't make sense
-        # to re-implement get_info as get_info_all.
-        infos = []
         try:
-            # get a list of CT names which will be nova friendly.
             # NOTE: This can be an issue if nova decides to change
             # the format of names.  We would need to have a migration process
             # to change the names in the name field of the CTs.
-            out, err = utils.execute('vzlist', '--all', '-o',
-                                     'name', '-H', run_as_root=True)
+            out, err = utils.execute('vzlist', '--all', '-H', '-o',
+                                     VZLIST_INFO_FIELDS, run_as_root=True)
             if err:
                 LOG.error(_('Stderr output from vzlist: %s') % err)
         except ProcessExecutionError as err:
             LOG.error(_('Stderr output from vzlist: %s') % err)
             raise exception.Error(_('Problem listing Vzs'))
 
-        for name in out.splitlines():
-            name = name.split()[0]
-            status = self.get_info(name)
-            infos.append(driver.InstanceInfo(name, status['state']))
-
+        metas = []
+        for line in out.splitlines():
+            fields = line.split()
+            if len(fields) < 6 or fields[1] == '-':
+                # Containers without a name were not created by nova.
+                continue
+            metas.append(self._parse_vzlist_info(fields))
+
+        power_states = db.instance_get_power_states(
+            context.get_admin_context(), [meta['id'] for meta in metas])
+
+        infos = {}
+        for meta in metas:
+            if meta['id'] not in power_states:
+                LOG.warn(_('Container %s has no instance') % meta['name'])
+                continue
+            state = self._get_power_state(meta, power_states[meta['id']])
+            infos[meta['name']] = {'state': state,
+                                   'max_mem': meta['max_mem'],
+                                   'mem': meta['mem'],
+                                   'num_cpu': meta['num_cpu'],
+                                   'cpu_time': 0}
         return infos
 
+    @staticmethod
+    def _parse_vzlist_info(fields):
+        """
+        Turn a line of the vzlist output of get_info_all into the id, name,
+        state and metrics of a container.  Memory is given in KiB and
+        unlimited values, shown as '-', are given as 0.
+        """
+        def to_int(value):
+            if value == '-':
+                return 0
+            return int(value)
+
+        ctid, name, state, privvmpages, privvmpages_limit, cpus = fields[:6]
+        page_kb = VZ_PAGE_SIZE / 1024
+        return {'id': int(ctid),
+                'name': name,
+                'state': state,
+                'mem': to_int(privvmpages) * page_kb,
+                'max_mem': to_int(privvmpages_limit) * page_kb,
+                'num_cpu': to_int(cpus)}
+
+    @staticmethod
+    def _get_power_state(meta, db_power_state):
+        """
+        Work out the power state of a container from the status vzlist
+        reported for it and the power state in the database.
+        """
+        # Store the assumed state as the default
+        state = db_power_state
+        if db_power_state != power_state.NOSTATE:
+            # NOTE(imsplitbit): This is not ideal but it looks like nova uses
+            # codes returned from libvirt and xen which don't correlate to
+            # the status returned from OpenVZ which is either 'running' or
+            # 'stopped'.  There is some contention on how to handle systems
+            # that were shutdown intentially however I am defaulting to the
+            # nova expected behavior.
+            if meta['state'] == 'running':
+                state = power_state.RUNNING
+            elif meta['state'] is None or meta['state'] == '-':
+                state = power_state.NOSTATE
+            else:
+                state = power_state.SHUTDOWN
+        return state
+
     def spawn(self, context, instance, network_info=None,
               block_device_mapping=None):
         """
@@ -271,15 +350,22 @@ class OpenVzConnection(driver.ComputeDriver):
         # it more durable during failure. And roll back changes made leading
         # up to the error.
         self._cache_image(context, instance)
-        self._create_vz(instance)
-        self._set_vz_os_hint(instance)
+        try:
+            self._create_vz(instance)
+        finally:
+            self.image_cache.release(instance['image_ref'])
         self._configure_vz(instance)
-        self._set_name(instance)
+        # Everything else the container needs set is saved in one go, after
+        # the base config so that it doesn't override any of it.
+        settings = OVZSettings(instance['id'])
+        self._set_vz_os_hint(instance, settings=settings)
+        self._set_name(instance, settings)
+        self._set_hostname(instance, settings=settings)
+        self._set_instance_size(instance, settings=settings)
+        self._set_onboot(instance, settings)
+        self._apply_spawn_settings(instance, settings)
         self.plug_vifs(instance, network_info)
-        self._set_hostname(instance)
-        self._set_instance_size(instance)
         self._attach_volumes(instance)
-        self._set_onboot(instance)
         self._start(instance)
         self._initial_secure_host(instance)
         self._gratuitous_arp_all_addresses(instance, network_info)
@@ -345,7 +431,7 @@ class OpenVzConnection(driver.ComputeDriver):
                                   instance['id'])
         return True
 
-    def _set_vz_os_hint(self, instance, ostemplate='ubuntu'):
+    def _set_vz_os_hint(self, instance, ostemplate='ubuntu', settings=None):
         """
         I exist as a stopgap because currently there are no os hints
         in the image managment of nova.  There are ways of hacking it in
@@ -370,18 +456,10 @@ class OpenVzConnection(driver.ComputeDriver):
         # of resolver, hostname and the like
 
         # TODO(imsplitbit): change the ostemplate default value to a flag
-        try:
-            out, err = utils.execute('vzctl', 'set', instance['id'],
-                                     '--save', '--ostemplate', ostemplate,
-                                     run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
-        except exception.ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            raise exception.Error(
-                _('Cant set ostemplate to \'%(ostemplate)s\' for %(id)s') %
-                {'ostemplate': ostemplate, 'id': instance['id']})
+        self._vzctl_set(instance, settings, '--ostemplate', ostemplate,
+                        _('Cant set ostemplate to \'%(ostemplate)s\' for '
+                          '%(id)s') % {'ostemplate': ostemplate,
+                                       'id': instance['id']})
 
     def _cache_image(self, context, instance):
         """
@@ -389,25 +467,18 @@ class OpenVzConnection(driver.ComputeDriver):
         image library to pull the image down the distro image into the openvz
         template cache.  This is the method that openvz wants to operate
         properly.
-        """
 
-        image_name = '%s.tar.gz' % instance['image_ref']
-        full_image_path = '%s/%s' % (FLAGS.ovz_image_template_dir, image_name)
-
-        if not os.path.exists(full_image_path):
-            # These objects are required to retrieve images from the object
-            # store. This is known only to work with glance so far but as I
-            # understand it. glance's interface matches that of the other
-            # object stores.
-            user = manager.AuthManager().get_user(instance['user_id'])
-            project = manager.AuthManager().get_project(instance['project_id'])
+        The image stays pinned in the cache until it is released.
+        """
+        return self.image_cache.fetch(context, instance['image_ref'],
+                                      pin=True)
 
-            # Grab image and place it in the image cache
-            images.fetch(context, instance['image_ref'], full_image_path, user,
-                         project)
-            return True
-        else:
-            return False
+    def prefetch_image(self, context, image_ref):
+        """
+        Warm the template cache with the image ahead of the instances which
+        will be created from it.
+        """
+        return self.image_cache.fetch(context, image_ref)
 
     def _configure_vz(self, instance, config='basic'):
         """
@@ -441,29 +512,56 @@ class OpenVzConnection(driver.ComputeDriver):
             raise exception.Error(_('Failed to add %s to OpenVz')
                                   % instance['id'])
 
-    def _set_onboot(self, instance):
+    def _apply_spawn_settings(self, instance, settings):
+        """
+        Save the settings queued while spawning the instance.
+
+        vzctl rejects the command as a whole, so if it fails with onboot
+        queued the settings are saved again without it, as onboot is only
+        best effort.  Any other failure fails the spawn.
+        """
+        try:
+            settings.apply()
+        except exception.Error as err:
+            if not settings.remove('--onboot'):
+                raise
+            LOG.error(_('Failed saving the settings of %(id)s with onboot, '
+                        'retrying without it: %(err)s') %
+                      {'id': instance['id'], 'err': err})
+            settings.apply()
+
+    def _set_onboot(self, instance, settings=None):
         """
         Method to set the onboot status of the instance. This is done
         so that openvz does not handle booting, and instead the compute
         manager can handle initialization.
-        
+
         I run the command:
-        
-        vzctl set <ctid> --onboot no --save
-        
-        If I fail to run an exception is raised.
+
+        vzctl set <ctid> --save --onboot no
+
+        If I fail to run on my own the error is only logged.  Queued on
+        settings, a failure is handled when they are applied, see
+        _apply_spawn_settings.
         """
         try:
             # Set the onboot status for the vz
-            out, err = utils.execute('vzctl', 'set', instance['id'],
-                                     '--onboot', 'no', '--save',
-                                     run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            LOG.error(_('Failed setting onboot'))
+            self._vzctl_set(instance, settings, '--onboot', 'no',
+                            _('Failed setting onboot'))
+        except exception.Error as err:
+            LOG.error(err)
+
+    def _vzctl_set(self, instance, settings, option, value, error_msg):
+        """
+        Queue the option on the settings to save with the other settings for
+        the container, or save it right away if no settings are given.
+        """
+        if settings is None:
+            settings = OVZSettings(instance['id'])
+            settings.set(option, value, error_msg)
+            settings.apply()
+        else:
+            settings.set(option, value, error_msg)
 
     def _start(self, instance):
         """
@@ -535,7 +633,7 @@ class OpenVzConnection(driver.ComputeDriver):
             raise exception.Error(_('Failed to update db for %s')
                                   % instance['id'])
 
-    def _set_hostname(self, instance, hostname=False):
+    def _set_hostname(self, instance, hostname=False, settings=None):
         """
         I exist to set the hostname of a given container.  The option to pass
         a hostname to the method was added with the intention to allow the
@@ -556,16 +654,8 @@ class OpenVzConnection(driver.ComputeDriver):
         if not hostname:
             hostname = instance['hostname']
 
-        try:
-            out, err = utils.execute('vzctl', 'set', instance['id'],
-                                     '--save', '--hostname', hostname,
-                                     run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
-        except ProcessExecutionError:
-            raise exception.Error(_('Cannot set the hostname on %s') %
-                                  instance['id'])
+        self._vzctl_set(instance, settings, '--hostname', hostname,
+                        _('Cannot set the hostname on %s') % instance['id'])
 
     def _gratuitous_arp_all_addresses(self, instance, network_info):
         """
@@ -626,7 +716,7 @@ class OpenVzConnection(driver.ComputeDriver):
             LOG.error(_('Stderr output from vzctl: %s') % err)
             LOG.error(_('Failed arping through VE'))
 
-    def _set_name(self, instance):
+    def _set_name(self, instance, settings=None):
         """
         I exist to store the name of an instance in the name field for
         openvz.  This is done to facilitate the get_info method which only
@@ -640,18 +730,8 @@ class OpenVzConnection(driver.ComputeDriver):
         requirement of the get_info method to have the name field filled out.
         """
 
-        try:
-            out, err = utils.execute('vzctl', 'set', instance['id'],
-                                     '--save', '--name', instance['name'],
-                                     run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
-
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            raise exception.Error(_('Unable to save metadata for %s') %
-                                  instance['id'])
+        self._vzctl_set(instance, settings, '--name', instance['name'],
+                        _('Unable to save metadata for %s') % instance['id'])
 
     def _find_by_name(self, instance_name):
         """
@@ -774,11 +854,13 @@ class OpenVzConnection(driver.ComputeDriver):
             raise exception.InstanceUnacceptable(
                 _("Instance size reset FAILED"))
 
-    def _set_instance_size(self, instance, instance_type_id = None):
+    def _set_instance_size(self, instance, instance_type_id=None,
+                           settings=None):
         """
         Given that these parameters make up and instance's 'size' we are
         bundling them together to make resizing an instance on the host
-        an easier task.
+        an easier task.  They are all saved with one vzctl set command, or
+        queued on the settings given.
         """
         if not instance_type_id:
             instance_type = instance_types.get_instance_type(
@@ -792,21 +874,25 @@ class OpenVzConnection(driver.ComputeDriver):
         percent_of_resource = self._percent_of_resource(
             instance_type['memory_mb'])
 
-        self._set_vmguarpages(instance, instance_memory_pages)
-        self._set_privvmpages(instance, instance_memory_pages)
-        self._set_kmemsize(instance, instance_memory_bytes)
+        size_settings = settings or OVZSettings(instance['id'])
+        self._set_vmguarpages(instance, instance_memory_pages, size_settings)
+        self._set_privvmpages(instance, instance_memory_pages, size_settings)
+        self._set_kmemsize(instance, instance_memory_bytes, size_settings)
         if FLAGS.ovz_use_cpuunit:
-            self._set_cpuunits(instance, percent_of_resource)
+            self._set_cpuunits(instance, percent_of_resource, size_settings)
         if FLAGS.ovz_use_cpulimit:
-            self._set_cpulimit(instance, percent_of_resource)
+            self._set_cpulimit(instance, percent_of_resource, size_settings)
         if FLAGS.ovz_use_cpus:
-            self._set_cpus(instance, instance_type['vcpus'])
+            self._set_cpus(instance, instance_type['vcpus'],
+                           settings=size_settings)
         if FLAGS.ovz_use_ioprio:
-            self._set_ioprio(instance, percent_of_resource)
+            self._set_ioprio(instance, percent_of_resource, size_settings)
         if FLAGS.ovz_use_disk_quotas:
-            self._set_diskspace(instance, instance_type)
+            self._set_diskspace(instance, instance_type, size_settings)
+        if settings is None:
+            size_settings.apply()
 
-    def _set_vmguarpages(self, instance, num_pages):
+    def _set_vmguarpages(self, instance, num_pages, settings=None):
         """
         Set the vmguarpages attribute for a container.  This number represents
         the number of 4k blocks of memory that are guaranteed to the container.
@@ -819,19 +905,10 @@ class OpenVzConnection(driver.ComputeDriver):
         If I fail to run then an exception is raised because this affects the
         memory allocation for the container.
         """
-        try:
-            out, err = utils.execute('vzctl', 'set', instance['id'],
-                                      '--save', '--vmguarpages', num_pages,
-                                      run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            raise exception.Error(_('Cannot set vmguarpages for %s') %
-                                  instance['id'])
+        self._vzctl_set(instance, settings, '--vmguarpages', num_pages,
+                        _('Cannot set vmguarpages for %s') % instance['id'])
 
-    def _set_privvmpages(self, instance, num_pages):
+    def _set_privvmpages(self, instance, num_pages, settings=None):
         """
         Set the privvmpages attribute for a container.  This represents the
         memory allocation limit.  Think of this as a bursting limit.  For now
@@ -845,19 +922,10 @@ class OpenVzConnection(driver.ComputeDriver):
         If I fail to run an exception is raised as this is essential for the
         running container to operate properly within it's memory constraints.
         """
-        try:
-            out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
-                                     '--privvmpages', num_pages,
-                                     run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            raise exception.Error(_('Cannot set privvmpages for %s') %
-                                  instance['id'])
+        self._vzctl_set(instance, settings, '--privvmpages', num_pages,
+                        _('Cannot set privvmpages for %s') % instance['id'])
 
-    def _set_kmemsize(self, instance, instance_memory):
+    def _set_kmemsize(self, instance, instance_memory, settings=None):
         """
         Set the kmemsize attribute for a container.  This represents the
         amount of the container's memory allocation that will be made
@@ -880,20 +948,12 @@ class OpenVzConnection(driver.ComputeDriver):
             float(FLAGS.ovz_kmemsize_barrier_differential) / 100.0))
         kmemsize = '%d:%d' % (kmem_barrier, kmem_limit)
 
-        try:
-            out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
-                                     '--kmemsize',
-                                     kmemsize, run_as_root=True)
-            LOG.debug(_('Stdout from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr from vzctl: %s') % err)
-        except ProcessExecutionError as err:
-            LOG.error(_('Error setting kmemsize: %s') % err)
-            raise exception.Error(
-                _('Error setting kmemsize to %(kmemsize)s on %(id)s') %
-                {'kmemsize': kmemsize, 'id': instance['id']})
+        self._vzctl_set(instance, settings, '--kmemsize', kmemsize,
+                        _('Error setting kmemsize to %(kmemsize)s on '
+                          '%(id)s') % {'kmemsize': kmemsize,
+                                       'id': instance['id']})
 
-    def _set_cpuunits(self, instance, percent_of_resource):
+    def _set_cpuunits(self, instance, percent_of_resource, settings=None):
         """
         Set the cpuunits setting for the container.  This is an integer
         representing the number of cpu fair scheduling counters that the
@@ -918,18 +978,10 @@ class OpenVzConnection(driver.ComputeDriver):
         if units > self.utility['UNITS']:
             units = self.utility['UNITS']
 
-        try:
-            out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
-                                     '--cpuunits', units, run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            raise exception.Error(_('Cannot set cpuunits for %s') %
-                                  instance['id'])
+        self._vzctl_set(instance, settings, '--cpuunits', units,
+                        _('Cannot set cpuunits for %s') % instance['id'])
 
-    def _set_cpulimit(self, instance, percent_of_resource):
+    def _set_cpulimit(self, instance, percent_of_resource, settings=None):
         """
         This is a number in % equal to the amount of cpu processing power
         the container gets.  NOTE: 100% is 1 logical cpu so if you have 12
@@ -953,18 +1005,10 @@ class OpenVzConnection(driver.ComputeDriver):
         if cpulimit > self.utility['CPULIMIT']:
             cpulimit = self.utility['CPULIMIT']
 
-        try:
-            out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
-                                     '--cpulimit', cpulimit, run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            raise exception.Error(_('Unable to set cpulimit for %s') %
-                                  instance['id'])
+        self._vzctl_set(instance, settings, '--cpulimit', cpulimit,
+                        _('Unable to set cpulimit for %s') % instance['id'])
 
-    def _set_cpus(self, instance, vcpus, multiplier=2):
+    def _set_cpus(self, instance, vcpus, multiplier=2, settings=None):
         """
         The number of logical cpus that are made available to the container.
         I default to showing 2 cpus to each container at a minimum.
@@ -983,18 +1027,10 @@ class OpenVzConnection(driver.ComputeDriver):
         if vcpus > (self.utility['CPULIMIT'] / 100):
             vcpus = self.utility['CPULIMIT'] / 100
 
-        try:
-            out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
-                                     '--cpus', vcpus, run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            raise exception.Error(_('Unable to set cpus for %s') %
-                                  instance['id'])
+        self._vzctl_set(instance, settings, '--cpus', vcpus,
+                        _('Unable to set cpus for %s') % instance['id'])
 
-    def _set_ioprio(self, instance, percent_of_resource):
+    def _set_ioprio(self, instance, percent_of_resource, settings=None):
         """
         Set the IO priority setting for a given container.  This is represented
         by an integer between 0 and 7.  If no priority is given one will be
@@ -1011,18 +1047,11 @@ class OpenVzConnection(driver.ComputeDriver):
         """
         ioprio = int(float(FLAGS.ovz_ioprio_limit) * percent_of_resource)
 
-        try:
-            out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
-                                     '--ioprio', ioprio, run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            raise exception.Error(_('Unable to set IO priority for %s') %
-                instance['id'])
+        self._vzctl_set(instance, settings, '--ioprio', ioprio,
+                        _('Unable to set IO priority for %s') %
+                        instance['id'])
 
-    def _set_diskspace(self, instance, instance_type):
+    def _set_diskspace(self, instance, instance_type, settings=None):
         """
         Implement OpenVz disk quotas for local disk space usage.
         This method takes a soft and hard limit.  This is also the amount
@@ -1047,17 +1076,10 @@ class OpenVzConnection(driver.ComputeDriver):
         soft = '%s%s' % (soft, FLAGS.ovz_disk_space_increment)
         hard = '%s%s' % (hard, FLAGS.ovz_disk_space_increment)
 
-        try:
-            out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
-                                     '--diskspace', '%s:%s' % (soft, hard),
-                                     run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            raise exception.Error(_('Error setting diskspace quota for %s') %
-                                  instance['id'])
+        self._vzctl_set(instance, settings, '--diskspace',
+                        '%s:%s' % (soft, hard),
+                        _('Error setting diskspace quota for %s') %
+                        instance['id'])
 
     def plug_vifs(self, instance, network_info):
         """
@@ -1421,25 +1443,10 @@ class OpenVzConnection(driver.ComputeDriver):
             LOG.error(_('Instance %s Not Found') % instance_name)
             raise exception.NotFound('Instance %s Not Found' % instance_name)
 
-        # Store the assumed state as the default
-        state = instance['power_state']
-
         LOG.debug(_('Instance %(id)s is in state %(power_state)s') %
-                {'id': instance['id'], 'power_state': state})
+                {'id': instance['id'], 'power_state': instance['power_state']})
 
-        if instance['power_state'] != power_state.NOSTATE:
-            # NOTE(imsplitbit): This is not ideal but it looks like nova uses
-            # codes returned from libvirt and xen which don't correlate to
-            # the status returned from OpenVZ which is either 'running' or
-            # 'stopped'.  There is some contention on how to handle systems
-            # that were shutdown intentially however I am defaulting to the
-            # nova expected behavior.
-            if meta['state'] == 'running':
-                state = power_state.RUNNING
-            elif meta['state'] is None or meta['state'] == '-':
-                state = power_state.NOSTATE
-            else:
-                state = power_state.SHUTDOWN
+        state = self._get_power_state(meta, instance['power_state'])
 
         # TODO(imsplitbit): Need to add all metrics to this dict.
         return {'state': state,
@@ -1743,6 +1750,275 @@ class OpenVzConnection(driver.ComputeDriver):
         except ProcessExecutionError as err:
             LOG.error(_('Stderr output from vzcpucheck: %s') % err)
 
+class OVZImageCache(object):
+    """
+    I keep the templates containers are created from on the host.
+
+    Only one download of an image runs at a time, however many containers
+    are being created from it.  Downloads are written to a .part file which
+    is renamed into place once its checksum is verified, so a template is
+    never seen half written.  When the cache is over its byte budget the
+    least recently used templates which aren't pinned are evicted.  Only
+    templates fetched through the cache are evicted; they are listed in a
+    manifest in the directory so that they are still known after a
+    restart, and anything else in the directory is left alone.
+    """
+
+    MANIFEST = '.ovz-image-cache'
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or FLAGS.ovz_image_template_dir
+        if max_bytes is None:
+            max_bytes = FLAGS.ovz_image_cache_max_bytes
+        self.max_bytes = max_bytes
+        self.entries = set()
+        self.pins = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+        self.evict()
+
+    def path(self, image_ref):
+        return '%s/%s.tar.gz' % (self.cache_dir, image_ref)
+
+    def _manifest_path(self):
+        return '%s/%s' % (self.cache_dir, self.MANIFEST)
+
+    def _load(self):
+        """
+        Pick up the templates fetched before the service restarted, and
+        remove any downloads which were cut short by it.
+        """
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith('.tar.gz.part'):
+                LOG.info(_('Removing partial download %s') % name)
+                try:
+                    os.unlink('%s/%s' % (self.cache_dir, name))
+                except OSError as err:
+                    LOG.error(_('Unable to remove %(name)s: %(err)s') %
+                              locals())
+        try:
+            with open(self._manifest_path()) as manifest:
+                image_refs = [line.strip() for line in manifest]
+        except IOError:
+            return
+        self.entries = set(image_ref for image_ref in image_refs
+                           if image_ref and
+                              os.path.exists(self.path(image_ref)))
+
+    def _save(self):
+        """
+        Write the manifest of the templates fetched through the cache.  It
+        is written to a temporary file first, so a crash can't leave it
+        half written.
+        """
+        manifest_path = self._manifest_path()
+        try:
+            with open('%s.tmp' % manifest_path, 'w') as manifest:
+                for image_ref in sorted(self.entries):
+                    manifest.write('%s\n' % image_ref)
+            os.rename('%s.tmp' % manifest_path, manifest_path)
+        except (IOError, OSError) as err:
+            LOG.error(_('Unable to save the image cache manifest: %s') % err)
+
+    def fetch(self, context, image_ref, pin=False):
+        """
+        Make sure the template for the image is in the cache, downloading
+        it if needed.  I return True if it was downloaded.
+
+        A pinned template is not evicted until it is released.
+        """
+        image_ref = str(image_ref)
+        if pin:
+            self.pins[image_ref] = self.pins.get(image_ref, 0) + 1
+
+        @utils.synchronized('ovz-image-%s' % image_ref)
+        def fetch_if_missing():
+            path = self.path(image_ref)
+            if os.path.exists(path):
+                self.hits += 1
+                # The modification time orders the templates for eviction.
+                # A template put there by something else is left unmanaged.
+                os.utime(path, None)
+                return False
+            self.misses += 1
+            self._download(context, image_ref, path)
+            self.entries.add(image_ref)
+            self._save()
+            return True
+
+        try:
+            fetched = fetch_if_missing()
+        except Exception:
+            if pin:
+                self.release(image_ref)
+            raise
+        if fetched:
+            self.evict()
+        return fetched
+
+    def release(self, image_ref):
+        """Unpin the template so that it can be evicted."""
+        image_ref = str(image_ref)
+        count = self.pins.get(image_ref, 0) - 1
+        if count > 0:
+            self.pins[image_ref] = count
+        else:
+            self.pins.pop(image_ref, None)
+
+    def _download(self, context, image_ref, path):
+        part_path = '%s.part' % path
+        try:
+            metadata = images.fetch(context, image_ref, part_path,
+                                    context.user_id, context.project_id)
+            checksum = (metadata or {}).get('checksum')
+            if FLAGS.ovz_image_cache_verify_checksum and checksum:
+                actual = self._md5sum(part_path)
+                if actual != checksum:
+                    raise exception.ImageUnacceptable(image_id=image_ref,
+                        reason=_('checksum %(actual)s does not match '
+                                 '%(checksum)s') % locals())
+            os.rename(part_path, path)
+        except Exception:
+            if os.path.exists(part_path):
+                os.unlink(part_path)
+            raise
+
+    @staticmethod
+    def _md5sum(path, chunk_size=1024 * 1024):
+        md5 = hashlib.md5()
+        with open(path, 'rb') as image_file:
+            chunk = image_file.read(chunk_size)
+            while chunk:
+                md5.update(chunk)
+                chunk = image_file.read(chunk_size)
+        return md5.hexdigest()
+
+    def evict(self):
+        """
+        Remove the least recently used templates which aren't pinned until
+        the cache is within its byte budget.
+        """
+        if not self.max_bytes:
+            return
+        managed = len(self.entries)
+        templates = []
+        total = 0
+        for image_ref in list(self.entries):
+            path = self.path(image_ref)
+            try:
+                size = os.path.getsize(path)
+                mtime = os.path.getmtime(path)
+            except OSError:
+                self.entries.discard(image_ref)
+                continue
+            total += size
+            templates.append((mtime, size, image_ref))
+        templates.sort()
+        for mtime, size, image_ref in templates:
+            if total <= self.max_bytes:
+                break
+            if image_ref in self.pins:
+                continue
+            LOG.info(_('Evicting template %s from the image cache') %
+                     image_ref)
+            try:
+                os.unlink(self.path(image_ref))
+            except OSError as err:
+                LOG.error(_('Unable to evict template %(image_ref)s: '
+                            '%(err)s') % locals())
+                continue
+            self.entries.discard(image_ref)
+            self.evictions += 1
+            total -= size
+        if len(self.entries) != managed:
+            self._save()
+
+    def get_stats(self):
+        """Returns the hit, miss and eviction counts."""
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
+class OVZSettings(object):
+    """
+    I collect the settings to change on a container so that they can all be
+    saved with a single vzctl set command.  Each vzctl command forks a
+    process through the root helper, which is most of the cost of setting
+    up or resizing a container.
+    """
+
+    def __init__(self, instance_id):
+        self.instance_id = instance_id
+        self.entries = []
+
+    def set(self, option, value, error_msg=None):
+        """
+        Queue the option to be saved, replacing any value queued for it.
+        The error message is used if the settings fail to save.
+        """
+        for index, (queued, _value, _msg) in enumerate(self.entries):
+            if queued == option:
+                self.entries[index] = (option, value, error_msg)
+                return
+        self.entries.append((option, value, error_msg))
+
+    def remove(self, option):
+        """
+        Drop every value queued for the option.  Returns whether any was.
+        """
+        entries = [entry for entry in self.entries if entry[0] != option]
+        removed = len(entries) != len(self.entries)
+        self.entries = entries
+        return removed
+
+    def add(self, option, value, error_msg=None):
+        """
+        Queue the option to be saved alongside any value already queued for
+        it, for options vzctl takes more than once such as --ipadd.
+        """
+        self.entries.append((option, value, error_msg))
+
+    def apply(self):
+        """
+        Save all of the queued settings.
+
+        I run the command:
+
+        vzctl set <ctid> --save <option> <value> [<option> <value> ...]
+
+        If I fail to run an exception is raised with the error messages of
+        all of the settings, as it is unknown which of them vzctl rejected.
+        """
+        if not self.entries:
+            return
+        cmd = ['vzctl', 'set', self.instance_id, '--save']
+        for option, value, _msg in self.entries:
+            cmd.extend([option, value])
+        try:
+            out, err = utils.execute(*cmd, run_as_root=True)
+            LOG.debug(_('Stdout output from vzctl: %s') % out)
+            if err:
+                LOG.error(_('Stderr output from vzctl: %s') % err)
+        except ProcessExecutionError as err:
+            LOG.error(_('Stderr output from vzctl: %s') % err)
+            error_msgs = []
+            for option, _value, error_msg in self.entries:
+                error_msg = error_msg or (
+                    _('Cannot set %(option)s for %(id)s') %
+                    {'option': option, 'id': self.instance_id})
+                if error_msg not in error_msgs:
+                    error_msgs.append(error_msg)
+            raise exception.Error('; '.join(error_msgs))
+        self.entries = []
+
+
 class OVZFile(object):
     """
     This is a generic file class for wrapping up standard file operations that
@@ -2277,18 +2553,22 @@ class OVZNetworkInterfaces(object):
         """
         I add all interfaces and addresses to the container.
         """
+        # The interfaces, addresses and nameserver are all saved with one
+        # vzctl set command.
+        settings = OVZSettings(self.interface_info[0]['id'])
         if FLAGS.ovz_use_veth_devs:
             for net_dev in self.interface_info:
                 self._add_netif(net_dev['id'], net_dev['name'],
-                                net_dev['bridge'], net_dev['mac'])
+                                net_dev['bridge'], net_dev['mac'], settings)
 
             self._load_template()
             self._fill_templates()
         else:
             for net_dev in self.interface_info:
-                self._add_ip(net_dev['id'], net_dev['address'])
+                self._add_ip(net_dev['id'], net_dev['address'], settings)
 
-        self._set_nameserver(net_dev['id'], net_dev['dns'])
+        self._set_nameserver(net_dev['id'], net_dev['dns'], settings)
+        settings.apply()
 
     def _load_template(self):
         """
@@ -2358,7 +2638,8 @@ class OVZNetworkInterfaces(object):
             raise exception.Error(_('Variant %(variant)s is not known',
                                     locals()))
 
-    def _add_netif(self, instance_id, netif, bridge, host_mac):
+    def _add_netif(self, instance_id, netif, bridge, host_mac,
+                   settings=None):
         """
         I am a work around to add the eth devices the way OpenVZ
         wants them.
@@ -2366,29 +2647,19 @@ class OVZNetworkInterfaces(object):
         When I work, I run a command similar to this:
         vzctl set 1 --save --netif_add \
             eth0,,veth1.eth0,11:11:11:11:11:11,br100
-        """
-        try:
-            # Command necessary to create a bridge networking setup.
-            # right now this is the only supported networking model
-            # in the openvz connector.
-            host_if = 'veth%s.%s' % (instance_id, netif)
-
-            out, err = utils.execute('vzctl', 'set', instance_id,
-                                     '--save', '--netif_add',
-                                     '%s,,%s,%s,%s' %
-                                     (netif, host_if, host_mac, bridge),
-                                     run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
 
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            raise exception.Error(
-                    'Error adding network device to container %s' %
-                    instance_id)
+        Given settings, the device is queued on them instead.
+        """
+        # Command necessary to create a bridge networking setup.
+        # right now this is the only supported networking model
+        # in the openvz connector.
+        host_if = 'veth%s.%s' % (instance_id, netif)
+        self._vzctl_add(instance_id, settings, '--netif_add',
+                        '%s,,%s,%s,%s' % (netif, host_if, host_mac, bridge),
+                        'Error adding network device to container %s' %
+                        instance_id)
 
-    def _add_ip(self, instance_id, ip):
+    def _add_ip(self, instance_id, ip, settings=None):
         """
         I add an IP address to a container if you are not using veth devices.
 
@@ -2399,20 +2670,13 @@ class OVZNetworkInterfaces(object):
         If I fail to run an exception is raised as this indicates a failure to
         create a network available connection within the container thus making
         it unusable to all but local users and therefore unusable to nova.
+        Given settings, the address is queued on them instead.
         """
-        try:
-            out, err = utils.execute('vzctl', 'set', instance_id,
-                                     '--save', '--ipadd', ip, run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
+        self._vzctl_add(instance_id, settings, '--ipadd', ip,
+                        _('Error adding %(ip)s to %(instance_id)s' %
+                          {'ip': ip, 'instance_id': instance_id}))
 
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            raise exception.Error(_('Error adding %(ip)s to %(instance_id)s' %
-                                    {'ip': ip, 'instance_id': instance_id}))
-
-    def _set_nameserver(self, instance_id, dns):
+    def _set_nameserver(self, instance_id, dns, settings=None):
         """
         Get the nameserver for the assigned network and set it using
         OpenVz's tools.
@@ -2422,19 +2686,23 @@ class OVZNetworkInterfaces(object):
         vzctl set <ctid> --save --nameserver <nameserver>
 
         If I fail to run an exception is raised as this will indicate
-        the container's inability to do name resolution.
+        the container's inability to do name resolution.  Given settings,
+        the nameserver is queued on them instead.
         """
-        try:
-            out, err = utils.execute('vzctl', 'set', instance_id,
-                                     '--save', '--nameserver', dns,
-                                     run_as_root=True)
-            LOG.debug(_('Stdout output from vzctl: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzctl: %s') % err)
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzctl: %s') % err)
-            raise exception.Error(_('Unable to set nameserver for %s') %
-            instance_id)
+        self._vzctl_add(instance_id, settings, '--nameserver', dns,
+                        _('Unable to set nameserver for %s') % instance_id)
+
+    def _vzctl_add(self, instance_id, settings, option, value, error_msg):
+        """
+        Queue the option on the settings, or save it right away if no
+        settings are given.
+        """
+        if settings is None:
+            settings = OVZSettings(instance_id)
+            settings.add(option, value, error_msg)
+            settings.apply()
+        else:
+            settings.add(option, value, error_msg)
 
 
 class OVZNetworkFile(OVZFile):
@@ -27,6 +27,7 @@ from nova import wsgi
 from reddwarf.api import accounts
 from reddwarf.api import config
 from reddwarf.api import databases
+from reddwarf.api import dbstats
 from reddwarf.api import diagnostics
 from reddwarf.api import images
 from reddwarf.api import instances
@@ -141,6 +142,13 @@ class APIRouter(wsgi.Router):
                             controller=accounts.create_resource(),
                             action="show", conditions=dict(method=["GET"]))
 
+            with mapper.submapper(path_prefix="/{project_id}/mgmt/dbstats",
+                                  controller=dbstats.create_resource()) as m:
+                m.connect("", action="index",
+                          conditions=dict(method=["GET"]))
+                m.connect("", action="delete",
+                          conditions=dict(method=["DELETE"]))
+
             mapper.resource("config", "configs",
                             controller=config.create_resource(),
                             path_prefix="mgmt")
@@ -17,6 +17,7 @@ Common shared code across DBaaS API
 """
 
 from nova import exception as nova_exception
+from nova import flags
 from nova import log as logging
 from nova.compute import power_state
 from nova.db.sqlalchemy.api import is_admin_context
@@ -28,6 +29,7 @@ from reddwarf.guest.db import models
 
 XML_NS_V10 = 'http://docs.openstack.org/database/api/v1.0'
 LOG = logging.getLogger('reddwarf.api.common')
+FLAGS = flags.FLAGS
 
 dbaas_mapping = {
     None: 'BUILD',
@@ -98,6 +100,25 @@ def instance_available(ctxt, instance_id, local_id, compute_api):
         LOG.debug(msg)
         raise exception.UnprocessableEntity(msg)
 
+def get_pagination_params(req):
+    """Return the local id marker and limit for a listing request.
+
+    The marker is the uuid of the last instance seen by the client.
+    """
+    marker = req.GET.get('marker', None)
+    if marker is not None:
+        marker = dbapi.localid_from_uuid(marker)
+    limit = FLAGS.osapi_max_limit
+    if 'limit' in req.GET:
+        try:
+            limit = int(req.GET['limit'])
+        except ValueError:
+            raise exception.BadRequest("limit param must be an integer")
+        if limit < 0:
+            raise exception.BadRequest("limit param must be positive")
+        limit = min(limit or FLAGS.osapi_max_limit, FLAGS.osapi_max_limit)
+    return marker, limit
+
 def verify_admin_context(f):
     """
     Verify that the current context has administrative access,
@@ -0,0 +1,90 @@
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import webob
+
+from nova import flags
+from nova import log as logging
+from nova.api.openstack import wsgi
+from nova.db.sqlalchemy import session
+
+from reddwarf.api import common
+from reddwarf.guest import api as guest_api
+
+LOG = logging.getLogger('reddwarf.api.dbstats')
+LOG.setLevel(logging.DEBUG)
+
+
+FLAGS = flags.FLAGS
+
+
+class Controller(object):
+    """ The Database Statistics Controller for the Platform API """
+
+    def __init__(self):
+        super(Controller, self).__init__()
+
+    @common.verify_admin_context
+    def index(self, req):
+        """List the sql statement and guest listing cache counters of this
+           API process"""
+        LOG.info("List the sql statement counters")
+        LOG.debug("%s - %s", req.environ, req.body)
+        stats = session.get_query_stats()
+        functions = [{'name': name,
+                      'count': function['count'],
+                      'time': function['time'],
+                      'maxTime': function['max_time'],
+                      'rows': function['rows']}
+                     for name, function in sorted(stats['functions'].items())]
+        cache_stats = guest_api.get_result_cache_stats()
+        return {'dbstats': {'enabled': FLAGS.sql_instrument,
+                            'slowQueries': stats['slow_queries'],
+                            'functions': functions,
+                            'guestResultCache': cache_stats}}
+
+    @common.verify_admin_context
+    def delete(self, req):
+        """Reset the sql statement counters of this API process"""
+        LOG.info("Reset the sql statement counters")
+        session.reset_query_stats()
+        return webob.Response(status_int=202)
+
+
+def create_resource(version='1.0'):
+    controller = {
+        '1.0': Controller,
+    }[version]()
+
+    metadata = {
+        "attributes": {
+            "dbstats": ["enabled", "slowQueries"],
+            "function": ["name", "count", "time", "maxTime", "rows"],
+            "guestResultCache": ["hits", "misses", "evictions", "size"],
+        },
+    }
+
+    xmlns = {
+        '1.0': common.XML_NS_V10,
+    }[version]
+
+    serializers = {
+        'application/xml': wsgi.XMLDictSerializer(metadata=metadata,
+                                                  xmlns=xmlns),
+    }
+
+    response_serializer = wsgi.ResponseSerializer(body_serializers=serializers)
+
+    return wsgi.Resource(controller, serializer=response_serializer)
@@ -25,6 +25,7 @@ from nova import exception as nova_exception
 from nova import flags
 from nova import log as logging
 from nova import quota
+from nova import utils
 from nova.api.openstack import common as nova_common
 from nova.api.openstack import faults
 from nova.api.openstack import servers
@@ -193,19 +194,10 @@ class Controller(object):
         """ Returns a list of instance names and ids for a given user """
         LOG.info("Call to Instances index")
         LOG.debug("%s - %s", req.environ, req.body)
-        servers_response = self.server_controller.index(req)
-        server_list = servers_response['servers']
-        context = req.environ['nova.context']
-
-        # Instances need the status for each instance in all circumstances,
-        # unlike servers.
-        server_states = dbapi.instance_state_get_all_filtered(context)
-        for server in server_list:
-            state = server_states[server['id']]
-            server['status'] = nova_common.status_from_state(state)
-
+        server_list, guest_statuses = self._get_servers(req,
+                                                        is_detail=False)
         id_list = [server['id'] for server in server_list]
-        status_lookup = InstanceStatusLookup(id_list)
+        status_lookup = InstanceStatusLookup(id_list, guest_statuses)
         instances = [self.view.build_index(server, req, status_lookup)
                         for server in server_list]
         return {'instances': instances}
@@ -213,13 +205,120 @@ class Controller(object):
     def detail(self, req):
         """ Returns a list of instance details for a given user """
         LOG.debug("%s - %s", req.environ, req.body)
-        server_list = self.server_controller.detail(req)['servers']
+        server_list, guest_statuses = self._get_servers(req, is_detail=True)
         id_list = [server['id'] for server in server_list]
-        status_lookup = InstanceStatusLookup(id_list)
+        status_lookup = InstanceStatusLookup(id_list, guest_statuses)
         instances = [self.view.build_detail(server, req, status_lookup)
                         for server in server_list]
         return {'instances': instances}
 
+    def _get_servers(self, req, is_detail):
+        """Returns the servers for one page of instances, and their guest
+        statuses if they were loaded along the way, or else None.
+
+        Only the page is loaded from the database, along with the instance
+        types and volumes for the detail view. Searches the database can't
+        do are left to the servers API.
+        """
+        context = req.environ['nova.context']
+        try:
+            filters = self._get_filters(context, req.GET)
+            marker, limit = common.get_pagination_params(req)
+            joins = ['instance_type'] if is_detail else []
+            instance_list = db.instance_get_page_by_filters(context, filters,
+                                                            joins, marker,
+                                                            limit)
+        except nova_exception.InvalidInput:
+            return self._get_servers_from_servers_api(req, is_detail)
+        volumes = {}
+        if is_detail:
+            id_list = [instance['id'] for instance in instance_list]
+            volumes = dbapi.volume_get_all_by_instances(context, id_list)
+        server_list = [self._build_server(instance, is_detail,
+                                          volumes.get(instance['id']))
+                       for instance in instance_list]
+        return server_list, None
+
+    def _get_servers_from_servers_api(self, req, is_detail):
+        context = req.environ['nova.context']
+        if is_detail:
+            return self.server_controller.detail(req)['servers'], None
+        server_list = self.server_controller.index(req)['servers']
+        # Instances need the status for each instance in all circumstances,
+        # unlike servers. The guest statuses are loaded in the same query.
+        id_list = [server['id'] for server in server_list]
+        server_states, guest_statuses = \
+            dbapi.instance_state_and_guest_status_get_list(context, id_list)
+        for server in server_list:
+            state = server_states[server['id']]
+            server['status'] = nova_common.status_from_state(state)
+        return server_list, guest_statuses
+
+    @staticmethod
+    def _get_filters(context, search_opts):
+        """Converts the search options to instance filters.
+
+        Raises InvalidInput for options the database can't search by.
+        """
+        filters = {}
+        for opt, value in search_opts.iteritems():
+            if opt in ('marker', 'limit'):
+                continue
+            elif opt == 'name':
+                filters['display_name'] = value
+            elif opt == 'image':
+                filters['image_ref'] = value
+            elif opt == 'reservation_id':
+                filters['reservation_id'] = value
+            elif opt == 'status':
+                state = nova_common.vm_state_from_status(value)
+                if state is None:
+                    reason = _('Invalid server status: %s') % value
+                    raise exception.BadRequest(reason)
+                filters['vm_state'] = state
+            elif opt == 'flavor':
+                try:
+                    instance_type = db.instance_type_get_by_flavor_id(
+                        context, value)
+                except nova_exception.NotFound:
+                    raise exception.NotFound()
+                filters['instance_type_id'] = instance_type['id']
+            elif opt == 'changes-since':
+                try:
+                    filters['changes-since'] = utils.parse_isotime(value)
+                except ValueError:
+                    raise exception.BadRequest(_('Invalid changes-since '
+                                                 'value'))
+            else:
+                reason = _("%s can not be searched in the database") % opt
+                raise nova_exception.InvalidInput(reason=reason)
+        if 'changes-since' not in filters:
+            filters['deleted'] = False
+        return filters
+
+    @staticmethod
+    def _build_server(instance, is_detail, volumes=None):
+        """Builds the part of a servers API server the views use."""
+        server = {'id': instance['id'],
+                  'uuid': instance['uuid'],
+                  'name': instance['display_name']}
+        if not is_detail:
+            # The index has always shown the status of the power state.
+            server['status'] = nova_common.status_from_state(
+                instance['power_state'])
+            return server
+        server['status'] = nova_common.status_from_state(
+            instance['vm_state'], instance['task_state'])
+        server['created'] = utils.isotime(instance['created_at'])
+        server['updated'] = utils.isotime(instance['updated_at'])
+        if instance['instance_type']:
+            flavor_id = str(instance['instance_type']['flavorid'])
+            server['flavor'] = {'id': flavor_id}
+        server['hostname'] = instance['hostname']
+        if volumes:
+            server['volumes'] = volumes
+        return server
+
     def show(self, req, id):
         """ Returns instance details by instance id """
         LOG.info("Get Instance by ID - %s", id)
@@ -434,14 +533,15 @@ class Controller(object):
 
     def _get_guest_info(self, context, id):
         """Get the root and volume information from the guest"""
-        root_enabled = None
-        volume_info = None
-        try:
-            root_enabled = self.guest_api.is_root_enabled(context, id)
-            volume_info = self.guest_api.get_volume_info(context, id)
-        except Exception as err:
-            LOG.error(err)
+        summary = self.guest_api.get_instance_summary(context, id)
+        root_enabled = summary['root_enabled']
+        volume_info = summary['volume_info']
+        if isinstance(root_enabled, exception.GuestError):
+            LOG.error("Guest not responding on instance %s" % id)
+            root_enabled = None
+        if isinstance(volume_info, exception.GuestError):
             LOG.error("Guest not responding on instance %s" % id)
+            volume_info = None
         return root_enabled, volume_info
 
     @staticmethod
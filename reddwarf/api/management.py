@@ -18,6 +18,7 @@ import webob
 from nova import exception as nova_exception
 from nova import flags
 from nova import log as logging
+from nova import utils
 
 from nova.api.openstack import servers
 from nova.api.openstack import wsgi
@@ -37,6 +38,9 @@ LOG = logging.getLogger('reddwarf.api.management')
 LOG.setLevel(logging.DEBUG)
 
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('reddwarf_mgmt_index_stream_batch_size', 500,
+                     'Number of instances fetched from the database per '
+                     'batch when streaming the management instance index')
 
 def create_resource(version='1.0'):
     controller = {
@@ -136,13 +140,17 @@ class Controller(object):
         status_lookup = InstanceStatusLookup([instance_id])
         status = status_lookup.get_status_from_server(server)
 
-        # Lookup additional volume information
+        # Lookup the volume information, databases and users in one go
+        summary = None
         volume_info = None
-        try:
-            if status.is_sql_running:
-                volume_info = self.guest_api.get_volume_info(context, server['id'])
-        except exception.GuestError as err:
-            LOG.warn("Skipping Volume information as guest is not yet available")
+        if status.is_sql_running:
+            summary = self.guest_api.get_instance_summary(
+                context, instance_id, include_root_enabled=False,
+                include_databases=True)
+            volume_info = summary['volume_info']
+            if isinstance(volume_info, exception.GuestError):
+                LOG.warn("Skipping Volume information as guest is not yet available")
+                volume_info = None
 
         instance = self.instance_view.build_mgmt_single(server,
                                                         instance_ref,
@@ -151,7 +159,7 @@ class Controller(object):
                                                         volume_info)
         try:
             instance = self._get_guest_info(context, instance_id, status,
-                                            instance)
+                                            instance, summary)
 
         except Exception as err:
             msg = "Unable to retrieve information from the guest"
@@ -163,7 +171,9 @@ class Controller(object):
 
     @common.verify_admin_context
     def index(self, req):
-        """ Returns all local instances, optionally filtered by deleted status."""
+        """ Returns a page of local instances, optionally filtered by deleted
+            status. Passing stream=true returns every instance as a
+            streamed JSON response instead."""
         LOG.info("Get all Instances")
         LOG.debug("%s - %s", req.environ, req.body)
         dfilter = req.GET.get('deleted', None)
@@ -175,52 +185,62 @@ class Controller(object):
                 deleted = False
 
         context = req.environ['nova.context']
-        instances, flavors, ips = dbapi.instances_mgmt_index(context, deleted)
-        result = []
-        for instance in instances:
-            details = {
-                'account_id': instance['project_id'],
-                'id': instance['uuid'],
-                'host': instance['host'],
-                'status': instance['vm_state'],
-                'created_at': instance['created_at'],
-                'deleted_at': instance['deleted_at'],
-                'deleted': instance['deleted'],
-            }
-            # Associate the flavor.
-            # TODO(ed-): Should probably make the relational database do all the data relating.
-            flavor = [f for f in flavors if f['id'] == instance['instance_type_id']]
-            if len(flavor) > 0:
-                flavor = flavor[0]
-                details['flavorid'] = flavor['flavorid']
-
-            # Now associate the IPs.
-            # TODO(ed-): A join would be preferable.
-            instance_ips = filter((lambda ip: ip['instance_id'] == instance['id']), ips)
-            details['ips'] = [{
-                'address': ip['address'],
-                'virtual_interface_id': ip['virtual_interface_id'],
-                } for ip in instance_ips]
-
-            # Associate storage
-            if instance['volumes']:
-                details['volumes'] = [{
-                    'size': volume['size'],
-                    'mountpoint': volume['mountpoint']
-                } for volume in instance['volumes']]
-            else:
-                details['volumes'] = []
-
-            result.append(details)
-
+        marker, limit = common.get_pagination_params(req)
+        stream = req.GET.get('stream', '').lower() in ['true']
+        if stream and req.best_match_content_type() == 'application/json':
+            return self._stream_index(context, deleted, marker)
+
+        instances, ips, volumes = dbapi.instances_mgmt_index(context,
+                                                             deleted,
+                                                             marker,
+                                                             limit)
+        result = [self.instance_view.build_mgmt_index(instance, ips, volumes)
+                  for instance in instances]
         return {"instances": result}
 
-    def _get_guest_info(self, context, id, status, instance):
-        """Get all the guest details and add it to the response"""
+    def _stream_index(self, context, deleted, marker):
+        """Stream every instance after the marker as JSON, fetching the
+        instances from the database one batch at a time."""
+        batch_size = FLAGS.reddwarf_mgmt_index_stream_batch_size
+
+        def generate(marker):
+            yield '{"instances": ['
+            separator = ''
+            while True:
+                instances, ips, volumes = dbapi.instances_mgmt_index(
+                    context, deleted, marker, batch_size)
+                for instance in instances:
+                    details = self.instance_view.build_mgmt_index(instance,
+                                                                  ips,
+                                                                  volumes)
+                    yield separator + utils.dumps(details)
+                    separator = ', '
+                if len(instances) < batch_size:
+                    break
+                marker = instances[-1]['id']
+            yield ']}'
+
+        return webob.Response(app_iter=generate(marker),
+                              content_type='application/json')
+
+    def _get_guest_info(self, context, id, status, instance, summary=None):
+        """Get all the guest details and add it to the response
+
+        The databases and users are taken from the guest summary if given,
+        otherwise it is fetched from the guest.
+        """
         dbs = []
         users = []
         if status.is_sql_running:
-            db_list = self.guest_api.list_databases(context, id)
+            if summary is None:
+                summary = self.guest_api.get_instance_summary(
+                    context, id, include_root_enabled=False,
+                    include_databases=True)
+            db_list = summary['databases']
+            users = summary['users']
+            for result in (db_list, users):
+                if isinstance(result, exception.GuestError):
+                    raise result
 
             LOG.debug("DBS: %r" % db_list)
             dbs = [{
@@ -228,7 +248,6 @@ class Controller(object):
                     'collate': db['_collate'],
                     'character_set': db['_character_set']
                     } for db in db_list]
-            users = self.guest_api.list_users(context, id)
             users = [{'name': user['_name']} for user in users]
 
         root_access = dbapi.get_root_enabled_history(context, id)
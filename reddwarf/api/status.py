@@ -109,10 +109,18 @@ class InstanceStatusLookup(object):
     quickly return InstanceStatus objects when given the compute instance
     component.
     """
-    def __init__(self, guest_ids):
+    def __init__(self, guest_ids, guest_status_mapping=None):
+        """
+        If the guest statuses were already loaded, for example by
+        dbapi.instance_state_and_guest_status_get_list, they can be passed in
+        as a dictionary mapping instance IDs to GuestStatus to avoid looking
+        them up again.
+        """
         self.local_ids = guest_ids
-        lookup = dbapi.guest_status_get_list(self.local_ids).all()
-        self.guest_status_mapping = dict([(r.instance_id, r) for r in lookup])
+        if guest_status_mapping is None:
+            lookup = dbapi.guest_status_get_list(self.local_ids).all()
+            guest_status_mapping = dict([(r.instance_id, r) for r in lookup])
+        self.guest_status_mapping = guest_status_mapping
 
     def get_status_from_id(self, context, id):
         """Loads a compute instance ref to grab the instance status."""
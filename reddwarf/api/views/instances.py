@@ -151,6 +151,28 @@ class MgmtViewBuilder(ViewBuilder):
             instance['volume']['used'] = _to_gb(volume_info['used'])
         return instance
 
+    def build_mgmt_index(self, instance, ips, volumes):
+        """Build out the management index view for a single instance.
+
+        :param instance: instance dict from dbapi.instances_mgmt_index
+        :param ips: dict of local instance id to a list of fixed ips
+        :param volumes: dict of local instance id to a list of volumes
+        """
+        details = {
+            'account_id': instance['project_id'],
+            'id': instance['uuid'],
+            'host': instance['host'],
+            'status': instance['vm_state'],
+            'created_at': instance['created_at'],
+            'deleted_at': instance['deleted_at'],
+            'deleted': instance['deleted'],
+            'ips': ips.get(instance['id'], []),
+            'volumes': volumes.get(instance['id'], []),
+        }
+        if instance['flavorid'] is not None:
+            details['flavorid'] = instance['flavorid']
+        return details
+
     def build_guest_info(self, instance, status=None, dbs=None, users=None,
                          root_enabled=None):
         """Build out all possible information for a guest"""
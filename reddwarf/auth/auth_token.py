@@ -44,11 +44,15 @@ HTTP_X_AUTHORIZATION: the client identity being passed in
 
 import base64
 import json
+import sys
+import time
 
-from beaker.cache import CacheManager
 from datetime import datetime
+from eventlet import pools
 from eventlet import wsgi
+from eventlet.event import Event
 from eventlet.green import httplib
+from eventlet.green import socket
 from paste.deploy import loadapp
 
 from nova import log as logging
@@ -56,15 +60,37 @@ from nova import flags
 from nova.api.openstack import faults
 
 from reddwarf import exception
+from reddwarf import utils
 
 FLAGS = flags.FLAGS
 flags.DEFINE_integer('reddwarf_auth_cache_expire_time', 60*5,
                      'Time in seconds for the cache to expire user tokens')
+flags.DEFINE_integer('reddwarf_auth_negative_cache_expire_time', 30,
+                     'Time in seconds for the cache to expire tokens the '
+                     'auth service rejected')
+flags.DEFINE_integer('reddwarf_auth_cache_size', 10000,
+                     'Maximum number of validated tokens to cache')
+flags.DEFINE_integer('reddwarf_auth_pool_size', 10,
+                     'Maximum number of connections kept open to the auth '
+                     'service')
 
 LOG = logging.getLogger(__name__)
 
 PROTOCOL_NAME = "Token Authentication"
 
+# Shared by every AuthProtocol in the process. Created on first use as the
+# flags are not parsed when this is imported.
+TOKEN_CACHE = None
+
+
+def _get_token_cache():
+    global TOKEN_CACHE
+    if TOKEN_CACHE is None:
+        TOKEN_CACHE = utils.LRUCache(FLAGS.reddwarf_auth_cache_size,
+                                     ttl=FLAGS.reddwarf_auth_cache_expire_time)
+    return TOKEN_CACHE
+
+
 class AuthProtocol(object):
     """Auth Middleware that handles authenticating client calls"""
 
@@ -100,6 +126,10 @@ class AuthProtocol(object):
             self.service_auth_path = "/v2.0/tokens"
             self._expound_claims = self._expound_claims_2_0
 
+        self.http = HTTPConnectionPool(self.auth_protocol, self.auth_host,
+                                       self.auth_port,
+                                       FLAGS.reddwarf_auth_pool_size)
+
         # Credentials used to verify this component with the Auth service since
         # validating tokens is a privileged call
         service_user = conf.get('service_user')
@@ -109,10 +139,15 @@ class AuthProtocol(object):
         self.basic_auth = base64.b64encode("%(service_user)s:%(service_pass)s"
                                            % locals())
 
-        # Create cache manager
-        self.cache_type = conf.get('cache_type', 'memory')
-        cm = CacheManager(type=self.cache_type)
-        self.cache = cm.get_cache('dbaas')
+        self.cache = _get_token_cache()
+        # Validations in progress, so concurrent requests presenting the same
+        # uncached claims wait on one call to the auth service.
+        self.pending_validations = {}
+        self.validations = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.validation_time = 0.0
+        self.max_validation_time = 0.0
 
     def __call__(self, env, start_response):
         """ Handle incoming request. Authenticate. And send downstream. """
@@ -129,39 +164,20 @@ class AuthProtocol(object):
             # No claim(s) provided
             return self._reject_request(env, start_response)
 
-        #set the caching key to the concatenation of claim and tenant
-        cache_key = "%s/%s" % (claims,tenant)
-
         # this request is presenting claims. Let's validate them
-        #TODO(cp16net) what happens with 1000s of users being cached?
-        if self.cache.has_key(cache_key):
-            # get the cached values
-            data, status = self.cache.get_value(cache_key)
-            valid = self._validate_status(status)
-
-            if not valid:
-                # Keystone rejected claim
-                return self._reject_claims(env, start_response)
-        else:
-            # need to get the values and then cache them if valid
-            try:
-                data, status = self._validate_token(claims, tenant)
-            except :
-                msg = ("Authorization Service is not available at this "
-                       "time for (tenant=%s)." % tenant)
-                LOG.error(msg)
-                return faults.Fault(exception.ServiceUnavailable(msg)) \
-                                    (env, start_response)
+        try:
+            data, status = self._get_validation(claims, tenant)
+        except :
+            msg = ("Authorization Service is not available at this "
+                   "time for (tenant=%s)." % tenant)
+            LOG.error(msg)
+            return faults.Fault(exception.ServiceUnavailable(msg)) \
+                                (env, start_response)
 
-            valid = self._validate_status(status)
-            if not valid:
-                # rejected claim because claims are not valid
-                return self._reject_claims(env, start_response)
-            else:
-                # claim is valid so cache the result from validation
-                cache_key = "%s/%s" % (claims,tenant)
-                self.cache.set_value(cache_key, (data, status),
-                                     expiretime=FLAGS.reddwarf_auth_cache_expire_time)
+        valid = self._validate_status(status)
+        if not valid:
+            # rejected claim because claims are not valid
+            return self._reject_claims(env, start_response)
 
         self._decorate_request("X_IDENTITY_STATUS", "Confirmed", env,
                                proxy_headers)
@@ -175,6 +191,67 @@ class AuthProtocol(object):
 
         return self.app(env, start_response)
 
+    def _get_validation(self, claims, tenant):
+        """Return the data and status of validating the claims, from the
+        cache or from the one validation in progress if possible."""
+        #set the caching key to the concatenation of claim and tenant
+        cache_key = "%s/%s" % (claims, tenant)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        pending = self.pending_validations.get(cache_key)
+        if pending is not None:
+            self.coalesced += 1
+            return pending.wait()
+        pending = Event()
+        self.pending_validations[cache_key] = pending
+        try:
+            result = self._timed_validate_token(claims, tenant)
+            self._cache_validation(cache_key, result)
+        except:
+            exc_info = sys.exc_info()
+            self.errors += 1
+            pending.send_exception(*exc_info)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        finally:
+            del self.pending_validations[cache_key]
+        pending.send(result)
+        return result
+
+    def _timed_validate_token(self, claims, tenant):
+        start = time.time()
+        try:
+            return self._validate_token(claims, tenant)
+        finally:
+            elapsed = time.time() - start
+            self.validations += 1
+            self.validation_time += elapsed
+            self.max_validation_time = max(self.max_validation_time, elapsed)
+
+    def _cache_validation(self, cache_key, result):
+        """Cache valid claims, and for a shorter time rejected ones. Errors
+        of the auth service are not cached."""
+        data, status = result
+        if self._validate_status(status):
+            self.cache.set(cache_key, result)
+        elif status < 500:
+            self.cache.set(cache_key, result,
+                           ttl=FLAGS.reddwarf_auth_negative_cache_expire_time)
+
+    def get_stats(self):
+        """Return the token cache counts and the validation counts and
+        latency."""
+        stats = self.cache.get_stats()
+        average = 0.0
+        if self.validations:
+            average = self.validation_time / self.validations
+        stats.update({'validations': self.validations,
+                      'coalesced': self.coalesced,
+                      'errors': self.errors,
+                      'average_validation_time': average,
+                      'max_validation_time': self.max_validation_time})
+        return stats
+
     def _retrieve_tenant(self, env):
         # Retrieve the tenant/accountid from the url
         path_info = env.get('PATH_INFO', '/')
@@ -207,12 +284,9 @@ class AuthProtocol(object):
                    'Accept': 'application/json'}
         request_body = {'passwordCredentials': {'username': username,
                                                 'password': password}}
-        conn = get_connection(self.auth_protocol, self.auth_host,
-                              self.auth_port)
-        conn.request("POST", self.service_auth_path, json.dumps(request_body),
-                     headers=headers)
-        response = conn.getresponse()
-        data = response.read()
+        response, data = self.http.request("POST", self.service_auth_path,
+                                           json.dumps(request_body),
+                                           headers=headers)
         try:
             if not data or not self._validate_status(response.status):
                 if response.status == 302:
@@ -250,14 +324,9 @@ class AuthProtocol(object):
                    'X-Auth-Token': self.admin_token,
                    'Authorization': 'Basic %s' % self.basic_auth}
 
-        conn = get_connection(self.auth_protocol, self.auth_host,
-                              self.auth_port)
-        conn.request("GET", "%s/%s?belongsTo=%s&type=%s" %
-                     (self.validate_token_path, claims, tenant, self.auth_type),
-                     headers=headers)
-        response = conn.getresponse()
-        data = response.read()
-        conn.close()
+        response, data = self.http.request("GET", "%s/%s?belongsTo=%s&type=%s"
+            % (self.validate_token_path, claims, tenant, self.auth_type),
+            headers=headers)
         return data, response.status
 
     def _validate_status(self, status):
@@ -338,3 +407,41 @@ def get_connection(type, host, port):
         return httplib.HTTPSConnection("%(host)s:%(port)s" % locals())
     else:
         return httplib.HTTPConnection("%(host)s:%(port)s" % locals())
+
+
+class HTTPConnectionPool(pools.Pool):
+    """Keeps connections to the auth service open between requests."""
+
+    def __init__(self, type, host, port, max_size):
+        self.type = type
+        self.host = host
+        self.port = port
+        super(HTTPConnectionPool, self).__init__(max_size=max_size)
+
+    def create(self):
+        return get_connection(self.type, self.host, self.port)
+
+    def request(self, method, path, body=None, headers=None):
+        """Return the response and its body.
+
+        If the connection was closed while idle the request is retried once,
+        which reopens it.
+
+        """
+        conn = self.get()
+        try:
+            try:
+                return self._request(conn, method, path, body, headers)
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                return self._request(conn, method, path, body, headers)
+        except:
+            conn.close()
+            raise
+        finally:
+            self.put(conn)
+
+    def _request(self, conn, method, path, body, headers):
+        conn.request(method, path, body, headers=headers or {})
+        response = conn.getresponse()
+        return response, response.read()
@@ -16,12 +16,16 @@
 #    under the License.
 
 import json
+import time
 
+from eventlet.event import Event
 from eventlet.timeout import Timeout
 
 from nova import flags
 from nova import log as logging
 from nova import exception as nova_exception
+from nova import rpc
+from nova import utils
 
 from nova.compute import instance_types
 from nova.compute import power_state
@@ -44,6 +48,10 @@ from reddwarf.utils import poll_until
 flags.DEFINE_integer('reddwarf_guest_initialize_time_out', 10 * 60,
                      'Time in seconds for a guest to initialize before it is '
                      'considered a failure and aborted.')
+flags.DEFINE_integer('reddwarf_guest_status_poll_interval', 30,
+                     'Time in seconds between checks of the guest status '
+                     'in the database while waiting for a guest to '
+                     'initialize, in case its status notification is lost.')
 flags.DEFINE_integer('reddwarf_guest_update_time_out', 10 * 60,
                      'Time in seconds for the guest update to finish before '
                      'the manager presumes it to have failed.')
@@ -53,6 +61,11 @@ flags.DEFINE_integer('reddwarf_instance_suspend_time_out', 3 * 60,
 flags.DEFINE_integer('reddwarf_volume_time_out', 10 * 60,
                      'Time in seconds for an instance to wait for a volume '
                      'to be provisioned before aborting.')
+flags.DEFINE_boolean('reddwarf_notify_scheduler_of_deletes', False,
+                     'Tell the schedulers when an instance is deleted so the '
+                     'memory scheduler can reuse its memory right away. Only '
+                     'enable it with the memory scheduler, as other drivers '
+                     'pass the message on to a random compute host.')
 
 FLAGS = flags.FLAGS
 LOG = logging.getLogger(__name__)
@@ -75,6 +88,39 @@ def notify_of_failure(context, event_type, exception, audit_msg, err_values):
     notifier.notify(publisher_id(), event_type, notifier.ERROR, err_values)
 
 
+class GuestStatusWaiters(object):
+    """Wakes greenthreads waiting on a guest when it reports a new status.
+
+    Guests send a guest_status_changed cast to the compute node of their
+    instance whenever their status changes, so waiters don't have to poll
+    the database.
+
+    """
+
+    def __init__(self):
+        self.events = {}
+
+    def watch(self, instance_id):
+        """Returns an event sent on the next status change of the guest.
+
+        Call this before checking the status in the database so a change
+        made in between is not missed.
+
+        """
+        instance_id = int(instance_id)
+        if instance_id not in self.events:
+            self.events[instance_id] = Event()
+        return self.events[instance_id]
+
+    def forget(self, instance_id):
+        self.events.pop(int(instance_id), None)
+
+    def notify(self, instance_id, state):
+        event = self.events.pop(int(instance_id), None)
+        if event is not None:
+            event.send(state)
+
+
 class ReddwarfInstanceMetaData(object):
     """Represents standard Reddwarf instance metadata."""
 
@@ -181,13 +227,19 @@ class ReddwarfInstanceInitializer(object):
             self._abort_guest_install()
             return False
 
-    def wait_for_guest(self, guest_api):
-        """Wait for the guest to come up and abort if it fails or times out."""
+    def wait_for_guest(self, guest_api, waiters=None):
+        """Wait for the guest to come up and abort if it fails or times out.
+
+        The guest status is checked whenever the guest notifies the waiters
+        of a change, and every reddwarf_guest_status_poll_interval seconds
+        in case a notification is lost.
+
+        """
+        if waiters is None:
+            waiters = GuestStatusWaiters()
         try:
-            poll_until(lambda : dbapi.guest_status_get(self.instance_id),
-                       lambda status : status.state == power_state.RUNNING,
-                       sleep_time=2,
-                       time_out=FLAGS.reddwarf_guest_initialize_time_out)
+            self._wait_until_guest_is_running(waiters,
+                FLAGS.reddwarf_guest_initialize_time_out)
             LOG.info("Guest is now running on instance %s" % self.instance_id)
             return True
         except exception.PollTimeOut as pto:
@@ -199,6 +251,24 @@ class ReddwarfInstanceInitializer(object):
             self._abort_guest_install()
             return False
 
+    def _wait_until_guest_is_running(self, waiters, time_out):
+        deadline = time.time() + time_out
+        try:
+            while True:
+                event = waiters.watch(self.instance_id)
+                status = dbapi.guest_status_get(self.instance_id)
+                if status.state == power_state.RUNNING:
+                    return
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise exception.PollTimeOut()
+                wait_time = min(remaining,
+                                FLAGS.reddwarf_guest_status_poll_interval)
+                with Timeout(wait_time, False):
+                    event.wait()
+        finally:
+            waiters.forget(self.instance_id)
+
     def initialize_compute_instance(self, **kwargs):
         """Runs underlying compute instance and aborts if any errors occur."""
         try:
@@ -268,6 +338,7 @@ class ReddwarfComputeManager(ComputeManager):
     def __init__(self, *args, **kwargs):
         super(ReddwarfComputeManager, self).__init__(*args, **kwargs)
         self.guest_api = guest.API()
+        self.guest_waiters = GuestStatusWaiters()
         self.compute_manager = super(ReddwarfComputeManager, self)
 
     def resize_in_place(self, context, instance_id, new_instance_type_id):
@@ -353,16 +424,64 @@ class ReddwarfComputeManager(ComputeManager):
         occur when the REST API is called.
 
         """
+        start_time = time.time()
         metadata = ReddwarfInstanceMetaData(self.db, context, instance_id)
         instance = ReddwarfInstanceInitializer(self.compute_manager, self.db,
             context, instance_id, metadata.volume_id, metadata.volume,
             metadata.volume_mount_point, metadata.databases, metadata.users)
         # If any steps return False, cancel subsequent steps.
-        (instance.initialize_volume(self.volume_api,
-                                    self.volume_client, self.host) and
-         instance.initialize_guest(self.guest_api) and
-         instance.initialize_compute_instance(**kwargs) and
-         instance.wait_for_guest(self.guest_api))
+        if (instance.initialize_volume(self.volume_api,
+                                       self.volume_client, self.host) and
+            instance.initialize_guest(self.guest_api) and
+            instance.initialize_compute_instance(**kwargs) and
+            instance.wait_for_guest(self.guest_api, self.guest_waiters)):
+            self._notify_of_active(context, instance_id, start_time)
+
+    def _notify_of_active(self, context, instance_id, start_time):
+        """Sends a notification with the time it took the instance to become
+        active, both since it was created and since this host started
+        provisioning it."""
+        instance_ref = self.db.instance_get(context, instance_id)
+        since_created = utils.utcnow() - instance_ref['created_at']
+        payload = {
+            'instance_id': instance_id,
+            'host': self.host,
+            'time_to_active': since_created.days * 24 * 60 * 60 +
+                              since_created.seconds +
+                              since_created.microseconds / 1000000.0,
+            'provision_time': time.time() - start_time,
+        }
+        LOG.info("Instance %(instance_id)s became active in "
+                 "%(time_to_active).1fs." % payload)
+        notifier.notify(publisher_id(self.host),
+                        'reddwarf.instance.create.active', notifier.INFO,
+                        payload)
+
+    def guest_status_changed(self, context, instance_id, state):
+        """Wakes anything waiting on the guest's status to change."""
+        LOG.debug("Guest status of instance %s changed to %s."
+                  % (instance_id, state))
+        self.guest_waiters.notify(instance_id, state)
+
+    def _notify_scheduler_of_delete(self, context, instance_id):
+        """Tells the schedulers the memory of the instance is free again."""
+        if not FLAGS.reddwarf_notify_scheduler_of_deletes:
+            return
+        # The deleted row still has the host and size of the instance, and
+        # its deleted_at time lets the schedulers tell whether their last
+        # sync already saw the delete.
+        instance_ref = self.db.instance_get(
+            context.elevated(read_deleted=True), instance_id)
+        if instance_ref['deleted_at'] is None:
+            return
+        rpc.fanout_cast(context, FLAGS.scheduler_topic,
+                        {'method': 'instance_memory_released',
+                         'args': {'topic': FLAGS.compute_topic,
+                                  'host': instance_ref['host'],
+                                  'memory_mb': instance_ref['memory_mb'],
+                                  'project_id': instance_ref['project_id'],
+                                  'deleted_at': utils.strtime(
+                                      instance_ref['deleted_at'])}})
 
     def terminate_instance(self, context, instance_id):
         """Terminate the instance and also delete all the attached volumes"""
@@ -373,6 +492,7 @@ class ReddwarfComputeManager(ComputeManager):
             LOG.info("Skipping as no volumes are associated with the instance")
 
         self.compute_manager.terminate_instance(context, instance_id)
+        self._notify_scheduler_of_delete(context, instance_id)
 
         for volume in volumes:
             self.volume_api.delete_volume_when_available(context,
@@ -21,6 +21,7 @@ import datetime
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.sql import and_
 from sqlalchemy.sql import func
 from sqlalchemy.sql import text
 
@@ -39,13 +40,20 @@ from nova.db.sqlalchemy.models import Service
 from nova.db.sqlalchemy.models import Volume
 from nova.db.sqlalchemy.session import get_session
 from nova.compute import power_state
+from nova.compute import vm_states
 
 from reddwarf import exception
+from reddwarf import utils
 from reddwarf.db import models
 from reddwarf.guest.status import GuestStatus
 
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('reddwarf_localid_cache_size', 10000,
+                     'Number of instance uuid to local id mappings cached '
+                     'in process.')
 LOG = logging.getLogger('reddwarf.db.api')
+# Created on first use as the flags are not parsed when this is imported.
+LOCALID_CACHE = None
 
 def guest_status_create(instance_id):
     """Create a new guest status for the instance
@@ -112,6 +120,27 @@ def guest_status_update(instance_id, status):
                         'state_description': status.description})
 
 
+def guest_status_heartbeat(instance_ids, status=None):
+    """Refresh the updated_at time of the given guests in a single update,
+       also writing their state if a status is given
+
+    :param instance_ids: list of instance ids for the guests
+    :param status: the status all of the guests reported, if known
+    """
+    if not instance_ids:
+        return
+    values = {'updated_at': datetime.datetime.utcnow()}
+    if status is not None:
+        values.update({'state': status.code,
+                       'state_description': status.description})
+    session = get_session()
+    with session.begin():
+        session.query(models.GuestStatus).\
+                filter(models.GuestStatus.instance_id.in_(instance_ids)).\
+                filter_by(deleted=False).\
+                update(values, synchronize_session=False)
+
+
 def guest_status_delete(instance_id):
     """Set the specified instance state as deleted
 
@@ -145,24 +174,96 @@ def show_instances_on_host(context, id):
     return result
 
 @require_admin_context
-def instances_mgmt_index(context, deleted=None):
+def instances_mgmt_index(context, deleted=None, marker=None, limit=None):
+    """Return one page of instances for the management index.
+
+    Instances are ordered by local id and only those with an id greater than
+    the marker are returned. The flavor is fetched in the same query using an
+    outer join, while the fixed ips and volumes for the page are fetched with
+    a single batched IN query each.
+
+    :param deleted: only return instances with this deleted flag, if set
+    :param marker: local id of the last instance seen by the caller
+    :param limit: maximum number of instances to return
+    :returns: a tuple of the instance dicts, a dict of instance id to a list
+              of fixed ip dicts and a dict of instance id to a list of
+              volume dicts
+    """
     session = get_session()
-    instances = session.query(Instance)
+    columns = (Instance.id, Instance.uuid, Instance.project_id, Instance.host,
+               Instance.vm_state, Instance.created_at, Instance.deleted_at,
+               Instance.deleted, InstanceTypes.flavorid)
+    keys = ('id', 'uuid', 'project_id', 'host', 'vm_state', 'created_at',
+            'deleted_at', 'deleted', 'flavorid')
+    query = session.query(*columns).\
+                    outerjoin((InstanceTypes,
+                               Instance.instance_type_id == InstanceTypes.id))
     if deleted is not None:
-        instances = instances.filter_by(deleted=deleted)
-
-    # Join to get the flavor types.
-    # TODO(ed-): The join works, but the model doesn't hand over the columns.
-    #instances = instances.join((InstanceTypes,
-    #    Instance.instance_type_id == InstanceTypes.id))
+        query = query.filter(Instance.deleted == deleted)
+    if marker is not None:
+        query = query.filter(Instance.id > marker)
+    query = query.order_by(Instance.id)
+    if limit is not None:
+        query = query.limit(limit)
+    instances = [dict(zip(keys, row)) for row in query.all()]
+
+    ips = {}
+    volumes = {}
+    ids = [instance['id'] for instance in instances]
+    if not ids:
+        return instances, ips, volumes
+
+    ip_rows = session.query(FixedIp.instance_id, FixedIp.address,
+                            FixedIp.virtual_interface_id).\
+                      filter(FixedIp.instance_id.in_(ids)).\
+                      filter(FixedIp.deleted == False).\
+                      all()
+    for instance_id, address, vif_id in ip_rows:
+        ips.setdefault(instance_id, []).append({
+            'address': address,
+            'virtual_interface_id': vif_id,
+            })
+
+    volume_rows = session.query(Volume.instance_id, Volume.size,
+                                Volume.mountpoint).\
+                          filter(Volume.instance_id.in_(ids)).\
+                          filter(Volume.deleted == False).\
+                          all()
+    for instance_id, size, mountpoint in volume_rows:
+        volumes.setdefault(instance_id, []).append({
+            'size': size,
+            'mountpoint': mountpoint,
+            })
+
+    return instances, ips, volumes
 
-    # Fetch the instance_types, or "flavors"
-    flavors = session.query(InstanceTypes)
+@require_context
+def volume_get_all_by_instances(context, instance_ids):
+    """Returns the volumes of the given instances in a single query.
 
-    # Fetch the IPs for mapping.
-    ips = session.query(FixedIp).filter(FixedIp.instance_id != None)
+    :param instance_ids: list of instance ids to look up
+    :returns: a dict of instance id to a list of dicts with the id, name,
+              description and size of each volume, as in the servers API
+    """
+    volumes = {}
+    if not instance_ids:
+        return volumes
+    session = get_session()
+    rows = session.query(Volume.instance_id, Volume.id, Volume.display_name,
+                         Volume.display_description, Volume.size).\
+                   filter(Volume.instance_id.in_(instance_ids)).\
+                   filter(Volume.deleted == False).\
+                   order_by(Volume.id).\
+                   all()
+    for instance_id, volume_id, name, description, size in rows:
+        volumes.setdefault(instance_id, []).append({
+            'id': volume_id,
+            'name': name,
+            'description': description,
+            'size': size,
+            })
+    return volumes
 
-    return instances.all(), flavors.all(), ips.all()
 
 @require_admin_context
 def instance_get_by_state_and_updated_before(context, state, time):
@@ -218,15 +319,48 @@ def volume_get_by_state_and_updated_before(context, state, time):
     return result
 
 @require_admin_context
-def volume_get_orphans(context, latest_time):
-    session = get_session()
-    result = session.query(Volume).\
-                     filter_by(deleted=False).\
-                     filter_by(instance_id=None).\
-                     filter(Volume.status=='available').\
-                     filter(Volume.updated_at < latest_time).\
-                     all()                     
-    return result
+def volume_get_orphans(context, latest_time, marker=None, limit=None):
+    """Finds the available volumes without an instance updated before the
+    given time, ordered by id.
+
+    Only the volumes with an id greater than the marker are returned, at
+    most limit of them.
+    """
+    session = get_session()
+    query = session.query(Volume).\
+                    filter_by(deleted=False).\
+                    filter_by(instance_id=None).\
+                    filter(Volume.status=='available').\
+                    filter(Volume.updated_at < latest_time)
+    if marker is not None:
+        query = query.filter(Volume.id > marker)
+    return query.order_by(Volume.id).limit(limit).all()
+
+
+@require_admin_context
+def instance_get_stuck_building(context, latest_time, marker=None,
+                                limit=None):
+    """Finds the instances still building which were last updated before the
+    given time, ordered by id, after the marker and at most limit of them.
+    """
+    session = get_session()
+    query = session.query(Instance).\
+                    filter_by(deleted=False).\
+                    filter_by(vm_state=vm_states.BUILDING).\
+                    filter(Instance.updated_at < latest_time)
+    if marker is not None:
+        query = query.filter(Instance.id > marker)
+    return query.order_by(Instance.id).limit(limit).all()
+
+
+@require_admin_context
+def instance_get_all_without_relations(context):
+    """Returns every instance which is not deleted, without loading any of
+    the related rows."""
+    session = get_session()
+    return session.query(Instance).\
+                   filter_by(deleted=False).\
+                   all()
 
 def get_root_enabled_history(context, id):
     """
@@ -345,20 +479,61 @@ def config_delete(key):
                 delete()
 
 
+def _get_localid_cache():
+    global LOCALID_CACHE
+    if LOCALID_CACHE is None:
+        LOCALID_CACHE = utils.LRUCache(FLAGS.reddwarf_localid_cache_size)
+    return LOCALID_CACHE
+
+
 def localid_from_uuid(uuid):
     """
     Given an instance's uuid, retrieve the local instance_id for compatibility
     with nova. When nova uses uuids exclusively, this function will not be
     needed.
+
+    The id of an instance never changes once assigned, so the mapping is
+    cached in process.
     """
+    cache = _get_localid_cache()
+    local_id = cache.get(uuid)
+    if local_id is not None:
+        return local_id
     LOG.debug("Retrieving local id for instance %s" % uuid)
     session = get_session()
     try:
-        result = session.query(Instance).filter_by(uuid=uuid).one()
-        return result['id']
+        local_id = session.query(Instance.id).filter_by(uuid=uuid).one()[0]
     except NoResultFound:
         LOG.debug("No such instance found.")
         raise exception.NotFound()
+    cache.set(uuid, local_id)
+    return local_id
+
+
+def localids_from_uuids(uuids):
+    """
+    Returns a dictionary mapping each of the given instance uuids to its
+    local instance_id, looking up the ones not yet cached in a single query.
+    Uuids with no matching instance are left out.
+    """
+    cache = _get_localid_cache()
+    result = {}
+    missing = []
+    for uuid in uuids:
+        local_id = cache.get(uuid)
+        if local_id is None:
+            missing.append(uuid)
+        else:
+            result[uuid] = local_id
+    if missing:
+        session = get_session()
+        rows = session.query(Instance.uuid, Instance.id).\
+                       filter(Instance.uuid.in_(missing)).\
+                       all()
+        for uuid, local_id in rows:
+            cache.set(uuid, local_id)
+            result[uuid] = local_id
+    return result
 
 
 def rsdns_record_create(name, id):
@@ -420,6 +595,60 @@ def rsdns_record_list():
     return result
 
 
+def rsdns_record_get_page(created_before, marker=None, limit=None):
+    """
+    Returns the records created before the given time ordered by name,
+    after the marker and at most limit of them.
+    """
+    session = get_session()
+    query = session.query(models.RsDnsRecord).\
+                    filter_by(deleted=False).\
+                    filter(models.RsDnsRecord.created_at < created_before)
+    if marker is not None:
+        query = query.filter(models.RsDnsRecord.name > marker)
+    return query.order_by(models.RsDnsRecord.name).limit(limit).all()
+
+
+def rsdns_job_create(job_id, callback_url, entry):
+    """
+    Stores a pending RSDNS job creating the record for the given entry.
+    """
+    LOG.debug("Storing RSDNS job %s for record %s." % (job_id, entry.name))
+    job = models.RsDnsJob()
+    job.update({'id': job_id,
+                'callback_url': callback_url,
+                'name': entry.name,
+                'content': entry.content,
+                'type': entry.type,
+                'ttl': entry.ttl})
+    session = get_session()
+    with session.begin():
+        job.save(session=session)
+    return job
+
+
+def rsdns_job_delete(job_id):
+    """
+    Deletes a finished RSDNS job.
+    """
+    session = get_session()
+    with session.begin():
+        session.query(models.RsDnsJob).\
+                filter_by(id=job_id).\
+                delete()
+
+
+def rsdns_job_get_all():
+    """
+    Returns all of the pending RSDNS jobs, oldest first.
+    """
+    session = get_session()
+    return session.query(models.RsDnsJob).\
+                   filter_by(deleted=False).\
+                   order_by(models.RsDnsJob.created_at).\
+                   all()
+
+
 @require_admin_context
 def service_get_all_compute_memory(context):
     """Return a list of service nodes and the memory used at each.
@@ -444,6 +673,28 @@ def service_get_all_compute_memory(context):
                                                        subq, label)
 
 
+@require_admin_context
+def instance_last_deleted_at(context):
+    """Return the latest deleted_at time of the deleted instances."""
+    session = get_session()
+    return session.query(func.max(Instance.deleted_at)).\
+                   filter_by(deleted=True).\
+                   scalar()
+
+
+@require_admin_context
+def instance_count_by_host_and_project(context):
+    """Return (host, project_id, count) for the instances on each host."""
+    session = get_session()
+    return session.query(Instance.host,
+                         Instance.project_id,
+                         func.count(Instance.id)).\
+                   filter_by(deleted=False).\
+                   filter(Instance.host != None).\
+                   group_by(Instance.host, Instance.project_id).\
+                   all()
+
+
 @require_context
 def fixed_ip_get_by_instance_for_network(context, instance_id, bridge_name):
     session = get_session()
@@ -459,18 +710,56 @@ def fixed_ip_get_by_instance_for_network(context, instance_id, bridge_name):
     return rv
 
 
-@require_context
-def instance_state_get_all_filtered(context):
-    """Returns a dictionary mapping instance IDs to their state."""
-    session = get_session()
-    query = session.query(nova_models.Instance).filter_by(deleted=False)
-
+def _instance_state_query(context, session, instance_ids, *columns):
+    """Builds a query over the given columns restricted to the instances the
+    context may see and, if given, to the instance ids."""
+    query = session.query(*columns).filter(Instance.deleted == False)
     if not context.is_admin:
         if context.project_id:
-            results = query.filter_by(project_id=context.project_id).all()
+            query = query.filter(Instance.project_id == context.project_id)
         else:
-            results = query.filter_by(user_id=context.user_id).all()
-    else:
-        results = query.all()
+            query = query.filter(Instance.user_id == context.user_id)
+    if instance_ids is not None:
+        query = query.filter(Instance.id.in_(instance_ids))
+    return query
+
 
-    return dict((result['id'], result['power_state']) for result in results)
+@require_context
+def instance_state_get_all_filtered(context, instance_ids=None):
+    """Returns a dictionary mapping instance IDs to their state.
+
+    :param instance_ids: only look up these instance ids, if given
+    """
+    if instance_ids is not None and not instance_ids:
+        return {}
+    session = get_session()
+    query = _instance_state_query(context, session, instance_ids,
+                                  Instance.id, Instance.power_state)
+    return dict(query.all())
+
+
+@require_context
+def instance_state_and_guest_status_get_list(context, instance_ids):
+    """Returns the compute state and guest status for the given instances
+    in a single query.
+
+    :param instance_ids: list of instance ids to look up
+    :returns: a tuple of a dictionary mapping instance IDs to their state
+              and a dictionary mapping instance IDs to their GuestStatus
+    """
+    states = {}
+    guest_statuses = {}
+    if not instance_ids:
+        return states, guest_statuses
+    session = get_session()
+    query = _instance_state_query(context, session, instance_ids,
+                                  Instance.id, Instance.power_state,
+                                  models.GuestStatus)
+    query = query.outerjoin((models.GuestStatus,
+                             and_(models.GuestStatus.instance_id == Instance.id,
+                                  models.GuestStatus.deleted == False)))
+    for instance_id, state, guest_status in query.all():
+        states[instance_id] = state
+        if guest_status is not None:
+            guest_statuses[instance_id] = guest_status
+    return states, guest_statuses
@@ -0,0 +1,48 @@
+#    Copyright 2011 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Index
+from sqlalchemy import MetaData
+from sqlalchemy import Table
+from sqlalchemy.engine.reflection import Inspector
+
+meta = MetaData()
+
+INDEX_NAME = 'instances_uuid_idx'
+
+
+def _has_uuid_index(migrate_engine):
+    inspector = Inspector.from_engine(migrate_engine)
+    for index in inspector.get_indexes('instances'):
+        if index['column_names'] == ['uuid'] and index['unique']:
+            return True
+    return False
+
+
+def upgrade(migrate_engine):
+    instances = Table('instances', meta, autoload=True,
+                      autoload_with=migrate_engine)
+    meta.bind = migrate_engine
+    if not _has_uuid_index(migrate_engine):
+        Index(INDEX_NAME, instances.c.uuid, unique=True).create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    instances = Table('instances', meta, autoload=True,
+                      autoload_with=migrate_engine)
+    meta.bind = migrate_engine
+    inspector = Inspector.from_engine(migrate_engine)
+    names = [index['name'] for index in inspector.get_indexes('instances')]
+    if INDEX_NAME in names:
+        Index(INDEX_NAME, instances.c.uuid).drop(migrate_engine)
@@ -74,4 +74,17 @@ class RsDnsRecord(BASE, NovaBase):
 
     name = Column(String(length=255), primary_key=True)
     id = Column('id', String(length=64))
-    
\ No newline at end of file
+    
+
+class RsDnsJob(BASE, NovaBase):
+    """
+    A DNS record creation job which RS DNS has not yet finished.
+    """
+    __tablename__ = 'rsdns_jobs'
+
+    id = Column(String(length=64), primary_key=True)
+    callback_url = Column(String(length=255))
+    name = Column(String(length=255))
+    content = Column(String(length=255))
+    type = Column(String(length=16))
+    ttl = Column(Integer)
@@ -19,6 +19,8 @@
 Dns manager.
 """
 
+import time
+
 from nova import flags
 from nova import log as logging
 from nova import utils
@@ -27,10 +29,114 @@ from nova.manager import Manager
 from reddwarf import dns # import for flag values
 
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('dns_job_poll_interval', 1,
+                     'Time in seconds between checks for pending DNS jobs '
+                     'which are due to be polled.')
+flags.DEFINE_integer('dns_job_max_poll_interval', 16,
+                     'Maximum time in seconds between polls of a single DNS '
+                     'job. Jobs are polled less often the longer they run.')
+flags.DEFINE_integer('dns_job_time_out', 2 * 60,
+                     'Time in seconds for a DNS job to finish before it is '
+                     'abandoned.')
 
 LOG = logging.getLogger('reddwarf.dns.manager')
 
 
+class PendingDnsJob(object):
+    """A DNS job and when it is next due to be polled."""
+
+    def __init__(self, entry, job, now):
+        self.entry = entry
+        self.job = job
+        self.started_at = now
+        self.interval = FLAGS.dns_job_poll_interval
+        self.next_poll_at = now + self.interval
+
+
+class DnsJobTracker(object):
+    """Polls the pending jobs of a DNS driver together on one loop.
+
+    The driver must provide finish_entry(entry, job) and
+    abandon_entry(entry, job). Jobs must have a ready property.
+
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pending = []
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    def add(self, entry, job):
+        self.pending.append(PendingDnsJob(entry, job, time.time()))
+
+    def poll(self):
+        """Polls each job which is due, finishing or abandoning it if done."""
+        now = time.time()
+        # Jobs added while polling land in the new list.
+        jobs, self.pending = self.pending, []
+        done = 0
+        try:
+            for pending in jobs:
+                if pending.next_poll_at > now:
+                    self.pending.append(pending)
+                elif self._poll_job(pending, now):
+                    self._back_off(pending, now)
+                done += 1
+        finally:
+            # Whatever escapes the loop, the jobs not yet looked at are
+            # only known here, so put them back.
+            self.pending.extend(jobs[done:])
+
+    def _back_off(self, pending, now):
+        pending.interval = min(pending.interval * 2,
+                               FLAGS.dns_job_max_poll_interval)
+        pending.next_poll_at = now + pending.interval
+        self.pending.append(pending)
+
+    def _poll_job(self, pending, now):
+        """Returns True if the job should be polled again.
+
+        Errors checking or finishing a job are retried until the job times
+        out, as they may only be transient.
+
+        """
+        try:
+            if pending.job.ready:
+                self.driver.finish_entry(pending.entry, pending.job)
+                self.completed += 1
+                return False
+        except Exception as err:
+            LOG.exception("Error finishing the DNS job for entry %s: %s"
+                          % (pending.entry.name, err))
+            self.failed += 1
+        if now - pending.started_at >= FLAGS.dns_job_time_out:
+            LOG.error("DNS job for entry %s did not finish before time_out!"
+                      % pending.entry.name)
+            self.timed_out += 1
+            return self._abandon(pending)
+        return True
+
+    def _abandon(self, pending):
+        """Abandons the job, returning True if it must be tried again."""
+        try:
+            self.driver.abandon_entry(pending.entry, pending.job)
+        except Exception as err:
+            LOG.exception("Error abandoning DNS entry %s: %s"
+                          % (pending.entry.name, err))
+            return True
+        return False
+
+    def get_metrics(self):
+        """Returns the counts of pending, completed and timed out jobs, and
+        of the failed attempts to finish a job."""
+        return {'pending': len(self.pending),
+                'completed': self.completed,
+                'failed': self.failed,
+                'timed_out': self.timed_out}
+
+
 class DnsManager(Manager):
     """Handles associating DNS to and from IPs."""
 
@@ -42,8 +148,23 @@ class DnsManager(Manager):
         if not dns_instance_entry_factory:
             dns_instance_entry_factory = FLAGS.dns_instance_entry_factory
         self.entry_factory = utils.import_object(dns_instance_entry_factory)
+        self.jobs = DnsJobTracker(self.driver)
         super(DnsManager, self).__init__(*args, **kwargs)
 
+    def _submits_jobs(self):
+        """Whether the driver can create entries without waiting on them."""
+        return hasattr(self.driver, 'submit_entry')
+
+    def init_host(self):
+        """Resumes the pending DNS jobs and starts polling them."""
+        if not self._submits_jobs():
+            return
+        for entry, job in self.driver.get_pending_jobs():
+            LOG.info("Resuming DNS job for entry %s." % entry.name)
+            self.jobs.add(entry, job)
+        self.job_poller = utils.LoopingCall(self.jobs.poll)
+        self.job_poller.start(FLAGS.dns_job_poll_interval)
+
     def create_instance_entry(self, context, instance, content):
         """Connects a new instance with a DNS entry.
 
@@ -57,7 +178,10 @@ class DnsManager(Manager):
         if entry:
             entry.content = content
             LOG.debug("Modified entry address %s." % str(entry))
-            self.driver.create_entry(entry)
+            if self._submits_jobs():
+                self.jobs.add(entry, self.driver.submit_entry(entry))
+            else:
+                self.driver.create_entry(entry)
 
     def delete_instance_entry(self, context, instance, content):
         """Removes a DNS entry associated to an instance."""
@@ -20,10 +20,12 @@ Dns Driver that uses Rackspace DNSaaS.
 """
 
 import hashlib
+import time
 
 from novaclient.exceptions import NotFound
 from rsdns.client import DNSaas
 from rsdns.client.future import RsDnsError
+from rsdns.client.records import FutureRecord
 
 from nova import flags
 from nova import log as logging
@@ -51,6 +53,9 @@ flags.DEFINE_string('dns_management_base_url', None,
                     'The management URL for DNS.')
 flags.DEFINE_integer('dns_ttl', 300, 'TTL for the DNS entries')
 flags.DEFINE_integer('dns_domain_id', None, 'DNS domain id from RSDNS')
+flags.DEFINE_integer('dns_record_index_refresh_interval', 5 * 60,
+                     'Time in seconds between refreshes of the local index '
+                     'of the DNS records from the rsdns_records table.')
 
 FLAGS = flags.FLAGS
 LOG = logging.getLogger('reddwarf.dns.rsdns.driver')
@@ -78,6 +83,68 @@ class EntryToRecordConverter(object):
                         ttl=record.ttl, dns_zone=dns_zone)
 
 
+class RsDnsRecordIndex(object):
+    """Keeps the records listed in the rsdns_records table in memory.
+
+    This lets lookups by name or content be answered without paging through
+    every record in the domain. The index is refreshed incrementally; only
+    records not seen before are fetched from RS DNS.
+
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.last_refresh = None
+
+    def add(self, record_id, entry):
+        self.entries[record_id] = entry
+
+    def remove(self, record_id):
+        self.entries.pop(record_id, None)
+
+    def get(self, record_id):
+        return self.entries.get(record_id)
+
+    def find(self, name=None, content=None):
+        return [entry for entry in self.entries.values()
+                if (not name or entry.name == name) and
+                   (not content or entry.content == content)]
+
+    def refresh_due(self, interval):
+        return (self.last_refresh is None or
+                time.time() - self.last_refresh >= interval)
+
+    def refresh(self, db_records, fetch_entry, list_entries=None):
+        """Syncs the index with the (name, record id) pairs given.
+
+        Records no longer listed are dropped and new ones are fetched with
+        fetch_entry(record_id). An empty index is first seeded from
+        list_entries(), a dict of every entry by record id, as paging
+        through the domain takes far fewer requests than a get per record.
+
+        """
+        listed = {}
+        if list_entries is not None and not self.entries and db_records:
+            listed = list_entries()
+        record_ids = set()
+        for name, record_id in db_records:
+            record_ids.add(record_id)
+            if record_id in self.entries:
+                continue
+            if record_id in listed:
+                self.add(record_id, listed[record_id])
+                continue
+            try:
+                self.add(record_id, fetch_entry(record_id))
+            except NotFound:
+                LOG.warn("DNS record %s (%s) is in the database but not "
+                         "in RS DNS." % (record_id, name))
+        for record_id in self.entries.keys():
+            if record_id not in record_ids:
+                self.remove(record_id)
+        self.last_refresh = time.time()
+
+
 def create_client_with_flag_values():
     """Creates a RS DNSaaS client using the Flag values."""
     if FLAGS.dns_management_base_url == None:
@@ -118,11 +185,33 @@ class RsDnsDriver(object):
         self.dns_client.authenticate()
         self.default_dns_zone = RsDnsZone(id=FLAGS.dns_domain_id, name=FLAGS.dns_domain_name)
         self.converter = EntryToRecordConverter(self.default_dns_zone)
+        self.index = RsDnsRecordIndex()
         if FLAGS.dns_ttl < 300:
             raise Exception("TTL value '--dns_ttl=%s' should be greater than" \
                             " 300" % FLAGS.dns_ttl)
 
     def create_entry(self, entry):
+        future = self.submit_entry(entry)
+        try:
+            poll_until(lambda : future.ready, sleep_time=2,
+                             time_out=60*2)
+            self.finish_entry(entry, future)
+        except exception.PollTimeOut as pto:
+            LOG.error("Failed to create DNS entry before time_out!")
+            self.abandon_entry(entry, future)
+            raise
+        except RsDnsError as rde:
+            LOG.error("An error occurred creating DNS entry!")
+            self.abandon_entry(entry, future)
+            raise
+
+    def submit_entry(self, entry):
+        """Starts creating the entry and returns the RS DNS job doing it.
+
+        The job is stored so it can be resumed after a restart. Once it is
+        ready, pass it to finish_entry, or to abandon_entry if it failed.
+
+        """
         dns_zone = entry.dns_zone or self.default_dns_zone
         if dns_zone.id == None:
             raise TypeError("The entry's dns_zone must have an ID specified.")
@@ -134,25 +223,54 @@ class RsDnsDriver(object):
                                                     record_data=entry.content,
                                                     record_type=entry.type,
                                                     record_ttl=entry.ttl)
-            try:
-                poll_until(lambda : future.ready, sleep_time=2,
-                                 time_out=60*2)
-                if len(future.resource) < 1:
-                    raise RsDnsError("No DNS records were created.")
-                elif len(future.resource) > 1:
-                    LOG.error("More than one DNS record created. Ignoring.")
-                actual_record = future.resource[0]
-                dbapi.rsdns_record_create(name=name, id=actual_record.id)
-                LOG.debug("Added RS DNS entry.")
-            except exception.PollTimeOut as pto:
-                LOG.error("Failed to create DNS entry before time_out!")
-                raise
-            except RsDnsError as rde:
-                LOG.error("An error occurred creating DNS entry!")
-                raise
         except Exception as ex:
             LOG.error("Error when creating a DNS record!")
             raise
+        dbapi.rsdns_job_create(future.jobId, future.callbackUrl, entry)
+        return future
+
+    def finish_entry(self, entry, future):
+        """Stores the record created by a finished job.
+
+        The job is only deleted once the record is stored, so a job which
+        fails here is resumed after a restart.
+
+        """
+        dns_zone = entry.dns_zone or self.default_dns_zone
+        if len(future.resource) < 1:
+            raise RsDnsError("No DNS records were created.")
+        elif len(future.resource) > 1:
+            LOG.error("More than one DNS record created. Ignoring.")
+        actual_record = future.resource[0]
+        try:
+            dbapi.rsdns_record_create(name=entry.name, id=actual_record.id)
+        except exception.DuplicateRecordEntry:
+            # Stored by an earlier attempt which stopped before deleting
+            # the job.
+            LOG.info("RS DNS record %s was already stored." % entry.name)
+        self.index.add(actual_record.id,
+            self.converter.record_to_entry(actual_record, dns_zone))
+        dbapi.rsdns_job_delete(future.jobId)
+        LOG.debug("Added RS DNS entry.")
+
+    def abandon_entry(self, entry, future):
+        """Forgets a job which failed or took too long."""
+        LOG.error("Gave up on RSDNS job %s creating entry %s."
+                  % (future.jobId, entry.name))
+        dbapi.rsdns_job_delete(future.jobId)
+
+    def get_pending_jobs(self):
+        """Returns the (entry, job) pairs of the jobs not yet finished."""
+        pending = []
+        for job in dbapi.rsdns_job_get_all():
+            entry = DnsEntry(name=job.name, content=job.content,
+                             type=job.type, ttl=job.ttl,
+                             dns_zone=self.default_dns_zone)
+            future = FutureRecord(self.dns_client.records, jobId=job.id,
+                                  callbackUrl=job.callback_url,
+                                  status="RUNNING")
+            pending.append((entry, future))
+        return pending
 
     def delete_entry(self, name, type, dns_zone=None):
         dns_zone = dns_zone or self.default_dns_zone
@@ -169,21 +287,72 @@ class RsDnsDriver(object):
         self.dns_client.records.delete(domain_id=dns_zone.id,
                                        record_id=record.id)
         dbapi.rsdns_record_delete(name)
+        self.index.remove(record.id)
 
-    def get_entries(self, name=None, content=None, dns_zone=None):
+    def get_entries(self, name=None, content=None, dns_zone=None,
+                    type=None):
+        """Lists the entries, searching on the DNS API if a type is given."""
         dns_zone = dns_zone or self.default_dns_zone
         long_name = name  # self.converter.name_to_long_name(name)
         records = self.dns_client.records.list(domain_id=dns_zone.id,
                                                record_name=long_name,
-                                               record_address=content)
+                                               record_address=content,
+                                               record_type=type)
         return [self.converter.record_to_entry(record, dns_zone)
                 for record in records]
 
+    def _fetch_entry(self, record_id):
+        record = self.dns_client.records.get(domain_id=self.default_dns_zone.id,
+                                             record_id=record_id)
+        return self.converter.record_to_entry(record, self.default_dns_zone)
+
+    def _list_entries(self):
+        dns_zone = self.default_dns_zone
+        records = self.dns_client.records.list(domain_id=dns_zone.id)
+        return dict((record.id,
+                     self.converter.record_to_entry(record, dns_zone))
+                    for record in records)
+
+    def refresh_index(self):
+        """Syncs the local index of entries with the rsdns_records table."""
+        db_records = [(record.name, record.id)
+                      for record in dbapi.rsdns_record_list()]
+        self.index.refresh(db_records, self._fetch_entry, self._list_entries)
+
+    def _refresh_index_if_due(self):
+        if self.index.refresh_due(FLAGS.dns_record_index_refresh_interval):
+            self.refresh_index()
+
+    def _uses_index(self, dns_zone):
+        return dns_zone is None or dns_zone == self.default_dns_zone
+
     def get_entries_by_content(self, content, dns_zone=None):
-        return self.get_entries(content=content)
+        if self._uses_index(dns_zone):
+            self._refresh_index_if_due()
+            entries = self.index.find(content=content)
+            if entries:
+                return entries
+        # Only A records are created by this driver.
+        return self.get_entries(content=content, dns_zone=dns_zone, type="A")
 
     def get_entries_by_name(self, name, dns_zone=None):
-        return self.get_entries(name=name, dns_zone=dns_zone)
+        if self._uses_index(dns_zone):
+            # The table is the authority on which records were created here,
+            # even if another process created or deleted them.
+            try:
+                db_record = dbapi.rsdns_record_get(name)
+            except exception.RsDnsRecordNotFound:
+                db_record = None
+            if db_record is not None:
+                entry = self.index.get(db_record.id)
+                if entry is None:
+                    try:
+                        entry = self._fetch_entry(db_record.id)
+                    except NotFound:
+                        return []
+                    self.index.add(db_record.id, entry)
+                return [entry]
+        return self.get_entries(name=name, dns_zone=dns_zone, type="A")
 
     def get_dns_zones(self, name=None):
         domains = self.dns_client.domains.list(name=name)
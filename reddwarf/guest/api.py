@@ -20,6 +20,8 @@ Handles all request to the Platform or Guest VM
 """
 
 
+import eventlet
+
 from nova import flags
 from nova import log as logging
 from nova import rpc
@@ -28,9 +30,36 @@ from nova.db import base
 
 from reddwarf import rpc as reddwarf_rpc
 from reddwarf import exception
+from reddwarf import utils
 
 FLAGS = flags.FLAGS
 LOG = logging.getLogger('nova.guest.api')
+flags.DEFINE_integer('guest_summary_time_out', 30,
+                     'Seconds to wait for all of the concurrent guest calls '
+                     'made by get_instance_summary to return')
+flags.DEFINE_integer('guest_result_cache_ttl', 10,
+                     'Seconds to cache the databases and users listed on a '
+                     'guest. Set to 0 to disable the cache.')
+flags.DEFINE_integer('guest_result_cache_size', 1000,
+                     'Maximum number of guest listings to cache')
+
+RESULT_CACHE = None
+# Marks a listing changed by a cast the guest may not have processed yet, so
+# results fetched meanwhile are not cached.
+_PENDING_WRITE = object()
+
+
+def _get_result_cache():
+    global RESULT_CACHE
+    if RESULT_CACHE is None:
+        RESULT_CACHE = utils.LRUCache(FLAGS.guest_result_cache_size,
+                                      ttl=FLAGS.guest_result_cache_ttl)
+    return RESULT_CACHE
+
+
+def get_result_cache_stats():
+    """Returns the hit and miss counts of the guest listing cache."""
+    return _get_result_cache().get_stats()
 
 
 class API(base.Base):
@@ -44,9 +73,38 @@ class API(base.Base):
         instance_ref = dbapi.instance_get(context, id)
         return "guest.%s" % instance_ref['hostname'].split(".")[0]
 
+    def _cached_call(self, context, id, method):
+        """Make a synchronous call whose result is cached per instance"""
+        if FLAGS.guest_result_cache_ttl <= 0:
+            return rpc.call(context, self._get_routing_key(context, id),
+                            {"method": method})
+        cache = _get_result_cache()
+        key = (id, method)
+        result = cache.get(key)
+        if result is _PENDING_WRITE:
+            # The listing is about to change so the guest is asked anyway.
+            cache.hits -= 1
+            cache.misses += 1
+        elif result is not None:
+            return result
+        new_result = rpc.call(context, self._get_routing_key(context, id),
+                              {"method": method})
+        if result is None:
+            # A change cast while the call was made marks the entry as
+            # pending, so only cache the result if the entry is still empty.
+            cache.add(key, new_result)
+        return new_result
+
+    def _invalidate(self, id, method):
+        """Drop a cached result, and avoid caching it again until the guest
+           has had time to process the change"""
+        if FLAGS.guest_result_cache_ttl > 0:
+            _get_result_cache().set((id, method), _PENDING_WRITE)
+
     def create_user(self, context, id, users):
         """Make an asynchronous call to create a new database user"""
         LOG.debug("Creating Users for Instance %s", id)
+        self._invalidate(id, "list_users")
         rpc.cast(context, self._get_routing_key(context, id),
                  {"method": "create_user",
                   "args": {"users": users}
@@ -55,13 +113,13 @@ class API(base.Base):
     def list_users(self, context, id):
         """Make an asynchronous call to list database users"""
         LOG.debug("Listing Users for Instance %s", id)
-        return rpc.call(context, self._get_routing_key(context, id),
-                 {"method": "list_users"})
+        return self._cached_call(context, id, "list_users")
 
     def delete_user(self, context, id, user):
         """Make an asynchronous call to delete an existing database user"""
         LOG.debug("Deleting user %s for Instance %s",
                   user, id)
+        self._invalidate(id, "list_users")
         rpc.cast(context, self._get_routing_key(context, id),
                  {"method": "delete_user",
                   "args": {"user": user}
@@ -71,6 +129,7 @@ class API(base.Base):
         """Make an asynchronous call to create a new database
            within the specified container"""
         LOG.debug("Creating databases for Instance %s", id)
+        self._invalidate(id, "list_databases")
         rpc.cast(context, self._get_routing_key(context, id),
                  {"method": "create_database",
                   "args": {"databases": databases}
@@ -78,15 +137,15 @@ class API(base.Base):
 
     def list_databases(self, context, id):
         """Make an asynchronous call to list database users"""
-        LOG.debug("Listing Users for Instance %s", id)
-        return rpc.call(context, self._get_routing_key(context, id),
-                 {"method": "list_databases"})
+        LOG.debug("Listing Databases for Instance %s", id)
+        return self._cached_call(context, id, "list_databases")
 
     def delete_database(self, context, id, database):
         """Make an asynchronous call to delete an existing database
            within the specified container"""
         LOG.debug("Deleting database %s for Instance %s",
                   database, id)
+        self._invalidate(id, "list_databases")
         rpc.cast(context, self._get_routing_key(context, id),
                  {"method": "delete_database",
                   "args": {"database": database}
@@ -96,6 +155,7 @@ class API(base.Base):
         """Make a synchronous call to enable the root user for
            access from anywhere"""
         LOG.debug("Enable root user for Instance %s", id)
+        self._invalidate(id, "list_users")
         return rpc.call(context, self._get_routing_key(context, id),
                  {"method": "enable_root"})
 
@@ -103,6 +163,7 @@ class API(base.Base):
         """Make a synchronous call to disable the root user for
            access from anywhere"""
         LOG.debug("Disable root user for Instance %s", id)
+        self._invalidate(id, "list_users")
         return rpc.call(context, self._get_routing_key(context, id),
                  {"method": "disable_root"})
 
@@ -123,7 +184,10 @@ class API(base.Base):
         """Make an asynchronous call to prepare the guest
            as a database container"""
         LOG.debug(_("Sending the call to prepare the Guest"))
-        reddwarf_rpc.cast_with_consumer(context, self._get_routing_key(context, id),
+        self._invalidate(id, "list_databases")
+        self._invalidate(id, "list_users")
+        reddwarf_rpc.cast_with_consumer_once(context,
+                 self._get_routing_key(context, id),
                  {"method": "prepare",
                   "args": {"databases": databases,
                            "memory_mb":memory_mb,
@@ -179,3 +243,55 @@ class API(base.Base):
         except Exception as e:
             LOG.error(e)
             raise exception.GuestError(original_message=str(e))
+
+    def get_instance_summary(self, context, id, include_root_enabled=True,
+                             include_databases=False):
+        """Make the synchronous calls needed to show an instance concurrently
+           so they cost a single round trip to the guest.
+
+        :returns: dict with volume_info and optionally root_enabled,
+                  databases and users. Calls that failed or did not return
+                  within guest_summary_time_out map to a GuestError instead.
+        """
+        LOG.debug("Get instance summary for Instance %s", id)
+        calls = {'volume_info': {"method": "get_filesystem_stats",
+                                 "args": {"fs_path": "/var/lib/mysql"}}}
+        if include_root_enabled:
+            calls['root_enabled'] = {"method": "is_root_enabled"}
+        if include_databases:
+            calls['databases'] = {"method": "list_databases"}
+            calls['users'] = {"method": "list_users"}
+        return self._call_concurrently(context, id, calls)
+
+    def _call_concurrently(self, context, id, calls):
+        """Issue each of the given calls to the guest in its own greenthread,
+           waiting for all of them until a shared deadline."""
+        routing_key = self._get_routing_key(context, id)
+
+        def _call(msg):
+            try:
+                return rpc.call(context, routing_key, msg)
+            except Exception as e:
+                LOG.error(e)
+                return exception.GuestError(original_message=str(e))
+
+        threads = dict((name, eventlet.spawn(_call, msg))
+                       for name, msg in calls.items())
+        results = {}
+        timeout = eventlet.Timeout(FLAGS.guest_summary_time_out)
+        try:
+            for name, thread in threads.items():
+                results[name] = thread.wait()
+        except eventlet.Timeout as t:
+            if t is not timeout:
+                raise
+            for name, thread in threads.items():
+                if name not in results:
+                    LOG.error("Timed out waiting on %s for Instance %s"
+                              % (calls[name]['method'], id))
+                    thread.kill()
+                    msg = "Timed out waiting for %s" % calls[name]['method']
+                    results[name] = exception.GuestError(original_message=msg)
+        finally:
+            timeout.cancel()
+        return results
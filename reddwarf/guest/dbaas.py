@@ -28,6 +28,7 @@ handles RPC calls relating to Platform specific operations.
 
 import os
 import re
+import time
 import uuid
 
 from datetime import date
@@ -36,19 +37,36 @@ from sqlalchemy import exc
 from sqlalchemy import interfaces
 from sqlalchemy.sql.expression import text
 
+from nova import context
+from nova import db
 from nova import flags
 from nova import log as logging
+from nova import rpc
 from nova.exception import ProcessExecutionError
 
 from reddwarf.db import api as dbapi
 from reddwarf.guest import utils as guest_utils, utils
 from reddwarf.guest.db import models
 from reddwarf.guest import status as guest_status
+from reddwarf.heartbeat import api as heartbeat_api
 
 ADMIN_USER_NAME = "os_admin"
 LOG = logging.getLogger('nova.guest.dbaas')
 FLAGS = flags.FLAGS
 FLUSH = text("""FLUSH PRIVILEGES;""")
+flags.DEFINE_integer('guest_ddl_batch_size', 50,
+                     'Number of users or databases created per '
+                     'multi-statement batch')
+flags.DEFINE_boolean('guest_status_notify_compute', True,
+                     'Notify the compute node of the instance whenever the '
+                     'guest status changes so waiters do not have to poll '
+                     'for it.')
+flags.DEFINE_integer('guest_status_heartbeat_interval', 60,
+                     'Seconds between heartbeats when the guest status has '
+                     'not changed. Set to 0 to disable heartbeats.')
+flags.DEFINE_boolean('guest_status_heartbeat_use_collector', False,
+                     'Send heartbeats to the heartbeat collector instead of '
+                     'writing them to the database directly.')
 
 ENGINE = None
 MYSQLD_ARGS = None
@@ -96,30 +114,137 @@ def load_mysqld_options():
         return None
 
 
+def execute_in_batches(items):
+    """Execute the statements of each item in multi-statement batches
+
+    Each batch holds the statements of up to guest_ddl_batch_size items and
+    costs one round trip and one privilege flush. When a statement fails
+    MySQL skips the rest of the batch, so the item it belongs to is reported
+    as failed and the following items are retried in the next batch.
+
+    :param items: list of (name, statements) tuples
+    :returns: a list of {'name': name, 'error': error} dicts, one per item,
+              where error is None if all of the item's statements succeeded
+    """
+    results = []
+    pending = list(items)
+    client = LocalSqlClient(get_engine())
+    while pending:
+        batch = pending[:FLAGS.guest_ddl_batch_size]
+        statements = [statement for name, item_statements in batch
+                      for statement in item_statements]
+        with client:
+            executed, error = client.execute_batch(statements)
+        for index, (name, item_statements) in enumerate(batch):
+            if executed >= len(item_statements):
+                executed -= len(item_statements)
+                results.append({'name': name, 'error': None})
+            else:
+                LOG.error("Error executing statements for %s: %s"
+                          % (name, error))
+                results.append({'name': name, 'error': str(error)})
+                break
+        pending = pending[index + 1:]
+    return results
+
+
+class GuestStatusReporter(object):
+    """Reports the guest status only when it changes.
+
+    Repeated reports of the same status are suppressed, except for a
+    heartbeat every guest_status_heartbeat_interval seconds so the status
+    updated_at time keeps showing the guest is alive.
+    """
+
+    def __init__(self):
+        self.last_status = None
+        self.last_sent_at = None
+        self.sent = 0
+        self.heartbeats = 0
+        self.suppressed = 0
+
+    def report(self, instance_id, status):
+        """Write the status if it changed, or send a heartbeat if due."""
+        now = time.time()
+        if (self.last_status is None or
+            self.last_status.code != status.code):
+            dbapi.guest_status_update(instance_id, status)
+            self.last_status = status
+            self.last_sent_at = now
+            self.sent += 1
+            self._notify_compute(instance_id, status)
+        elif self._heartbeat_due(now):
+            self._send_heartbeat(instance_id, status)
+            self.last_sent_at = now
+            self.heartbeats += 1
+        else:
+            self.suppressed += 1
+
+    def _heartbeat_due(self, now):
+        interval = FLAGS.guest_status_heartbeat_interval
+        return interval > 0 and now - self.last_sent_at >= interval
+
+    def _send_heartbeat(self, instance_id, status):
+        if FLAGS.guest_status_heartbeat_use_collector:
+            # The state goes along so the collector restores it should
+            # another writer have changed it.
+            heartbeat_api.API().guest_heartbeat(context.get_admin_context(),
+                                                instance_id, status.code)
+        else:
+            dbapi.guest_status_update(instance_id, status)
+
+    def _notify_compute(self, instance_id, status):
+        if not FLAGS.guest_status_notify_compute:
+            return
+        try:
+            ctxt = context.get_admin_context()
+            # Only the compute node of the instance can be waiting on it.
+            host = db.instance_get(ctxt, instance_id)['host']
+            rpc.cast(ctxt, db.queue_get_for(ctxt, FLAGS.compute_topic, host),
+                     {"method": "guest_status_changed",
+                      "args": {"instance_id": instance_id,
+                               "state": status.code}})
+        except Exception as err:
+            # The compute node falls back to polling the database.
+            LOG.error("Unable to notify compute of the guest status: %s"
+                      % err)
+
+    def get_metrics(self):
+        """Returns the counts of sent, heartbeat and suppressed reports."""
+        return {'sent': self.sent,
+                'heartbeats': self.heartbeats,
+                'suppressed': self.suppressed}
+
+
+STATUS_REPORTER = GuestStatusReporter()
+
+
 class DBaaSAgent(object):
     """ Database as a Service Agent Controller """
 
     def create_user(self, users):
         """Create users and grant them privileges for the
-           specified databases"""
+           specified databases
+
+        Returns a list with a result for each user.
+        """
         host = "%"
-        client = LocalSqlClient(get_engine())
-        with client:
-            for item in users:
-                user = models.MySQLUser()
-                user.deserialize(item)
-                # TODO(cp16net):Should users be allowed to create users
-                # 'os_admin' or 'debian-sys-maint'
-                t = text("""CREATE USER `%s`@:host IDENTIFIED BY '%s';"""
-                         % (user.name, user.password))
-                client.execute(t, host=host)
-                for database in user.databases:
-                    mydb = models.MySQLDatabase()
-                    mydb.deserialize(database)
-                    t = text("""
-                            GRANT ALL PRIVILEGES ON `%s`.* TO `%s`@:host;"""
-                            % (mydb.name, user.name))
-                    client.execute(t, host=host)
+        items = []
+        for item in users:
+            user = models.MySQLUser()
+            user.deserialize(item)
+            # TODO(cp16net):Should users be allowed to create users
+            # 'os_admin' or 'debian-sys-maint'
+            statements = ["""CREATE USER `%s`@'%s' IDENTIFIED BY '%s';"""
+                          % (user.name, host, user.password)]
+            for database in user.databases:
+                mydb = models.MySQLDatabase()
+                mydb.deserialize(database)
+                statements.append(
+                    """GRANT ALL PRIVILEGES ON `%s`.* TO `%s`@'%s';"""
+                    % (mydb.name, user.name, host))
+            items.append((user.name, statements))
+        return execute_in_batches(items)
 
     def list_users(self):
         """List users that have access to the database"""
@@ -150,16 +275,19 @@ class DBaaSAgent(object):
             client.execute(t)
 
     def create_database(self, databases):
-        """Create the list of specified databases"""
-        client = LocalSqlClient(get_engine())
-        with client:
-            for item in databases:
-                mydb = models.MySQLDatabase()
-                mydb.deserialize(item)
-                t = text("""CREATE DATABASE IF NOT EXISTS
-                            `%s` CHARACTER SET = %s COLLATE = %s;"""
-                         % (mydb.name, mydb.character_set, mydb.collate))
-                client.execute(t)
+        """Create the list of specified databases
+
+        Returns a list with a result for each database.
+        """
+        items = []
+        for item in databases:
+            mydb = models.MySQLDatabase()
+            mydb.deserialize(item)
+            statement = """CREATE DATABASE IF NOT EXISTS
+                           `%s` CHARACTER SET = %s COLLATE = %s;""" \
+                        % (mydb.name, mydb.character_set, mydb.collate)
+            items.append((mydb.name, [statement]))
+        return execute_in_batches(items)
 
     def list_databases(self):
         """List databases the user created on this mysql instance"""
@@ -274,27 +402,31 @@ class DBaaSAgent(object):
         instance_id = guest_utils.get_instance_id()
 
         if PREPARING:
-            dbapi.guest_status_update(instance_id, guest_status.BUILDING)
+            STATUS_REPORTER.report(instance_id, guest_status.BUILDING)
             return
 
         try:
             out, err = utils.execute("/usr/bin/mysqladmin", "ping", run_as_root=True)
-            dbapi.guest_status_update(instance_id, guest_status.RUNNING)
+            STATUS_REPORTER.report(instance_id, guest_status.RUNNING)
         except ProcessExecutionError as e:
             try:
                 out, err = utils.execute("ps", "-C", "mysqld", "h")
                 pid = out.split()[0]
                 # TODO(rnirmal): Need to create new statuses for instances where
                 # the mysql service is up, but unresponsive
-                dbapi.guest_status_update(instance_id, guest_status.BLOCKED)
+                STATUS_REPORTER.report(instance_id, guest_status.BLOCKED)
             except ProcessExecutionError as e:
                 if not MYSQLD_ARGS:
                     MYSQLD_ARGS = load_mysqld_options()
                 pid_file = MYSQLD_ARGS.get('pid-file', '/var/run/mysqld/mysqld.pid')
                 if os.path.exists(pid_file):
-                    dbapi.guest_status_update(instance_id, guest_status.CRASHED)
+                    STATUS_REPORTER.report(instance_id, guest_status.CRASHED)
                 else:
-                    dbapi.guest_status_update(instance_id, guest_status.SHUTDOWN)
+                    STATUS_REPORTER.report(instance_id, guest_status.SHUTDOWN)
+
+    def get_status_metrics(self):
+        """Return the counts of sent and suppressed status updates."""
+        return STATUS_REPORTER.get_metrics()
 
 
 class LocalSqlClient(object):
@@ -327,6 +459,28 @@ class LocalSqlClient(object):
             self.trans = None
             raise
 
+    def execute_batch(self, statements):
+        """Execute the statements in a single round trip
+
+        Execution stops at the first statement that fails.
+
+        :returns: a tuple of the number of statements that succeeded and the
+                  error raised by the statement that failed, or None
+        """
+        dbapi_error = self.engine.dialect.dbapi.Error
+        cursor = self.conn.connection.cursor()
+        executed = 0
+        try:
+            cursor.execute("\n".join(statements))
+            executed += 1
+            while cursor.nextset():
+                executed += 1
+        except dbapi_error as err:
+            return executed, err
+        finally:
+            cursor.close()
+        return executed, None
+
 
 class KeepAliveConnection(interfaces.PoolListener):
     """
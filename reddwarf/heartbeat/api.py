@@ -0,0 +1,46 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Handles all requests to the Heartbeat collector.
+"""
+
+from nova import flags
+from nova import log as logging
+from nova import rpc
+from nova.db import base
+
+FLAGS = flags.FLAGS
+
+LOG = logging.getLogger('reddwarf.heartbeat.api')
+
+
+class API(base.Base):
+    """API for sending heartbeats to the heartbeat collector."""
+
+    def __init__(self, **kwargs):
+        super(API, self).__init__(**kwargs)
+
+    def guest_heartbeat(self, context, instance_id, state=None):
+        """Make an asynchronous call to record that a guest is alive, and
+           in which state if given."""
+        LOG.debug("Sending heartbeat for guest %s" % instance_id)
+        args = {'instance_id': instance_id}
+        if state is not None:
+            args['state'] = state
+        rpc.cast(context, FLAGS.heartbeat_topic,
+                 {'method': 'guest_heartbeat', 'args': args})
@@ -0,0 +1,144 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Heartbeat collector manager.
+
+Guests cast their liveness heartbeats here instead of writing them to the
+database themselves. The heartbeats are buffered in memory and written in
+bulk on every periodic task run, with one update per reported state. The
+state is written with each heartbeat so that it is restored if something
+else changed it since the guest last reported a change.
+
+Services using the collector report mode cast their heartbeats here too.
+Those are written every heartbeat_service_flush_interval seconds with the
+time each was received, so service_is_up still sees when the service was
+last alive. Keep report_interval plus this interval below
+service_down_time. A service whose row is gone is told so on its node
+topic, so it can recreate the row.
+"""
+
+from nova import context
+from nova import db
+from nova import flags
+from nova import log as logging
+from nova import rpc
+from nova import utils
+from nova.manager import Manager
+
+from reddwarf.db import api as dbapi
+from reddwarf.guest.status import GuestStatus
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('heartbeat_service_flush_interval', 5,
+                     'Seconds between writing the buffered service '
+                     'heartbeats to the database.')
+
+LOG = logging.getLogger('reddwarf.heartbeat.manager')
+
+
+class HeartbeatManager(Manager):
+    """Collects heartbeats and writes them to the database in bulk."""
+
+    def __init__(self, *args, **kwargs):
+        # Maps instance ids to the state code last reported, or None.
+        self.guest_heartbeats = {}
+        # Maps service ids to a (report count, received at) pair.
+        self.service_heartbeats = {}
+        # Maps service ids to the node topic of the service.
+        self.service_topics = {}
+        super(HeartbeatManager, self).__init__(*args, **kwargs)
+
+    def init_host(self):
+        flush = utils.LoopingCall(self.flush_service_heartbeats)
+        flush.start(interval=FLAGS.heartbeat_service_flush_interval,
+                    now=False)
+
+    def guest_heartbeat(self, context, instance_id, state=None):
+        """Buffers a heartbeat from a guest until the next flush."""
+        self.guest_heartbeats[instance_id] = state
+
+    def service_heartbeat(self, context, service_id, topic=None, host=None):
+        """Buffers a heartbeat from a service until the next flush."""
+        count, _received_at = self.service_heartbeats.get(service_id,
+                                                          (0, None))
+        self.service_heartbeats[service_id] = (count + 1, utils.utcnow())
+        if topic is not None and host is not None:
+            self.service_topics[service_id] = '%s.%s' % (topic, host)
+
+    def periodic_tasks(self, context=None):
+        """Writes all the heartbeats received since the last run."""
+        super(HeartbeatManager, self).periodic_tasks(context)
+        self.flush_guest_heartbeats()
+
+    def flush_guest_heartbeats(self):
+        if not self.guest_heartbeats:
+            return
+        heartbeats = self.guest_heartbeats
+        self.guest_heartbeats = {}
+        LOG.debug("Writing heartbeats for %d guests." % len(heartbeats))
+        by_state = {}
+        for instance_id, state in heartbeats.items():
+            by_state.setdefault(state, []).append(instance_id)
+        for state, instance_ids in by_state.items():
+            try:
+                status = None
+                if state is not None:
+                    status = GuestStatus.from_code(state)
+                dbapi.guest_status_heartbeat(instance_ids, status)
+            except Exception:
+                LOG.exception("Unable to write guest heartbeats.")
+                for instance_id in instance_ids:
+                    # Keep a newer heartbeat received since the swap.
+                    self.guest_heartbeats.setdefault(instance_id, state)
+
+    def flush_service_heartbeats(self):
+        if not self.service_heartbeats:
+            return
+        heartbeats = self.service_heartbeats
+        self.service_heartbeats = {}
+        LOG.debug("Writing heartbeats for %d services." % len(heartbeats))
+        ctxt = context.get_admin_context()
+        try:
+            missing = db.service_heartbeat_many(ctxt, heartbeats)
+        except Exception:
+            LOG.exception("Unable to write service heartbeats.")
+            for service_id, (count, received_at) in heartbeats.items():
+                if service_id in self.service_heartbeats:
+                    newer_count, received_at = \
+                        self.service_heartbeats[service_id]
+                    count += newer_count
+                self.service_heartbeats[service_id] = (count, received_at)
+            return
+        for service_id in missing:
+            self._notify_service_missing(ctxt, service_id)
+
+    def _notify_service_missing(self, context, service_id):
+        """Tells a service its row is gone so it recreates it."""
+        topic = self.service_topics.pop(service_id, None)
+        if topic is None:
+            LOG.warn("Service %s has no row and did not say where it "
+                     "listens." % service_id)
+            return
+        LOG.debug("Telling service %s on %s that its row is gone."
+                  % (service_id, topic))
+        try:
+            rpc.cast(context, topic, {'method': 'service_missing',
+                                      'args': {'service_id': service_id}})
+        except Exception:
+            LOG.exception("Unable to tell service %s that its row is gone."
+                          % service_id)
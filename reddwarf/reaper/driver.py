@@ -15,22 +15,55 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
 from datetime import timedelta
 
+from eventlet import greenpool
+from eventlet import greenthread
+
+from nova import db
 from nova import flags
 from nova import log as logging
 from nova import volume
 from nova import utils
+from nova.compute import power_state
+from nova.compute import vm_states
+from nova.notifier import api as notifier
+from reddwarf import exception
 from reddwarf.db import api as reddwarf_db
 
 
 FLAGS = flags.FLAGS
+flags.DECLARE('dns_driver', 'reddwarf.dns')
+flags.DECLARE('dns_instance_entry_factory', 'reddwarf.dns')
 LOG = logging.getLogger(__name__)
 
 
 flags.DEFINE_integer('reddwarf_reaper_orphan_volume_expiration_time',
                      60 * 60 * 24 * 7,
                      'Time until reaper will destroy orphaned volumes.')
+flags.DEFINE_integer('reddwarf_reaper_stuck_building_time', 60 * 60 * 2,
+                     'Time an instance may stay building before the reaper '
+                     'marks it as failed.')
+flags.DEFINE_integer('reddwarf_reaper_orphan_dns_expiration_time',
+                     60 * 60 * 24,
+                     'Time until reaper will delete DNS records which do '
+                     'not belong to an instance.')
+flags.DEFINE_list('reddwarf_reaper_tasks', ['volumes'],
+                  'Leaked resources the reaper cleans up, any of volumes, '
+                  'building_instances and dns_records.')
+flags.DEFINE_integer('reddwarf_reaper_batch_size', 100,
+                     'Most resources of each kind the reaper looks at per '
+                     'run. The rest are picked up by the following runs.')
+flags.DEFINE_integer('reddwarf_reaper_max_concurrency', 4,
+                     'Most resources the reaper cleans up at the same time.')
+flags.DEFINE_float('reddwarf_reaper_max_rate', 5.0,
+                   'Most resources the reaper starts cleaning up per second, '
+                   'or 0 for no limit.')
+
+
+def publisher_id(host=None):
+    return notifier.publisher_id("reddwarf-reaper", host)
 
 
 class ReaperDriver(object):
@@ -39,27 +72,261 @@ class ReaperDriver(object):
         pass
 
 
+class ReaperTask(object):
+    """A kind of leaked resource the reaper finds and cleans up.
+
+    Resources are found one batch at a time in a stable order, so the marker
+    of the last one seen lets the next run carry on from there.
+    """
+
+    name = None
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def find(self, context, marker, limit):
+        """Returns the candidates after the marker, at most limit of them."""
+        raise NotImplementedError()
+
+    def select(self, context, resources):
+        """Returns the candidates which have leaked."""
+        return resources
+
+    def reap(self, context, resource):
+        raise NotImplementedError()
+
+    def describe(self, resource):
+        return resource['id']
+
+    def get_marker(self, resource):
+        return resource['id']
+
+    def marker_from_string(self, value):
+        return int(value)
+
+
+class OrphanVolumeTask(ReaperTask):
+    """Deletes volumes which have been available without an instance for
+    longer than the orphan time out."""
+
+    name = 'volumes'
+
+    def find(self, context, marker, limit):
+        expiration_time = self.driver.orphan_time_out
+        latest_valid_time = utils.utcnow() - timedelta(seconds=expiration_time)
+        return reddwarf_db.volume_get_orphans(context, latest_valid_time,
+                                              marker, limit)
+
+    def reap(self, context, volume_ref):
+        LOG.warn("Deleting an orphaned volume, %s with description %s" %
+                 (volume_ref['id'], volume_ref['display_description']))
+        self.driver.volume_api.delete(context, volume_ref['id'])
+
+
+class StuckBuildingInstanceTask(ReaperTask):
+    """Marks instances which have been building for too long as failed, so
+    they can be deleted."""
+
+    name = 'building_instances'
+
+    def find(self, context, marker, limit):
+        stuck_time = FLAGS.reddwarf_reaper_stuck_building_time
+        latest_valid_time = utils.utcnow() - timedelta(seconds=stuck_time)
+        return reddwarf_db.instance_get_stuck_building(context,
+                                                       latest_valid_time,
+                                                       marker, limit)
+
+    def reap(self, context, instance_ref):
+        LOG.warn("Instance %s has been building since %s, marking it as "
+                 "failed." % (instance_ref['id'], instance_ref['updated_at']))
+        db.instance_update(context, instance_ref['id'],
+                           {'power_state': power_state.FAILED,
+                            'vm_state': vm_states.ERROR})
+
+
+class OrphanDnsRecordTask(ReaperTask):
+    """Deletes the DNS records of instances which no longer exist.
+
+    The names of the live instances are loaded once per pass over the
+    records, and again if they are older than the records looked at, so an
+    instance created during a long pass still keeps its record.
+    """
+
+    name = 'dns_records'
+
+    def __init__(self, driver):
+        super(OrphanDnsRecordTask, self).__init__(driver)
+        self.dns_driver = utils.import_object(FLAGS.dns_driver)
+        self.entry_factory = utils.import_object(
+            FLAGS.dns_instance_entry_factory)
+        self.live_names = None
+        self.live_names_loaded_at = None
+        self.created_before = None
+
+    def find(self, context, marker, limit):
+        expiration_time = FLAGS.reddwarf_reaper_orphan_dns_expiration_time
+        self.created_before = (utils.utcnow() -
+                               timedelta(seconds=expiration_time))
+        if marker is None:
+            self.live_names = None
+        return reddwarf_db.rsdns_record_get_page(self.created_before, marker,
+                                                 limit)
+
+    def select(self, context, records):
+        if not records:
+            return []
+        if (self.live_names is None or
+            self.live_names_loaded_at < self.created_before):
+            self.live_names_loaded_at = utils.utcnow()
+            self.live_names = self._load_live_names(context)
+        if self.live_names is False:
+            LOG.warn("Instances do not get DNS entries, so no DNS record "
+                     "is reaped.")
+            return []
+        return [record for record in records
+                if record['name'] not in self.live_names]
+
+    def _load_live_names(self, context):
+        """Returns the DNS names of the live instances, or False if
+        instances do not get DNS entries."""
+        names = set()
+        # The entry factories may use any column or the name of the
+        # instance, so they are given the whole row.
+        for instance in reddwarf_db.instance_get_all_without_relations(
+                context):
+            entry = self.entry_factory.create_entry(instance)
+            if entry is None:
+                return False
+            names.add(entry.name)
+        return names
+
+    def reap(self, context, record):
+        LOG.warn("Deleting the DNS record %s which belongs to no instance." %
+                 record['name'])
+        self.dns_driver.delete_entry(record['name'], 'A')
+
+    def describe(self, record):
+        return record['name']
+
+    def get_marker(self, record):
+        return record['name']
+
+    def marker_from_string(self, value):
+        return value
+
+
+TASKS = dict((task.name, task) for task in [OrphanVolumeTask,
+                                            StuckBuildingInstanceTask,
+                                            OrphanDnsRecordTask])
+
+
 class ReddwarfReaperDriver(object):
     """
     Searches for failed resources.
+
+    Each run looks at one bounded batch of every kind of resource, cleaning
+    up the leaked ones with limited concurrency and rate. How far each kind
+    got is kept in the config table, so the runs carry on across restarts.
     """
-    def __init__(self, orphan_time_out=None):
+    def __init__(self, orphan_time_out=None, task_names=None):
         self.volume_api = volume.API()
         self.orphan_time_out = orphan_time_out or \
             FLAGS.reddwarf_reaper_orphan_volume_expiration_time
+        self.tasks = []
+        for name in task_names or FLAGS.reddwarf_reaper_tasks:
+            if name not in TASKS:
+                LOG.error("The reaper has no task named %s." % name)
+                continue
+            self.tasks.append(TASKS[name](self))
+
+    @staticmethod
+    def _progress_key(task):
+        return "reaper_%s_marker" % task.name
+
+    def _load_progress(self, task):
+        try:
+            value = reddwarf_db.config_get(self._progress_key(task)).value
+        except exception.ConfigNotFound:
+            return None
+        if value is None:
+            return None
+        return task.marker_from_string(value)
+
+    def _save_progress(self, task, marker):
+        key = self._progress_key(task)
+        value = str(marker) if marker is not None else None
+        try:
+            reddwarf_db.config_get(key)
+        except exception.ConfigNotFound:
+            reddwarf_db.config_create(key, value,
+                                      "Last %s looked at by the reaper."
+                                      % task.name)
+        else:
+            reddwarf_db.config_update(key, value)
+
+    def _reap_all(self, context, task, resources):
+        """Reaps the resources with limited concurrency and rate, returning
+        how many were reaped and how many failed."""
+        pool = greenpool.GreenPool(FLAGS.reddwarf_reaper_max_concurrency)
+        max_rate = FLAGS.reddwarf_reaper_max_rate
+        interval = 1.0 / max_rate if max_rate > 0 else 0
+
+        def reap(resource):
+            try:
+                task.reap(context, resource)
+                return True
+            except Exception:
+                LOG.exception(_("Unable to reap %s %s") %
+                              (task.name, task.describe(resource)))
+                return False
+
+        threads = []
+        next_start = time.time()
+        for resource in resources:
+            if interval:
+                delay = next_start - time.time()
+                if delay > 0:
+                    greenthread.sleep(delay)
+                next_start = max(next_start, time.time()) + interval
+            threads.append(pool.spawn(reap, resource))
+        results = [thread.wait() for thread in threads]
+        reaped = results.count(True)
+        return reaped, len(results) - reaped
+
+    def run_task(self, context, task):
+        """Reaps the next batch of the task and returns a summary."""
+        batch_size = FLAGS.reddwarf_reaper_batch_size
+        marker = self._load_progress(task)
+        resources = task.find(context, marker, batch_size)
+        leaked = task.select(context, resources)
+        reaped, failed = self._reap_all(context, task, leaked)
+        # Once the end is reached the next run starts over from the start,
+        # retrying anything which failed.
+        if len(resources) < batch_size:
+            next_marker = None
+        else:
+            next_marker = task.get_marker(resources[-1])
+        self._save_progress(task, next_marker)
+        return {'task': task.name,
+                'scanned': len(resources),
+                'reaped': reaped,
+                'failed': failed,
+                'finished': next_marker is None}
 
     def clean_up_volumes(self, context):
-        """Finds all volumes which are not associated to an instance."""
-        expiration_time = self.orphan_time_out
-        latest_valid_time = utils.utcnow() - timedelta(seconds=expiration_time)
-        LOG.debug("Preparing to delete orphaned volumes updated before %s" %
-                  latest_valid_time)
-        volumes = reddwarf_db.volume_get_orphans(context, latest_valid_time)
-        if volumes:
-            for volume_ref in volumes:
-                self.volume_api.delete(context, volume_ref['id'])
-                LOG.warn("Deleting an orphaned volume, %s with description %s" %
-                         (volume_ref['id'], volume_ref['display_description']))
+        """Finds volumes which are not associated to an instance."""
+        for task in self.tasks:
+            if task.name == OrphanVolumeTask.name:
+                return self.run_task(context, task)
 
     def periodic_tasks(self, context):
-        self.clean_up_volumes(context)
+        summaries = []
+        for task in self.tasks:
+            try:
+                summaries.append(self.run_task(context, task))
+            except Exception:
+                LOG.exception(_("Reaper task %s failed") % task.name)
+        if any(summary['scanned'] for summary in summaries):
+            notifier.notify(publisher_id(), 'reddwarf.reaper.run',
+                            notifier.INFO, {'tasks': summaries})
+        return summaries
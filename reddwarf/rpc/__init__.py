@@ -25,3 +25,33 @@ def cast_with_consumer(context, topic, msg):
         consumer = conn.declare_topic_consumer(topic=topic)
         impl_kombu.cast(context, topic, msg)
 
+
+
+# Topics whose queue this process already declared, and the number of
+# reconnects made when they were declared. A reconnect may follow a broker
+# restart which lost the queues, so they are then declared again.
+DECLARED_TOPICS = set()
+DECLARED_AT_RECONNECT = 0
+
+
+def _declare_consumers(topics):
+    """Declares the queue for each topic not yet declared by this process."""
+    global DECLARED_AT_RECONNECT
+    if DECLARED_AT_RECONNECT != impl_kombu.RECONNECTS:
+        DECLARED_TOPICS.clear()
+        DECLARED_AT_RECONNECT = impl_kombu.RECONNECTS
+    new_topics = [topic for topic in topics if topic not in DECLARED_TOPICS]
+    if not new_topics:
+        return
+    with impl_kombu.ConnectionContext() as conn:
+        for topic in new_topics:
+            conn.declare_topic_consumer(topic=topic)
+    DECLARED_TOPICS.update(new_topics)
+
+
+def cast_with_consumer_once(context, topic, msg):
+    """Like cast_with_consumer, but only declares the queue the first time
+    this process casts to the topic."""
+    LOG.debug(_('Making asynchronous cast on %s...'), topic)
+    _declare_consumers([topic])
+    impl_kombu.cast(context, topic, msg)
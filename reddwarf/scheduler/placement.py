@@ -0,0 +1,67 @@
+#    Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Placement strategies of the memory scheduler.
+
+A strategy picks the host for an instance among the hosts that are up and
+have enough free memory for it, using the table of the HostMemoryTracker.
+"""
+
+
+class PlacementStrategy(object):
+    """Picks one of the hosts an instance fits on."""
+
+    # Whether the strategy needs the instances of each project per host.
+    uses_projects = False
+
+    def choose(self, tracker, hosts, memory_mb, project_id=None):
+        """Returns the host to use from the non empty list of hosts."""
+        raise NotImplementedError()
+
+
+class WorstFitStrategy(PlacementStrategy):
+    """Spreads instances by picking the host with the most free memory."""
+
+    def choose(self, tracker, hosts, memory_mb, project_id=None):
+        return min(hosts, key=lambda host: (tracker.committed[host], host))
+
+
+class BestFitStrategy(PlacementStrategy):
+    """Packs instances by picking the host left with the least free memory.
+
+    This keeps whole hosts free for the largest flavors instead of leaving
+    a little free memory on every host.
+
+    """
+
+    def choose(self, tracker, hosts, memory_mb, project_id=None):
+        return min(hosts, key=lambda host: (-tracker.committed[host], host))
+
+
+class TenantAntiAffinityStrategy(PlacementStrategy):
+    """Spreads the instances of each project across hosts.
+
+    Picks the host with the fewest instances of the project, and among
+    those the one with the most free memory.
+
+    """
+
+    uses_projects = True
+
+    def choose(self, tracker, hosts, memory_mb, project_id=None):
+        def key(host):
+            instances = tracker.projects.get(host, {}).get(project_id, 0)
+            return (instances, tracker.committed[host], host)
+        return min(hosts, key=key)
@@ -21,8 +21,11 @@
 Simple Scheduler
 """
 
+import time
+
 from nova import db
 from nova import flags
+from nova import rpc
 from nova import utils
 from nova import log as logging
 from nova.compute import power_state
@@ -43,6 +46,13 @@ flags.DEFINE_integer("max_networks", 1000,
                      "maximum number of networks to allow per host")
 flags.DEFINE_integer("max_instance_memory_mb", 1024 * 15,
                      "maximum amount of memory a host can use on instances")
+flags.DEFINE_integer("reddwarf_scheduler_memory_sync_interval", 60,
+                     "seconds between reloading the memory used by each host "
+                     "from the database in the memory scheduler")
+flags.DEFINE_string("reddwarf_scheduler_placement_strategy",
+                    "reddwarf.scheduler.placement.WorstFitStrategy",
+                    "strategy the memory scheduler uses to pick a host among "
+                    "the ones with enough free memory")
 
 LOG = logging.getLogger('nova.scheduler.simple')
 
@@ -160,22 +170,237 @@ class SimpleScheduler(chance.ChanceScheduler):
                                    " service running?"))
 
 
+class HostMemoryTracker(object):
+    """Keeps the memory committed to instances on each compute host.
+
+    The table is loaded from the database and then kept up to date as
+    instances are placed and deleted, so a placement does not need to sum
+    the memory of every instance. Placements claim their memory before the
+    instance is written to the database; a claim is kept on top of the
+    database totals until a sync that started after the instance was
+    written, so a host can not be over committed in between.
+
+    If track_projects is set the number of instances of each project on
+    each host is kept as well, for the placement strategies that use it.
+
+    """
+
+    def __init__(self, track_projects=False, max_memory_mb=None):
+        self.track_projects = track_projects
+        self.max_memory_mb = max_memory_mb
+        self.committed = {}
+        self.services = {}
+        self.projects = {}
+        # Maps instance ids to [host, memory_mb, finished_at, project_id].
+        self.claims = {}
+        self.synced_at = None
+        self.sync_started_at = None
+        # The latest deleted_at time of the instances the last sync read.
+        self.synced_deletes_until = None
+        self.syncs = 0
+
+    def sync_is_due(self):
+        if self.synced_at is None:
+            return True
+        interval = FLAGS.reddwarf_scheduler_memory_sync_interval
+        return time.time() >= self.synced_at + interval
+
+    def sync(self, context):
+        """Reloads the memory committed on each host from the database."""
+        started_at = time.time()
+        results = db_api.service_get_all_compute_memory(context)
+        # Read after the memory, so a delete made in between is taken as
+        # seen; its release is then ignored rather than counted twice.
+        deletes_until = db_api.instance_last_deleted_at(context)
+        project_counts = None
+        if self.track_projects:
+            project_counts = db_api.instance_count_by_host_and_project(
+                context)
+        self.load(results, project_counts, started_at, deletes_until)
+        self.syncs += 1
+
+    def load(self, results, project_counts=None, started_at=None,
+             deletes_until=None):
+        """Replaces the table with the given (service, memory_mb) pairs and
+        (host, project_id, count) rows, read at started_at, after instances
+        deleted up to deletes_until."""
+        if started_at is None:
+            started_at = time.time()
+        self.committed = {}
+        self.services = {}
+        self.projects = {}
+        for service, memory_mb in results:
+            self.committed[service['host']] = memory_mb
+            self.services[service['host']] = service
+        for host, project_id, count in project_counts or []:
+            self.projects.setdefault(host, {})[project_id] = count
+        for instance_id, claim in self.claims.items():
+            host, memory_mb, finished_at, project_id = claim
+            if finished_at is not None and finished_at < started_at:
+                # The instance was saved before the query so it is counted.
+                del self.claims[instance_id]
+            elif host in self.committed:
+                self.committed[host] += memory_mb
+                self._count_project(host, project_id, 1)
+        self.sync_started_at = started_at
+        self.synced_deletes_until = deletes_until
+        self.synced_at = time.time()
+
+    def _count_project(self, host, project_id, change):
+        if not self.track_projects or project_id is None:
+            return
+        counts = self.projects.setdefault(host, {})
+        count = counts.get(project_id, 0) + change
+        if count > 0:
+            counts[project_id] = count
+        else:
+            counts.pop(project_id, None)
+
+    def claim(self, instance_id, memory_mb, is_up, strategy,
+              project_id=None):
+        """Claims the memory on the host picked by the strategy.
+
+        Returns the host, or None if no host that is up has enough memory.
+        Nothing here yields, so two greenthreads can't claim the same room.
+
+        """
+        self.abort_claim(instance_id)
+        hosts = self._fitting_hosts(memory_mb, is_up)
+        if not hosts:
+            return None
+        host = strategy.choose(self, hosts, memory_mb, project_id)
+        self.committed[host] += memory_mb
+        self._count_project(host, project_id, 1)
+        self.claims[instance_id] = [host, memory_mb, None, project_id]
+        return host
+
+    def _fitting_hosts(self, memory_mb, is_up):
+        max_memory_mb = self.max_memory_mb or FLAGS.max_instance_memory_mb
+        return [host for host, committed in self.committed.iteritems()
+                if committed + memory_mb <= max_memory_mb and
+                   is_up(self.services[host])]
+
+    def choose_hosts(self, memory_mb, count, is_up, strategy,
+                     project_id=None):
+        """Returns up to count hosts the strategy would place instances of
+        the given size on next, in order, without claiming any memory."""
+        hosts = self._fitting_hosts(memory_mb, is_up)
+        chosen = []
+        while hosts and len(chosen) < count:
+            host = strategy.choose(self, hosts, memory_mb, project_id)
+            hosts.remove(host)
+            chosen.append(host)
+        return chosen
+
+    def finish_claim(self, instance_id):
+        """Marks the instance of the claim as saved to the database."""
+        claim = self.claims.get(instance_id)
+        if claim is not None:
+            claim[2] = time.time()
+
+    def abort_claim(self, instance_id):
+        """Gives back the memory of a claim."""
+        claim = self.claims.pop(instance_id, None)
+        if claim is not None:
+            host, memory_mb, _finished_at, project_id = claim
+            self.release(host, memory_mb, project_id=project_id)
+
+    def release(self, host, memory_mb, deleted_at=None, project_id=None):
+        """Gives back the memory of a deleted instance.
+
+        Instances deleted no later than the latest delete read by the last
+        sync are taken to be reflected by the database and are ignored.
+        Both times come from the deleted_at column, so a clock skew between
+        hosts can only delay a release until the next sync.
+
+        """
+        if deleted_at is not None and self.synced_deletes_until is not None \
+           and deleted_at <= self.synced_deletes_until:
+            return
+        if host in self.committed:
+            self.committed[host] = max(0, self.committed[host] - memory_mb)
+            self._count_project(host, project_id, -1)
+
+    def get_stats(self):
+        return {'hosts': len(self.committed),
+                'claims': len(self.claims),
+                'syncs': self.syncs}
+
+
 class MemoryScheduler(SimpleScheduler):
-    """Implements Naive Scheduler to find a host with the most free memory."""
+    """Implements Naive Scheduler to find a host with enough free memory.
+
+    The host is picked by the placement strategy named by the
+    reddwarf_scheduler_placement_strategy flag.
+
+    """
+
+    def __init__(self):
+        super(MemoryScheduler, self).__init__()
+        self.strategy = utils.import_object(
+            FLAGS.reddwarf_scheduler_placement_strategy)
+        self.tracker = HostMemoryTracker(self.strategy.uses_projects)
+
+    def _claim(self, instance_ref):
+        return self.tracker.claim(instance_ref['id'],
+                                  instance_ref['memory_mb'],
+                                  self.service_is_up,
+                                  self.strategy,
+                                  instance_ref['project_id'])
 
     def _schedule_based_on_resources(self, context, instance_ref):
-        results = db_api.service_get_all_compute_memory(context)
-        for result in results:
-            (service, memory_mb) = result
-            needed_memory = memory_mb + instance_ref['memory_mb']
-            if needed_memory <= FLAGS.max_instance_memory_mb and \
-               self.service_is_up(service):
-                LOG.debug("Scheduling instance %s" % 
-                          instance_ref['display_name'])
-                return self._schedule_now_on_host(context, service['host'],
-                                                  instance_ref['id'])
-        LOG.debug("Error scheduling %s" % instance_ref['display_name'])
-        raise driver.NoValidHost(_("Insufficient memory on all hosts."))
+        if self.tracker.sync_is_due():
+            self.tracker.sync(context)
+        host = self._claim(instance_ref)
+        if host is None:
+            # Memory freed since the last sync may make room, so look again.
+            self.tracker.sync(context)
+            host = self._claim(instance_ref)
+        if host is None:
+            LOG.debug("Error scheduling %s" % instance_ref['display_name'])
+            raise driver.NoValidHost(_("Insufficient memory on all hosts."))
+        LOG.debug("Scheduling instance %s" % instance_ref['display_name'])
+        try:
+            self._schedule_now_on_host(context, host, instance_ref['id'])
+        except Exception:
+            self.tracker.abort_claim(instance_ref['id'])
+            raise
+        self.tracker.finish_claim(instance_ref['id'])
+        return host
+
+    def schedule_instance_memory_released(self, context, host, memory_mb,
+                                          deleted_at=None, project_id=None,
+                                          **_kwargs):
+        """Gives back the memory of an instance deleted from the host."""
+        if deleted_at is None:
+            # Sent by an older compute node; the next sync will see it.
+            return
+        self.tracker.release(host, memory_mb,
+                             utils.parse_strtime(deleted_at), project_id)
+
+    def schedule_prefetch_image(self, context, image_ref, memory_mb,
+                                count=1, **_kwargs):
+        """Warms the image cache of the hosts the next instances of the
+        given size are likely to be placed on, ahead of a burst of creates.
+
+        The casts are made here, so None is returned to keep the scheduler
+        manager from casting to a host itself.
+
+        """
+        if self.tracker.sync_is_due():
+            self.tracker.sync(context)
+        hosts = self.tracker.choose_hosts(memory_mb, count,
+                                          self.service_is_up, self.strategy)
+        messages = []
+        for host in hosts:
+            LOG.debug("Prefetching image %s on %s" % (image_ref, host))
+            messages.append(
+                (db.queue_get_for(context, FLAGS.compute_topic, host),
+                 {'method': 'prefetch_image',
+                  'args': {'image_ref': image_ref}}))
+        if messages:
+            rpc.cast_many(context, messages)
+        return None
 
 
 class UnforgivingMemoryScheduler(MemoryScheduler):
@@ -0,0 +1,152 @@
+#    Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Replays create and delete events against a synthetic fleet of compute
+hosts to compare the placement strategies of the memory scheduler.
+
+An event is a dict such as
+    {"event": "create", "instance_id": 1, "memory_mb": 512,
+     "project_id": "p1"}
+    {"event": "delete", "instance_id": 1}
+and a recorded sequence is stored as one JSON event per line.
+"""
+
+import json
+import random
+import time
+
+from nova import utils
+
+from reddwarf.scheduler import simple
+
+
+STRATEGIES = {
+    'worst-fit': 'reddwarf.scheduler.placement.WorstFitStrategy',
+    'best-fit': 'reddwarf.scheduler.placement.BestFitStrategy',
+    'anti-affinity': 'reddwarf.scheduler.placement.TenantAntiAffinityStrategy',
+}
+
+
+def generate_events(count, seed=None, sizes=(512, 1024, 2048, 4096),
+                    projects=20, delete_ratio=0.45):
+    """Returns a random sequence of count create and delete events."""
+    rand = random.Random(seed)
+    events = []
+    live = []
+    next_id = 1
+    for i in range(count):
+        if live and rand.random() < delete_ratio:
+            instance_id = live.pop(rand.randrange(len(live)))
+            events.append({'event': 'delete', 'instance_id': instance_id})
+        else:
+            project_id = 'project%d' % rand.randrange(projects)
+            events.append({'event': 'create',
+                           'instance_id': next_id,
+                           'memory_mb': rand.choice(sizes),
+                           'project_id': project_id})
+            live.append(next_id)
+            next_id += 1
+    return events
+
+
+def load_events(path):
+    """Reads a recorded sequence of events, one JSON event per line."""
+    with open(path) as events_file:
+        return [json.loads(line) for line in events_file if line.strip()]
+
+
+def simulate(strategy, events, hosts, host_memory_mb):
+    """Replays the events on an empty fleet and returns the results.
+
+    The density is the memory used divided by the memory of the hosts in
+    use, averaged over the events, and colocated counts the instances
+    sharing a host with another instance of their project at the end.
+    With no hosts every create fails and nothing is free.
+
+    """
+    tracker = simple.HostMemoryTracker(strategy.uses_projects,
+                                       max_memory_mb=host_memory_mb)
+    tracker.load([({'host': 'host%03d' % i}, 0) for i in range(hosts)])
+    is_up = lambda service: True
+    latencies = []
+    failed = 0
+    densities = []
+    for event in events:
+        if event['event'] == 'create':
+            start = time.time()
+            host = tracker.claim(event['instance_id'], event['memory_mb'],
+                                 is_up, strategy, event.get('project_id'))
+            latencies.append(time.time() - start)
+            if host is None:
+                failed += 1
+        elif event['event'] == 'delete':
+            # Nothing is synced here so every placement stays a claim.
+            tracker.abort_claim(event['instance_id'])
+        used_hosts = len([memory_mb for memory_mb in
+                          tracker.committed.itervalues() if memory_mb])
+        if used_hosts:
+            used_memory = sum(tracker.committed.itervalues())
+            densities.append(float(used_memory) /
+                             (used_hosts * host_memory_mb))
+
+    projects = {}
+    for host, _memory_mb, _finished_at, project_id in tracker.claims.values():
+        if project_id is not None:
+            projects.setdefault((host, project_id), []).append(project_id)
+    latencies.sort()
+    return {
+        'placed': len(latencies) - failed,
+        'failed': failed,
+        'instances': len(tracker.claims),
+        'hosts_used': len([memory_mb for memory_mb in
+                           tracker.committed.itervalues() if memory_mb]),
+        'density': (sum(densities) / len(densities) if densities else 0.0),
+        'largest_free_mb': (host_memory_mb - min(tracker.committed.values())
+                            if tracker.committed else 0),
+        'colocated': sum(len(instances) for instances in projects.values()
+                         if len(instances) > 1),
+        'mean_latency_us': (sum(latencies) / len(latencies) * 1000000
+                            if latencies else 0.0),
+        'p99_latency_us': (latencies[int(len(latencies) * 0.99)] * 1000000
+                           if latencies else 0.0),
+    }
+
+
+def compare(events, hosts, host_memory_mb, strategies=None):
+    """Returns the results of simulate for each of the named strategies."""
+    results = {}
+    for name in strategies or sorted(STRATEGIES):
+        strategy = utils.import_object(STRATEGIES[name])
+        results[name] = simulate(strategy, events, hosts, host_memory_mb)
+    return results
+
+
+def format_results(results):
+    """Returns the results of compare as a table."""
+    columns = ['placed', 'failed', 'hosts_used', 'density',
+               'largest_free_mb', 'colocated', 'mean_latency_us',
+               'p99_latency_us']
+    lines = ['%-14s' % 'strategy' + ''.join('%17s' % column
+                                            for column in columns)]
+    for name in sorted(results):
+        values = []
+        for column in columns:
+            value = results[name][column]
+            if isinstance(value, float):
+                values.append('%17.2f' % value)
+            else:
+                values.append('%17d' % value)
+        lines.append('%-14s' % name + ''.join(values))
+    return '\n'.join(lines)
@@ -25,14 +25,17 @@ from paste import urlmap
 import nova
 from nova import context
 from nova import test
+from nova.api.openstack import wsgi
 from nova.compute import vm_states
 from nova.compute import power_state
+from nova.db.sqlalchemy import session as db_session
 import nova.exception as nova_exception
 
 
 import reddwarf
 from reddwarf.api import instances
 from reddwarf.db import models
+from reddwarf.guest import api as guest_api
 from reddwarf.tests import util
 
 base_url = util.v1_prefix
@@ -118,6 +121,30 @@ class MgmtApiTest(test.TestCase):
     def test_instances_index_restricted(self):
         self._test_path_restricted('instances')
 
+    def test_dbstats_restricted(self):
+        self._test_path_restricted('dbstats')
+
+    def test_dbstats(self):
+        self.stubs.Set(db_session, 'get_query_stats',
+                       lambda: {'slow_queries': 1,
+                                'functions': {'reddwarf.db.api.f': {
+                                    'count': 2, 'time': 3.0,
+                                    'max_time': 2.0, 'rows': 4}}})
+        cache_stats = {'hits': 5, 'misses': 2, 'evictions': 0, 'size': 2}
+        self.stubs.Set(guest_api, 'get_result_cache_stats',
+                       lambda: cache_stats)
+        req = webob.Request.blank(mgmt_url + 'dbstats')
+        admin_context = context.RequestContext('fake', 'fake',
+                                              auth_token=True, is_admin=True)
+        res = req.get_response(util.wsgi_app(fake_auth_context=admin_context))
+        self.assertEqual(res.status_int, 200)
+        res_body = json.loads(res.body)
+        self.assertEqual(1, res_body['dbstats']['slowQueries'])
+        self.assertEqual([{'name': 'reddwarf.db.api.f', 'count': 2,
+                           'time': 3.0, 'maxTime': 2.0, 'rows': 4}],
+                         res_body['dbstats']['functions'])
+        self.assertEqual(cache_stats, res_body['dbstats']['guestResultCache'])
+
     def test_get_guest_info_no_dbs(self):
         # Instantiate the controller because we need to inject mocked
         # attributes and methods
@@ -165,14 +192,12 @@ class MgmtApiTest(test.TestCase):
         # Just some mock goodness
         status = mox.MockAnything()
         status.is_sql_running = True
-        self.mox.StubOutWithMock(controller.guest_api, 'list_databases')
-        controller.guest_api.list_databases(FAKE_CONTEXT,
-                                            FAKE_INSTANCE['id'])\
-            .AndReturn(FAKE_DB_LIST)
-        self.mox.StubOutWithMock(controller.guest_api, 'list_users')
-        controller.guest_api.list_users(FAKE_CONTEXT,
-                                        FAKE_INSTANCE['id'])\
-            .AndReturn(FAKE_USER_LIST)
+        self.mox.StubOutWithMock(controller.guest_api, 'get_instance_summary')
+        controller.guest_api.get_instance_summary(FAKE_CONTEXT,
+                                                  FAKE_INSTANCE['id'],
+                                                  include_root_enabled=False,
+                                                  include_databases=True)\
+            .AndReturn({'databases': FAKE_DB_LIST, 'users': FAKE_USER_LIST})
         self.mox.StubOutWithMock(reddwarf.api.management.dbapi,
                                  'get_root_enabled_history')
         reddwarf.api.management.dbapi.get_root_enabled_history(
@@ -188,4 +213,70 @@ class MgmtApiTest(test.TestCase):
         self.assertTrue(len(instance['databases']) >= 0)
         self.assertTrue(len(instance['users']) >= 0)
         self.assertEqual(root_enabled.created_at, instance['root_enabled_at'])
-        self.assertEqual(root_enabled.user_id, instance['root_enabled_by'])
\ No newline at end of file
+        self.assertEqual(root_enabled.user_id, instance['root_enabled_by'])
+
+FAKE_MGMT_INSTANCES = [
+    {'id': 1, 'uuid': 'uuid-1', 'project_id': 'tenant', 'host': 'host1',
+     'vm_state': 'active', 'created_at': None, 'deleted_at': None,
+     'deleted': False, 'flavorid': 1},
+    {'id': 2, 'uuid': 'uuid-2', 'project_id': 'tenant', 'host': 'host2',
+     'vm_state': 'active', 'created_at': None, 'deleted_at': None,
+     'deleted': False, 'flavorid': None},
+]
+FAKE_MGMT_IPS = {1: [{'address': '10.0.0.2', 'virtual_interface_id': 7}]}
+FAKE_MGMT_VOLUMES = {2: [{'size': 2, 'mountpoint': '/dev/vdb'}]}
+
+
+class MgmtIndexTest(test.TestCase):
+    """Test the paginated and streamed management instance index"""
+
+    def setUp(self):
+        super(MgmtIndexTest, self).setUp()
+        self.context = context.RequestContext('fake', 'fake',
+                                              auth_token=True, is_admin=True)
+        self.controller = reddwarf.api.management.Controller()
+        self.mox.StubOutWithMock(reddwarf.api.management.dbapi,
+                                 'instances_mgmt_index')
+
+    def _request(self, query=''):
+        req = wsgi.Request.blank('/mgmt/instances' + query)
+        req.environ['nova.context'] = self.context
+        return req
+
+    def test_index_associates_by_instance_id(self):
+        reddwarf.api.management.dbapi.instances_mgmt_index(
+            self.context, None, None, 5).AndReturn((FAKE_MGMT_INSTANCES,
+                                                    FAKE_MGMT_IPS,
+                                                    FAKE_MGMT_VOLUMES))
+        self.mox.ReplayAll()
+        result = self.controller.index(req=self._request('?limit=5'))
+        instances = result['instances']
+        self.assertEqual(2, len(instances))
+        self.assertEqual('uuid-1', instances[0]['id'])
+        self.assertEqual(1, instances[0]['flavorid'])
+        self.assertEqual(FAKE_MGMT_IPS[1], instances[0]['ips'])
+        self.assertEqual([], instances[0]['volumes'])
+        self.assertFalse('flavorid' in instances[1])
+        self.assertEqual([], instances[1]['ips'])
+        self.assertEqual(FAKE_MGMT_VOLUMES[2], instances[1]['volumes'])
+
+    def test_index_rejects_bad_limit(self):
+        self.mox.ReplayAll()
+        self.assertRaises(reddwarf.exception.BadRequest,
+                          self.controller.index,
+                          req=self._request('?limit=abc'))
+
+    def test_index_streams_in_batches(self):
+        self.flags(reddwarf_mgmt_index_stream_batch_size=1)
+        dbapi = reddwarf.api.management.dbapi
+        dbapi.instances_mgmt_index(self.context, None, None, 1).\
+            AndReturn((FAKE_MGMT_INSTANCES[:1], FAKE_MGMT_IPS, {}))
+        dbapi.instances_mgmt_index(self.context, None, 1, 1).\
+            AndReturn((FAKE_MGMT_INSTANCES[1:], {}, FAKE_MGMT_VOLUMES))
+        dbapi.instances_mgmt_index(self.context, None, 2, 1).\
+            AndReturn(([], {}, {}))
+        self.mox.ReplayAll()
+        response = self.controller.index(req=self._request('?stream=true'))
+        body = json.loads(''.join(response.app_iter))
+        self.assertEqual(['uuid-1', 'uuid-2'],
+                         [instance['id'] for instance in body['instances']])
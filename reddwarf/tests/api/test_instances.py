@@ -237,3 +237,49 @@ class InstanceApiValidation(test.TestCase):
     def test_invalid_instance_restart(self):
         self.controller._validate_restart_instance(1, vm_states.BUILDING)
 
+
+
+class InstanceListFiltersTest(test.TestCase):
+    """Test the conversion of search options to database filters"""
+
+    def setUp(self):
+        super(InstanceListFiltersTest, self).setUp()
+        self.context = context.get_admin_context()
+        self.controller = instances.Controller()
+
+    def test_default_filters(self):
+        filters = self.controller._get_filters(self.context,
+                                               {'limit': '5', 'marker': 'x'})
+        self.assertEqual({'deleted': False}, filters)
+
+    def test_name_and_status(self):
+        filters = self.controller._get_filters(self.context,
+                                               {'name': 'db',
+                                                'status': 'ACTIVE'})
+        self.assertEqual({'display_name': 'db', 'vm_state': vm_states.ACTIVE,
+                          'deleted': False}, filters)
+
+    def test_changes_since_includes_deleted(self):
+        filters = self.controller._get_filters(
+            self.context, {'changes-since': '2011-01-24T17:08:01Z'})
+        self.assertFalse('deleted' in filters)
+
+    @raises(exception.BadRequest)
+    def test_invalid_status(self):
+        self.controller._get_filters(self.context, {'status': 'BOGUS'})
+
+    @raises(nova_exception.InvalidInput)
+    def test_unknown_option(self):
+        self.controller._get_filters(self.context, {'ip': '10.0.0.1'})
+
+    def test_detail_server_has_hostname_and_volume(self):
+        instance = {'id': 1, 'uuid': 'abc', 'display_name': 'db',
+                    'vm_state': vm_states.ACTIVE, 'task_state': None,
+                    'created_at': None, 'updated_at': None,
+                    'instance_type': {'flavorid': 1}, 'hostname': 'db-1'}
+        volumes = [{'id': 2, 'name': 'vol', 'description': None, 'size': 5}]
+        server = self.controller._build_server(instance, True, volumes)
+        self.assertEqual('db-1', server['hostname'])
+        self.assertEqual(volumes, server['volumes'])
+        self.assertEqual({'size': 5},
+                         self.controller.view.build_volume(server))
@@ -144,3 +144,14 @@ class StatusApiTest(test.TestCase):
     def test_get_status_from_server(self):
         lookup = status.InstanceStatusLookup([fake_instance['instance_id']])
         server = lookup.get_status_from_server(fake_instance)
+
+    def test_lookup_with_preloaded_guest_statuses(self):
+        def fail_guest_status_get_list(id_list=None):
+            self.fail("Guest statuses should not be loaded again.")
+        self.stubs.Set(reddwarf.db.api, "guest_status_get_list",
+                       fail_guest_status_get_list)
+        guest_status = fake_status()
+        guest_status.state = power_state.RUNNING
+        lookup = status.InstanceStatusLookup([0], {0: guest_status})
+        server = lookup.get_status_from_server(fake_instance)
+        self.assertTrue(server.is_sql_running)
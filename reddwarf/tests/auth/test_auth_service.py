@@ -16,6 +16,7 @@
 Tests the Authorization Service
 """
 
+import eventlet
 import json
 import mox
 import stubout
@@ -64,6 +65,7 @@ class AuthApiTest(test.TestCase):
                        get_admin_auth_token)
         self.stubs.Set(auth_token.AuthProtocol, "_validate_token",
                        validate_token)
+        self.stubs.Set(auth_token, "TOKEN_CACHE", None)
         app = nova_auth_token.KeystoneAuthShim(None)
         self.auth = auth_token.AuthProtocol(app, {})
 
@@ -113,8 +115,116 @@ class AuthApiTest(test.TestCase):
 
     def test_cache_hit(self):
         cache_key = "aat/dbaas"
-        self.auth.cache.set_value(cache_key, (data, 200))
+        self.auth.cache.set(cache_key, (data, 200))
         req = webob.Request.blank(flavors_url)
         req.headers = [("X-AUTH-TOKEN", "aat")]
         res = req.get_response(util.wsgi_app(fake_auth=False))
         self.assertEqual(res.status_int, 200)
+
+
+class AuthValidationTest(test.TestCase):
+    """Tests the caching and coalescing of token validations."""
+
+    def setUp(self):
+        super(AuthValidationTest, self).setUp()
+        self.calls = []
+        self.stubs.Set(auth_token.AuthProtocol, "get_admin_auth_token",
+                       get_admin_auth_token)
+        self.stubs.Set(auth_token.AuthProtocol, "_validate_token",
+                       self._validate_token)
+        self.stubs.Set(auth_token, "TOKEN_CACHE", None)
+        self.auth = auth_token.AuthProtocol(None, {})
+
+    def _validate_token(self, claims, tenant=None):
+        self.calls.append(claims)
+        eventlet.sleep(0.01)
+        return validate_token(None, claims, tenant)
+
+    def test_concurrent_validations_are_coalesced(self):
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(lambda i: self.auth._get_validation(TOKEN,
+                                                                     "dbaas"),
+                                 range(5)))
+        self.assertEqual([(data, 200)] * 5, results)
+        self.assertEqual([TOKEN], self.calls)
+        stats = self.auth.get_stats()
+        self.assertEqual(1, stats['validations'])
+        self.assertEqual(4, stats['coalesced'])
+
+    def test_rejected_tokens_are_cached(self):
+        for i in range(3):
+            self.assertEqual((data, 401),
+                             self.auth._get_validation("bad", "dbaas"))
+        self.assertEqual(["bad"], self.calls)
+        self.assertEqual(2, self.auth.get_stats()['hits'])
+
+    def test_service_errors_are_not_cached(self):
+        self.stubs.Set(auth_token.AuthProtocol, "_validate_token",
+                       lambda self, claims, tenant: (data, 503))
+        auth = auth_token.AuthProtocol(None, {})
+        auth._get_validation(TOKEN, "dbaas")
+        auth._get_validation(TOKEN, "dbaas")
+        self.assertEqual(2, auth.get_stats()['validations'])
+
+    def test_cache_is_bounded(self):
+        self.flags(reddwarf_auth_cache_size=2)
+        self.stubs.Set(auth_token, "TOKEN_CACHE", None)
+        auth = auth_token.AuthProtocol(None, {})
+        for tenant in ("a", "b", "c"):
+            auth._get_validation(TOKEN, tenant)
+        stats = auth.get_stats()
+        self.assertEqual(2, stats['size'])
+        self.assertEqual(1, stats['evictions'])
+
+
+class FakeHTTPConnection(object):
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.requests = 0
+        self.closed = 0
+
+    def request(self, method, path, body, headers):
+        self.requests += 1
+        if self.failures:
+            self.failures -= 1
+            raise auth_token.httplib.BadStatusLine("")
+
+    def getresponse(self):
+        return FakeHTTPResponse()
+
+    def close(self):
+        self.closed += 1
+
+
+class FakeHTTPResponse(object):
+
+    status = 200
+
+    def read(self):
+        return data
+
+
+class HTTPConnectionPoolTest(test.TestCase):
+
+    def setUp(self):
+        super(HTTPConnectionPoolTest, self).setUp()
+        self.pool = auth_token.HTTPConnectionPool("http", "localhost", 35357,
+                                                  2)
+
+    def test_connection_is_reused(self):
+        conn = FakeHTTPConnection(0)
+        self.pool.create = lambda: conn
+        for i in range(3):
+            response, body = self.pool.request("GET", "/v1.1/token")
+            self.assertEqual(data, body)
+        self.assertEqual(3, conn.requests)
+        self.assertEqual(0, conn.closed)
+
+    def test_closed_connection_is_retried_once(self):
+        conn = FakeHTTPConnection(1)
+        self.pool.create = lambda: conn
+        response, body = self.pool.request("GET", "/v1.1/token")
+        self.assertEqual(200, response.status)
+        self.assertEqual(2, conn.requests)
+        self.assertEqual(1, conn.closed)
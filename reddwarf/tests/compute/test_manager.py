@@ -15,6 +15,7 @@
 Tests for reddwarf.compute.manager.
 """
 
+import eventlet
 import webob
 from paste import urlmap
 
@@ -26,6 +27,7 @@ from nova import flags
 from nova import test
 from nova import utils
 from nova.compute import instance_types
+from nova.compute import power_state
 from nova.compute import vm_states
 from reddwarf import exception as reddwarf_exception
 from reddwarf.compute import manager
@@ -275,3 +277,126 @@ class RdComputeManagerGuestUpdateTest(test.TestCase):
         dbapi.guest_status_update(self.instance_id, guest_status.UNKNOWN)
         self.mox.ReplayAll()
         self.rd_compute.update_guest(self.ctxt, self.instance_id)
+
+
+class FakeComputeManager(object):
+
+    def __init__(self):
+        self.terminated = []
+
+    def terminate_instance(self, context, instance_id):
+        self.terminated.append(instance_id)
+
+
+class RdComputeManagerTerminateTest(test.TestCase):
+    """Tests telling the schedulers about deletes in terminate_instance."""
+
+    def setUp(self):
+        super(RdComputeManagerTerminateTest, self).setUp()
+        self.flags(connection_type='openvz',
+                   compute_manager="reddwarf.compute.manager.ReddwarfComputeManager",
+                   stub_network=True,
+                   network_manager='nova.network.manager.FlatManager')
+        self.rd_compute = utils.import_object(FLAGS.compute_manager)
+        self.rd_compute.compute_manager = FakeComputeManager()
+        self.ctxt = context.get_admin_context()
+        self.instance_id = 12345
+        self.reads = []
+        self.casts = []
+        self.stubs.Set(self.rd_compute.db, 'volume_get_all_by_instance',
+                       lambda context, instance_id: [])
+        self.stubs.Set(self.rd_compute.db, 'instance_get',
+                       self._fake_instance_get)
+        self.stubs.Set(manager.rpc, 'fanout_cast',
+                       lambda context, topic, msg:
+                           self.casts.append((topic, msg)))
+
+    def _fake_instance_get(self, context, instance_id):
+        self.reads.append(context.read_deleted)
+        return {'id': instance_id,
+                'host': 'host1',
+                'memory_mb': 512,
+                'project_id': 'project1',
+                'deleted_at': utils.parse_strtime(
+                    "2012-01-01T00:00:01.000000")}
+
+    def test_nothing_is_read_when_schedulers_are_not_told(self):
+        self.flags(reddwarf_notify_scheduler_of_deletes=False)
+        self.rd_compute.terminate_instance(self.ctxt, self.instance_id)
+        self.assertEqual([self.instance_id],
+                         self.rd_compute.compute_manager.terminated)
+        self.assertEqual([], self.reads)
+        self.assertEqual([], self.casts)
+
+    def test_deleted_instance_is_read_once(self):
+        self.flags(reddwarf_notify_scheduler_of_deletes=True)
+        self.rd_compute.terminate_instance(self.ctxt, self.instance_id)
+        self.assertEqual([True], self.reads)
+        self.assertEqual([(FLAGS.scheduler_topic,
+                           {'method': 'instance_memory_released',
+                            'args': {'topic': FLAGS.compute_topic,
+                                     'host': 'host1',
+                                     'memory_mb': 512,
+                                     'project_id': 'project1',
+                                     'deleted_at':
+                                         '2012-01-01T00:00:01.000000'}})],
+                         self.casts)
+
+
+class FakeGuestStatus(object):
+
+    def __init__(self, state):
+        self.state = state
+
+
+class WaitForGuestTest(test.TestCase):
+    """Tests waiting on the guest status notifications in wait_for_guest."""
+
+    def setUp(self):
+        super(WaitForGuestTest, self).setUp()
+        self.instance_id = 12345
+        self.states = [power_state.BUILDING]
+        self.checks = 0
+        self.waiters = manager.GuestStatusWaiters()
+        self.initializer = manager.ReddwarfInstanceInitializer(None, None,
+            context.get_admin_context(), self.instance_id)
+
+        def guest_status_get(instance_id):
+            self.checks += 1
+            return FakeGuestStatus(self.states[-1])
+        self.stubs.Set(dbapi, "guest_status_get", guest_status_get)
+
+    def test_notification_wakes_waiter(self):
+        self.flags(reddwarf_guest_status_poll_interval=60,
+                   reddwarf_guest_initialize_time_out=60)
+
+        def guest_starts():
+            self.states.append(power_state.RUNNING)
+            self.waiters.notify(self.instance_id, power_state.RUNNING)
+        eventlet.spawn_after(0.01, guest_starts)
+        with Timeout(5):
+            self.assertTrue(self.initializer.wait_for_guest(None,
+                                                            self.waiters))
+        self.assertEqual(2, self.checks)
+        self.assertEqual({}, self.waiters.events)
+
+    def test_falls_back_to_polling(self):
+        self.flags(reddwarf_guest_status_poll_interval=0.01,
+                   reddwarf_guest_initialize_time_out=60)
+        eventlet.spawn_after(0.05, self.states.append, power_state.RUNNING)
+        with Timeout(5):
+            self.assertTrue(self.initializer.wait_for_guest(None,
+                                                            self.waiters))
+        self.assertTrue(self.checks > 2)
+
+    def test_times_out(self):
+        self.flags(reddwarf_guest_status_poll_interval=0.01,
+                   reddwarf_guest_initialize_time_out=0.05)
+        self.assertRaises(reddwarf_exception.PollTimeOut,
+                          self.initializer._wait_until_guest_is_running,
+                          self.waiters, 0.05)
+        self.assertEqual({}, self.waiters.events)
+
+    def test_notify_without_waiter_is_ignored(self):
+        self.waiters.notify(self.instance_id, power_state.RUNNING)
+        self.assertEqual({}, self.waiters.events)
@@ -0,0 +1,105 @@
+#    Copyright 2011 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for the uuid to local id lookups and batched queries in
+reddwarf.db.api.
+"""
+
+from nova import context
+from nova import db
+from nova import test
+
+from reddwarf import exception
+from reddwarf.db import api as dbapi
+
+
+class LocalIdFromUuidTest(test.TestCase):
+
+    def setUp(self):
+        super(LocalIdFromUuidTest, self).setUp()
+        self.stubs.Set(dbapi, 'LOCALID_CACHE', None)
+        self.flags(reddwarf_localid_cache_size=10)
+        self.context = context.get_admin_context()
+        self.instances = [db.instance_create(self.context, {})
+                          for i in range(3)]
+        self.sessions = 0
+        get_session = dbapi.get_session
+
+        def counting_get_session(*args, **kwargs):
+            self.sessions += 1
+            return get_session(*args, **kwargs)
+        self.stubs.Set(dbapi, 'get_session', counting_get_session)
+
+    def tearDown(self):
+        for instance in self.instances:
+            db.instance_destroy(self.context, instance['id'])
+        super(LocalIdFromUuidTest, self).tearDown()
+
+    def test_lookup_is_cached(self):
+        instance = self.instances[0]
+        for i in range(3):
+            self.assertEqual(instance['id'],
+                             dbapi.localid_from_uuid(instance['uuid']))
+        self.assertEqual(1, self.sessions)
+        self.assertEqual(2, dbapi.LOCALID_CACHE.get_stats()['hits'])
+
+    def test_missing_uuid_is_not_found(self):
+        self.assertRaises(exception.NotFound, dbapi.localid_from_uuid,
+                          'no-such-uuid')
+        self.assertRaises(exception.NotFound, dbapi.localid_from_uuid,
+                          'no-such-uuid')
+        self.assertEqual(2, self.sessions)
+
+    def test_batch_lookup_only_queries_uncached(self):
+        dbapi.localid_from_uuid(self.instances[0]['uuid'])
+        uuids = [instance['uuid'] for instance in self.instances]
+        result = dbapi.localids_from_uuids(uuids + ['no-such-uuid'])
+        expected = dict([(instance['uuid'], instance['id'])
+                         for instance in self.instances])
+        self.assertEqual(expected, result)
+        self.assertEqual(2, self.sessions)
+        dbapi.localids_from_uuids(uuids)
+        self.assertEqual(2, self.sessions)
+
+
+class VolumesByInstancesTest(test.TestCase):
+
+    def setUp(self):
+        super(VolumesByInstancesTest, self).setUp()
+        self.context = context.get_admin_context()
+
+    def test_deleted_volumes_are_left_out(self):
+        instance = db.instance_create(self.context, {})
+        kept = db.volume_create(self.context, {'instance_id': instance['id'],
+                                               'size': 1})
+        deleted = db.volume_create(self.context,
+                                   {'instance_id': instance['id'], 'size': 2})
+        db.volume_destroy(self.context, deleted['id'])
+        volumes = dbapi.volume_get_all_by_instances(self.context,
+                                                    [instance['id']])
+        self.assertEqual([kept['id']],
+                         [volume['id'] for volume in volumes[instance['id']]])
+        self.assertEqual({}, dbapi.volume_get_all_by_instances(self.context,
+                                                               []))
+
+    def test_mgmt_index_leaves_out_deleted_volumes(self):
+        instance = db.instance_create(self.context, {})
+        db.volume_create(self.context, {'instance_id': instance['id'],
+                                        'size': 1})
+        deleted = db.volume_create(self.context,
+                                   {'instance_id': instance['id'], 'size': 2})
+        db.volume_destroy(self.context, deleted['id'])
+        instances, ips, volumes = dbapi.instances_mgmt_index(self.context)
+        self.assertEqual([1], [volume['size']
+                               for volume in volumes[instance['id']]])
@@ -0,0 +1,147 @@
+#    Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for the local record index and the job handling of
+reddwarf.dns.rsdns.driver.
+"""
+
+from novaclient.exceptions import NotFound
+
+from nova import test
+
+from reddwarf.dns.driver import DnsEntry
+from reddwarf.dns.rsdns import driver
+from reddwarf.dns.rsdns.driver import RsDnsRecordIndex
+
+
+def fake_entry(name, content):
+    return DnsEntry(name=name, content=content, type="A")
+
+
+class RsDnsRecordIndexTest(test.TestCase):
+
+    def setUp(self):
+        super(RsDnsRecordIndexTest, self).setUp()
+        self.index = RsDnsRecordIndex()
+        self.remote = {'1': fake_entry('a.example.com', '10.0.0.1'),
+                       '2': fake_entry('b.example.com', '10.0.0.2'),
+                       '3': fake_entry('c.example.com', '10.0.0.2')}
+        self.fetched = []
+
+    def fetch_entry(self, record_id):
+        self.fetched.append(record_id)
+        if record_id not in self.remote:
+            raise NotFound(404)
+        return self.remote[record_id]
+
+    def test_refresh_only_fetches_new_records(self):
+        self.index.refresh([('a.example.com', '1')], self.fetch_entry)
+        self.index.refresh([('a.example.com', '1'), ('b.example.com', '2')],
+                           self.fetch_entry)
+        self.assertEqual(['1', '2'], self.fetched)
+        self.assertEqual(['b.example.com'],
+                         [entry.name for entry in
+                          self.index.find(content='10.0.0.2')])
+
+    def test_refresh_drops_records_no_longer_in_database(self):
+        self.index.refresh([('a.example.com', '1'), ('b.example.com', '2')],
+                           self.fetch_entry)
+        self.index.refresh([('b.example.com', '2')], self.fetch_entry)
+        self.assertEqual(None, self.index.get('1'))
+        self.assertEqual([], self.index.find(name='a.example.com'))
+
+    def test_refresh_skips_records_missing_remotely(self):
+        self.index.refresh([('d.example.com', '4'), ('c.example.com', '3')],
+                           self.fetch_entry)
+        self.assertEqual(None, self.index.get('4'))
+        self.assertEqual(1, len(self.index.find(content='10.0.0.2')))
+
+    def list_entries(self):
+        self.listed += 1
+        return dict(self.remote)
+
+    def test_refresh_seeds_an_empty_index_from_the_listing(self):
+        self.listed = 0
+        self.index.refresh([('a.example.com', '1'), ('b.example.com', '2'),
+                            ('d.example.com', '4')],
+                           self.fetch_entry, self.list_entries)
+        self.assertEqual(1, self.listed)
+        # Only the record the listing lacked was asked for on its own.
+        self.assertEqual(['4'], self.fetched)
+        self.assertEqual('b.example.com', self.index.get('2').name)
+        self.index.refresh([('a.example.com', '1'), ('c.example.com', '3')],
+                           self.fetch_entry, self.list_entries)
+        self.assertEqual(1, self.listed)
+        self.assertEqual(['4', '3'], self.fetched)
+
+    def test_refresh_due(self):
+        self.assertTrue(self.index.refresh_due(60))
+        self.index.refresh([], self.fetch_entry)
+        self.assertFalse(self.index.refresh_due(60))
+        self.assertTrue(self.index.refresh_due(0))
+
+
+class FakeClient(object):
+
+    def authenticate(self):
+        pass
+
+
+class FakeRecord(object):
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.data = '10.0.0.1'
+        self.type = 'A'
+        self.ttl = 300
+
+
+class FakeFuture(object):
+
+    def __init__(self, job_id, resource):
+        self.jobId = job_id
+        self.resource = resource
+
+
+class RsDnsDriverFinishEntryTest(test.TestCase):
+
+    def setUp(self):
+        super(RsDnsDriverFinishEntryTest, self).setUp()
+        self.flags(dns_ttl=300)
+        self.stubs.Set(driver, 'create_client_with_flag_values', FakeClient)
+        self.driver = driver.RsDnsDriver()
+        self.deleted_jobs = []
+        self.stubs.Set(driver.dbapi, 'rsdns_job_delete',
+                       self.deleted_jobs.append)
+        self.entry = fake_entry('a.example.com', '10.0.0.1')
+        self.future = FakeFuture('job-1', [FakeRecord('1', 'a.example.com')])
+
+    def test_job_is_deleted_after_the_record_is_stored(self):
+        stored = []
+        self.stubs.Set(driver.dbapi, 'rsdns_record_create',
+                       lambda name, id: stored.append((name, id)))
+        self.driver.finish_entry(self.entry, self.future)
+        self.assertEqual([('a.example.com', '1')], stored)
+        self.assertEqual(['job-1'], self.deleted_jobs)
+        self.assertEqual('a.example.com', self.driver.index.get('1').name)
+
+    def test_job_is_kept_if_the_record_is_not_stored(self):
+        def fail(name, id):
+            raise Exception("database is away")
+
+        self.stubs.Set(driver.dbapi, 'rsdns_record_create', fail)
+        self.assertRaises(Exception, self.driver.finish_entry, self.entry,
+                          self.future)
+        self.assertEqual([], self.deleted_jobs)
@@ -0,0 +1,158 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for reddwarf.guest.api.
+"""
+
+import eventlet
+
+from nova import context
+from nova import rpc
+from nova import test
+
+from reddwarf import exception
+from reddwarf.guest import api as guest_api
+
+
+class TestGetInstanceSummary(test.TestCase):
+
+    def setUp(self):
+        super(TestGetInstanceSummary, self).setUp()
+        self.context = context.get_admin_context()
+        self.api = guest_api.API()
+        self.stubs.Set(self.api, '_get_routing_key',
+                       lambda context, id: "guest.instance-%s" % id)
+        self.responses = {
+            'is_root_enabled': True,
+            'get_filesystem_stats': {'used': 1024},
+            'list_databases': [],
+            'list_users': [],
+        }
+        self.calls = []
+        self.stubs.Set(rpc, 'call', self._fake_call)
+
+    def _fake_call(self, context, topic, msg):
+        self.calls.append((topic, msg['method']))
+        response = self.responses[msg['method']]
+        if isinstance(response, Exception):
+            raise response
+        if response == 'hang':
+            eventlet.sleep(10)
+        return response
+
+    def test_default_summary(self):
+        summary = self.api.get_instance_summary(self.context, 5)
+        self.assertEqual(True, summary['root_enabled'])
+        self.assertEqual({'used': 1024}, summary['volume_info'])
+        self.assertFalse('databases' in summary)
+        self.assertEqual(2, len(self.calls))
+
+    def test_summary_with_databases(self):
+        summary = self.api.get_instance_summary(self.context, 5,
+                                                include_root_enabled=False,
+                                                include_databases=True)
+        self.assertEqual([], summary['databases'])
+        self.assertEqual([], summary['users'])
+        self.assertFalse('root_enabled' in summary)
+        self.assertEqual(3, len(self.calls))
+
+    def test_failed_call_maps_to_guest_error(self):
+        self.responses['is_root_enabled'] = Exception("guest is gone")
+        summary = self.api.get_instance_summary(self.context, 5)
+        self.assertTrue(isinstance(summary['root_enabled'],
+                                   exception.GuestError))
+        self.assertEqual({'used': 1024}, summary['volume_info'])
+
+    def test_slow_call_times_out(self):
+        self.flags(guest_summary_time_out=0.1)
+        self.responses['get_filesystem_stats'] = 'hang'
+        summary = self.api.get_instance_summary(self.context, 5)
+        self.assertEqual(True, summary['root_enabled'])
+        self.assertTrue(isinstance(summary['volume_info'],
+                                   exception.GuestError))
+
+
+class TestGuestResultCache(test.TestCase):
+
+    def setUp(self):
+        super(TestGuestResultCache, self).setUp()
+        self.flags(guest_result_cache_ttl=60, guest_result_cache_size=10)
+        self.stubs.Set(guest_api, 'RESULT_CACHE', None)
+        self.context = context.get_admin_context()
+        self.api = guest_api.API()
+        self.stubs.Set(self.api, '_get_routing_key',
+                       lambda context, id: "guest.instance-%s" % id)
+        self.calls = []
+        self.casts = []
+        self.stubs.Set(rpc, 'call', self._fake_call)
+        self.stubs.Set(rpc, 'cast', self._fake_cast)
+
+    def _fake_call(self, context, topic, msg):
+        self.calls.append(msg['method'])
+        return [{'_name': 'db%d' % len(self.calls)}]
+
+    def _fake_cast(self, context, topic, msg):
+        self.casts.append(msg['method'])
+
+    def test_listing_is_cached(self):
+        first = self.api.list_databases(self.context, 5)
+        second = self.api.list_databases(self.context, 5)
+        self.assertEqual(first, second)
+        self.assertEqual(['list_databases'], self.calls)
+        stats = guest_api.get_result_cache_stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+
+    def test_listing_is_cached_per_instance(self):
+        self.api.list_users(self.context, 5)
+        self.api.list_users(self.context, 6)
+        self.assertEqual(['list_users', 'list_users'], self.calls)
+
+    def test_create_invalidates_listing(self):
+        self.api.list_databases(self.context, 5)
+        self.api.create_database(self.context, 5, [{'_name': 'new'}])
+        self.api.list_databases(self.context, 5)
+        self.api.list_databases(self.context, 5)
+        # Results are not cached again until the change has had time to
+        # reach the guest.
+        self.assertEqual(['list_databases'] * 3, self.calls)
+        stats = guest_api.get_result_cache_stats()
+        self.assertEqual(0, stats['hits'])
+        self.assertEqual(3, stats['misses'])
+
+    def test_create_during_listing_is_not_overwritten(self):
+        def create_while_listing(context, topic, msg):
+            self.api.create_database(self.context, 5, [{'_name': 'new'}])
+            return self._fake_call(context, topic, msg)
+
+        self.stubs.Set(rpc, 'call', create_while_listing)
+        self.api.list_databases(self.context, 5)
+        self.stubs.Set(rpc, 'call', self._fake_call)
+        self.api.list_databases(self.context, 5)
+        self.assertEqual(['list_databases'] * 2, self.calls)
+
+    def test_delete_user_leaves_databases_cached(self):
+        self.api.list_databases(self.context, 5)
+        self.api.delete_user(self.context, 5, {'_name': 'bob'})
+        self.api.list_databases(self.context, 5)
+        self.assertEqual(['list_databases'], self.calls)
+
+    def test_cache_can_be_disabled(self):
+        self.flags(guest_result_cache_ttl=0)
+        self.api.list_users(self.context, 5)
+        self.api.list_users(self.context, 5)
+        self.assertEqual(['list_users', 'list_users'], self.calls)
@@ -0,0 +1,283 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for the status reporting and batched statements of
+reddwarf.guest.dbaas.
+"""
+
+from nova import test
+
+from reddwarf.guest import dbaas
+from reddwarf.guest import status as guest_status
+
+
+class FakeDbApi(object):
+
+    def __init__(self):
+        self.updates = []
+        self.fail = False
+
+    def guest_status_update(self, instance_id, status):
+        if self.fail:
+            raise Exception("database is down")
+        self.updates.append((instance_id, status))
+
+
+class TestGuestStatusReporter(test.TestCase):
+
+    def setUp(self):
+        super(TestGuestStatusReporter, self).setUp()
+        self.fake_dbapi = FakeDbApi()
+        self.stubs.Set(dbaas, 'dbapi', self.fake_dbapi)
+        self.now = 1000.0
+        self.stubs.Set(dbaas.time, 'time', lambda: self.now)
+        self.casts = []
+        self.stubs.Set(dbaas.db, 'instance_get',
+                       lambda ctxt, instance_id: {'host': 'node1'})
+        self.stubs.Set(dbaas.db, 'queue_get_for',
+                       lambda ctxt, topic, host: '%s.%s' % (topic, host))
+        self.stubs.Set(dbaas.rpc, 'cast',
+                       lambda ctxt, topic, msg: self.casts.append((topic,
+                                                                  msg)))
+        self.flags(guest_status_heartbeat_interval=60,
+                   guest_status_heartbeat_use_collector=False)
+        self.reporter = dbaas.GuestStatusReporter()
+
+    def test_first_report_is_written(self):
+        self.reporter.report(5, guest_status.RUNNING)
+        self.assertEqual([(5, guest_status.RUNNING)], self.fake_dbapi.updates)
+        self.assertEqual(1, self.reporter.get_metrics()['sent'])
+
+    def test_unchanged_status_is_suppressed(self):
+        self.reporter.report(5, guest_status.RUNNING)
+        self.now += 10
+        self.reporter.report(5, guest_status.RUNNING)
+        self.assertEqual(1, len(self.fake_dbapi.updates))
+        self.assertEqual({'sent': 1, 'heartbeats': 0, 'suppressed': 1},
+                         self.reporter.get_metrics())
+
+    def test_changed_status_is_written(self):
+        self.reporter.report(5, guest_status.BUILDING)
+        self.reporter.report(5, guest_status.RUNNING)
+        self.assertEqual([(5, guest_status.BUILDING),
+                          (5, guest_status.RUNNING)],
+                         self.fake_dbapi.updates)
+
+    def test_changes_are_sent_to_compute(self):
+        self.reporter.report(5, guest_status.BUILDING)
+        self.reporter.report(5, guest_status.BUILDING)
+        self.reporter.report(5, guest_status.RUNNING)
+        self.assertEqual([guest_status.BUILDING.code,
+                          guest_status.RUNNING.code],
+                         [msg['args']['state'] for topic, msg in self.casts])
+        self.assertEqual('guest_status_changed', self.casts[0][1]['method'])
+        self.assertEqual(['compute.node1'] * 2,
+                         [topic for topic, msg in self.casts])
+
+    def test_compute_notification_can_be_disabled(self):
+        self.flags(guest_status_notify_compute=False)
+        self.reporter.report(5, guest_status.RUNNING)
+        self.assertEqual([], self.casts)
+
+    def test_heartbeat_is_sent_after_interval(self):
+        self.reporter.report(5, guest_status.RUNNING)
+        self.now += 60
+        self.reporter.report(5, guest_status.RUNNING)
+        self.assertEqual(2, len(self.fake_dbapi.updates))
+        self.assertEqual(1, self.reporter.get_metrics()['heartbeats'])
+
+    def test_heartbeat_to_collector_carries_the_state(self):
+        self.flags(guest_status_heartbeat_use_collector=True)
+        heartbeats = []
+        self.stubs.Set(dbaas.heartbeat_api.API, 'guest_heartbeat',
+                       lambda api, ctxt, instance_id, state:
+                           heartbeats.append((instance_id, state)))
+        self.reporter.report(5, guest_status.RUNNING)
+        self.now += 60
+        self.reporter.report(5, guest_status.RUNNING)
+        self.assertEqual([(5, guest_status.RUNNING.code)], heartbeats)
+        self.assertEqual(1, len(self.fake_dbapi.updates))
+
+    def test_heartbeat_can_be_disabled(self):
+        self.flags(guest_status_heartbeat_interval=0)
+        self.reporter.report(5, guest_status.RUNNING)
+        self.now += 6000
+        self.reporter.report(5, guest_status.RUNNING)
+        self.assertEqual(1, len(self.fake_dbapi.updates))
+
+    def test_failed_write_is_retried(self):
+        self.fake_dbapi.fail = True
+        self.assertRaises(Exception, self.reporter.report, 5,
+                          guest_status.RUNNING)
+        self.fake_dbapi.fail = False
+        self.reporter.report(5, guest_status.RUNNING)
+        self.assertEqual([(5, guest_status.RUNNING)], self.fake_dbapi.updates)
+
+
+class FakeDbapiError(Exception):
+    pass
+
+
+class FakeMySqlServer(object):
+    """Stands in for a local MySQL server, counting round trips."""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.round_trips = 0
+        self.flushes = 0
+        self.statements = []
+
+    def round_trip(self):
+        self.round_trips += 1
+
+    def run(self, statement):
+        if self.fail_on is not None and self.fail_on in statement:
+            raise FakeDbapiError("Operation failed for %s" % statement)
+        self.statements.append(statement)
+
+
+class FakeCursor(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.pending = []
+
+    def execute(self, sql):
+        self.server.round_trip()
+        self.pending = [s for s in sql.split(";") if s.strip()]
+        self.server.run(self.pending.pop(0))
+
+    def nextset(self):
+        if not self.pending:
+            return None
+        self.server.run(self.pending.pop(0))
+        return 1
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.connection = self
+
+    def cursor(self):
+        return FakeCursor(self.server)
+
+    def begin(self):
+        return self
+
+    def execute(self, statement, *args):
+        self.server.round_trip()
+        self.server.flushes += 1
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeEngine(object):
+
+    class dialect(object):
+        class dbapi(object):
+            Error = FakeDbapiError
+
+    def __init__(self, server):
+        self.server = server
+
+    def connect(self):
+        return FakeConnection(self.server)
+
+
+def fake_users(count, databases_per_user=2):
+    return [{'_name': 'user%d' % i,
+             '_password': 'password',
+             '_databases': [{'_name': 'db%d_%d' % (i, j)}
+                            for j in range(databases_per_user)]}
+            for i in range(count)]
+
+
+def fake_databases(count):
+    return [{'_name': 'db%d' % i,
+             '_character_set': 'utf8',
+             '_collate': 'utf8_general_ci'}
+            for i in range(count)]
+
+
+class TestBatchedStatements(test.TestCase):
+
+    def setUp(self):
+        super(TestBatchedStatements, self).setUp()
+        self.server = FakeMySqlServer()
+        self.stubs.Set(dbaas, 'get_engine',
+                       lambda: FakeEngine(self.server))
+        self.flags(guest_ddl_batch_size=50)
+        self.agent = dbaas.DBaaSAgent()
+
+    def test_users_are_created_in_one_round_trip(self):
+        results = self.agent.create_user(fake_users(3))
+        self.assertEqual(9, len(self.server.statements))
+        # One round trip for the statements and one for the flush.
+        self.assertEqual(2, self.server.round_trips)
+        self.assertEqual(1, self.server.flushes)
+        self.assertEqual([None] * 3, [r['error'] for r in results])
+
+    def test_batches_are_bounded(self):
+        self.flags(guest_ddl_batch_size=2)
+        results = self.agent.create_database(fake_databases(5))
+        self.assertEqual(5, len(results))
+        self.assertEqual(3, self.server.flushes)
+
+    def test_failed_item_is_reported_and_rest_continue(self):
+        self.server.fail_on = "`user1`@"
+        results = self.agent.create_user(fake_users(3))
+        self.assertEqual(['user0', 'user1', 'user2'],
+                         [r['name'] for r in results])
+        self.assertEqual(None, results[0]['error'])
+        self.assertNotEqual(None, results[1]['error'])
+        self.assertEqual(None, results[2]['error'])
+        self.assertEqual(6, len(self.server.statements))
+
+
+class TestBatchedStatementsRoundTrips(test.TestCase):
+    """Compares the round trips of one item per batch with those of
+    larger batches."""
+
+    def setUp(self):
+        super(TestBatchedStatementsRoundTrips, self).setUp()
+        self.agent = dbaas.DBaaSAgent()
+
+    def _round_trips(self, batch_size):
+        server = FakeMySqlServer()
+        self.stubs.Set(dbaas, 'get_engine', lambda: FakeEngine(server))
+        self.flags(guest_ddl_batch_size=batch_size)
+        self.agent.create_user(fake_users(100))
+        self.assertEqual(300, len(server.statements))
+        return server.round_trips
+
+    def test_batches_reduce_round_trips(self):
+        # Each batch takes one round trip for its statements and one for
+        # the flush.
+        self.assertEqual(200, self._round_trips(1))
+        self.assertEqual(4, self._round_trips(50))
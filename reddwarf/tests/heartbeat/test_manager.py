@@ -0,0 +1,87 @@
+#    Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for the service heartbeats of reddwarf.heartbeat.manager.
+"""
+
+import datetime
+
+from nova import context
+from nova import test
+from nova import utils
+
+from reddwarf.heartbeat import manager as heartbeat_manager
+
+
+class HeartbeatManagerServiceTest(test.TestCase):
+
+    def setUp(self):
+        super(HeartbeatManagerServiceTest, self).setUp()
+        self.context = context.get_admin_context()
+        self.manager = heartbeat_manager.HeartbeatManager()
+        self.now = datetime.datetime(2012, 1, 1, 0, 0, 1)
+        self.stubs.Set(utils, 'utcnow', lambda: self.now)
+        self.writes = []
+        self.fail = False
+        self.missing = []
+        self.stubs.Set(heartbeat_manager.db, 'service_heartbeat_many',
+                       self._fake_service_heartbeat_many)
+        self.casts = []
+        self.stubs.Set(heartbeat_manager.rpc, 'cast',
+                       lambda context, topic, msg:
+                           self.casts.append((topic, msg)))
+
+    def _fake_service_heartbeat_many(self, context, heartbeats):
+        if self.fail:
+            raise Exception("database went away")
+        self.writes.append(dict(heartbeats))
+        return self.missing
+
+    def test_heartbeats_are_counted_until_flushed(self):
+        self.manager.service_heartbeat(self.context, 1)
+        self.manager.service_heartbeat(self.context, 1)
+        self.manager.service_heartbeat(self.context, 2)
+        self.manager.flush_service_heartbeats()
+        self.assertEqual([{1: (2, self.now), 2: (1, self.now)}], self.writes)
+        self.manager.flush_service_heartbeats()
+        self.assertEqual(1, len(self.writes))
+
+    def test_failed_flush_keeps_the_heartbeats(self):
+        self.manager.service_heartbeat(self.context, 1)
+        self.manager.service_heartbeat(self.context, 1)
+        self.fail = True
+        self.manager.flush_service_heartbeats()
+        self.assertEqual([], self.writes)
+        self.now = datetime.datetime(2012, 1, 1, 0, 0, 2)
+        self.manager.service_heartbeat(self.context, 1)
+        self.fail = False
+        self.manager.flush_service_heartbeats()
+        self.assertEqual([{1: (3, self.now)}], self.writes)
+
+    def test_missing_service_is_told(self):
+        self.manager.service_heartbeat(self.context, 1, topic='compute',
+                                       host='host1')
+        self.manager.service_heartbeat(self.context, 2, topic='compute',
+                                       host='host2')
+        self.missing = [1]
+        self.manager.flush_service_heartbeats()
+        self.assertEqual([('compute.host1',
+                           {'method': 'service_missing',
+                            'args': {'service_id': 1}})], self.casts)
+
+    def test_missing_service_without_a_topic_is_not_told(self):
+        self.manager.service_heartbeat(self.context, 1)
+        self.missing = [1]
+        self.manager.flush_service_heartbeats()
+        self.assertEqual([], self.casts)
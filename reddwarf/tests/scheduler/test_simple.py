@@ -0,0 +1,218 @@
+#    Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for the memory tracking of reddwarf.scheduler.simple.
+"""
+
+import time
+
+from nova import context
+from nova import test
+from nova import utils
+from nova.scheduler import driver
+
+from reddwarf.scheduler import simple
+
+
+class FakeDb(object):
+    """Stands in for the instances and services tables."""
+
+    def __init__(self):
+        self.memory = {}
+        self.services = {}
+        self.instances = {}
+        self.queries = 0
+        self.last_deleted_at = None
+
+    def add_host(self, host, memory_mb=0, up=True):
+        updated_at = utils.utcnow()
+        if not up:
+            updated_at = utils.parse_strtime("2000-01-01T00:00:00.000000")
+        self.services[host] = {'host': host, 'updated_at': updated_at,
+                               'created_at': updated_at}
+        self.memory[host] = memory_mb
+
+    def service_get_all_compute_memory(self, context):
+        self.queries += 1
+        return sorted([(self.services[host], self.memory[host])
+                       for host in self.services],
+                      key=lambda result: result[1])
+
+    def instance_update(self, context, instance_id, values):
+        self.memory[values['host']] += self.instances[instance_id]
+
+    def instance_last_deleted_at(self, context):
+        return self.last_deleted_at
+
+
+class MemorySchedulerTestBase(test.TestCase):
+
+    def setUp(self):
+        super(MemorySchedulerTestBase, self).setUp()
+        self.flags(max_instance_memory_mb=1024,
+                   reddwarf_scheduler_memory_sync_interval=60)
+        self.fake_db = FakeDb()
+        self.stubs.Set(simple.db_api, 'service_get_all_compute_memory',
+                       self.fake_db.service_get_all_compute_memory)
+        self.stubs.Set(simple.db, 'instance_update',
+                       self.fake_db.instance_update)
+        self.stubs.Set(simple.db_api, 'instance_last_deleted_at',
+                       self.fake_db.instance_last_deleted_at)
+        self.stubs.Set(simple.db_api, 'instance_count_by_host_and_project',
+                       lambda context: [])
+        self.context = context.get_admin_context()
+        self.scheduler = simple.MemoryScheduler()
+
+    def _schedule(self, instance_id, memory_mb, project_id='project'):
+        self.fake_db.instances[instance_id] = memory_mb
+        instance_ref = {'id': instance_id, 'memory_mb': memory_mb,
+                        'project_id': project_id,
+                        'display_name': 'instance%d' % instance_id}
+        return self.scheduler._schedule_based_on_resources(self.context,
+                                                           instance_ref)
+
+
+class MemorySchedulerTest(MemorySchedulerTestBase):
+
+    def test_picks_host_with_most_free_memory(self):
+        self.fake_db.add_host('a', 512)
+        self.fake_db.add_host('b', 256)
+        self.assertEqual('b', self._schedule(1, 128))
+
+    def test_placements_do_not_query_the_database(self):
+        self.fake_db.add_host('a')
+        self.fake_db.add_host('b')
+        hosts = [self._schedule(i, 256) for i in range(8)]
+        self.assertEqual(4, hosts.count('a'))
+        self.assertEqual(4, hosts.count('b'))
+        self.assertEqual(1, self.fake_db.queries)
+
+    def test_skips_hosts_that_are_down(self):
+        self.fake_db.add_host('a', up=False)
+        self.fake_db.add_host('b', 512)
+        self.assertEqual('b', self._schedule(1, 256))
+
+    def test_claims_are_kept_until_a_later_sync(self):
+        self.fake_db.add_host('a')
+        self._schedule(1, 512)
+        # A sync that started before the instance was saved keeps the claim.
+        self.scheduler.tracker.claims[1][2] = time.time() + 60
+        self.scheduler.tracker.sync(self.context)
+        self.assertEqual(1024, self.scheduler.tracker.committed['a'])
+        self.scheduler.tracker.claims[1][2] = 0
+        self.scheduler.tracker.sync(self.context)
+        self.assertEqual(512, self.scheduler.tracker.committed['a'])
+        self.assertEqual({}, self.scheduler.tracker.claims)
+
+    def test_failed_update_gives_back_the_claim(self):
+        self.fake_db.add_host('a')
+
+        def fail(*args, **kwargs):
+            raise Exception("database is down")
+
+        self.stubs.Set(simple.db, 'instance_update', fail)
+        self.assertRaises(Exception, self._schedule, 1, 512)
+        self.assertEqual(0, self.scheduler.tracker.committed['a'])
+        self.assertEqual({}, self.scheduler.tracker.claims)
+
+    def test_prefetch_warms_the_next_hosts(self):
+        self.fake_db.add_host('a', 1024)
+        self.fake_db.add_host('b', 512)
+        self.fake_db.add_host('c', 256)
+        self.stubs.Set(simple.db, 'queue_get_for',
+                       lambda context, topic, host: '%s.%s' % (topic, host))
+        casts = []
+        self.stubs.Set(simple.rpc, 'cast_many',
+                       lambda context, messages: casts.extend(
+                           [queue for queue, msg in messages]))
+        # Nothing is returned, so the scheduler manager casts nothing more.
+        self.assertEqual(None, self.scheduler.schedule_prefetch_image(
+            self.context, 'image', 256, count=3))
+        self.assertEqual(['compute.c', 'compute.b'], casts)
+        self.assertEqual({}, self.scheduler.tracker.claims)
+
+    def test_full_hosts_are_synced_before_failing(self):
+        self.fake_db.add_host('a')
+        self._schedule(1, 1024)
+        self.assertRaises(driver.NoValidHost, self._schedule, 2, 512)
+        self.assertEqual(2, self.fake_db.queries)
+
+    def test_freed_memory_is_found_by_the_sync(self):
+        self.fake_db.add_host('a')
+        self._schedule(1, 1024)
+        self.scheduler.tracker.claims[1][2] = 0
+        self.fake_db.memory['a'] = 0
+        self.assertEqual('a', self._schedule(2, 512))
+
+    def test_released_memory_is_reused(self):
+        self.fake_db.add_host('a')
+        self._schedule(1, 1024)
+        self.scheduler.schedule_instance_memory_released(
+            self.context, 'a', 1024, deleted_at=self._strtime(10))
+        self.assertEqual('a', self._schedule(2, 1024))
+        self.assertEqual(1, self.fake_db.queries)
+
+    def _strtime(self, second):
+        return '2012-01-01T00:00:%02d.000000' % second
+
+    def test_release_seen_by_the_sync_is_ignored(self):
+        self.fake_db.add_host('a', 512)
+        self.fake_db.last_deleted_at = utils.parse_strtime(self._strtime(5))
+        self._schedule(1, 256)
+        self.scheduler.schedule_instance_memory_released(
+            self.context, 'a', 512, deleted_at=self._strtime(5))
+        self.assertEqual(768, self.scheduler.tracker.committed['a'])
+        self.scheduler.schedule_instance_memory_released(
+            self.context, 'a', 512, deleted_at=self._strtime(6))
+        self.assertEqual(256, self.scheduler.tracker.committed['a'])
+
+    def test_release_without_deleted_at_is_ignored(self):
+        self.fake_db.add_host('a', 512)
+        self._schedule(1, 256)
+        self.scheduler.schedule_instance_memory_released(
+            self.context, 'a', 512, released_at=0)
+        self.assertEqual(768, self.scheduler.tracker.committed['a'])
+
+
+class PlacementStrategyTest(MemorySchedulerTestBase):
+
+    def _use_strategy(self, name):
+        self.flags(reddwarf_scheduler_placement_strategy=
+                   'reddwarf.scheduler.placement.%s' % name)
+        self.scheduler = simple.MemoryScheduler()
+
+    def test_best_fit_packs_hosts(self):
+        self._use_strategy('BestFitStrategy')
+        self.fake_db.add_host('a')
+        self.fake_db.add_host('b', 256)
+        hosts = [self._schedule(i, 256) for i in range(4)]
+        self.assertEqual(['b', 'b', 'b', 'a'], hosts)
+
+    def test_anti_affinity_spreads_projects(self):
+        self._use_strategy('TenantAntiAffinityStrategy')
+        self.fake_db.add_host('a')
+        self.fake_db.add_host('b', 512)
+        self.assertEqual('a', self._schedule(1, 256, 'red'))
+        self.assertEqual('b', self._schedule(2, 256, 'red'))
+        self.assertEqual('a', self._schedule(3, 256, 'blue'))
+        self.assertEqual({'a': {'red': 1, 'blue': 1}, 'b': {'red': 1}},
+                         self.scheduler.tracker.projects)
+
+    def test_anti_affinity_counts_projects_from_the_database(self):
+        self._use_strategy('TenantAntiAffinityStrategy')
+        self.fake_db.add_host('a')
+        self.fake_db.add_host('b', 512)
+        self.stubs.Set(simple.db_api, 'instance_count_by_host_and_project',
+                       lambda context: [('a', 'red', 2)])
+        self.assertEqual('b', self._schedule(1, 256, 'red'))
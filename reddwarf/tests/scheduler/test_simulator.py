@@ -0,0 +1,90 @@
+#    Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for the placement simulator of the memory scheduler.
+"""
+
+import json
+import os
+import tempfile
+
+from nova import test
+
+from reddwarf.scheduler import placement
+from reddwarf.scheduler import simulator
+
+
+class SimulatorTest(test.TestCase):
+
+    def test_replays_recorded_events(self):
+        events = [{'event': 'create', 'instance_id': 1, 'memory_mb': 512},
+                  {'event': 'create', 'instance_id': 2, 'memory_mb': 1024},
+                  {'event': 'delete', 'instance_id': 1},
+                  {'event': 'create', 'instance_id': 3, 'memory_mb': 1024}]
+        handle, path = tempfile.mkstemp()
+        try:
+            os.write(handle, '\n'.join(json.dumps(event)
+                                       for event in events))
+            os.close(handle)
+            recorded = simulator.load_events(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(events, recorded)
+        results = simulator.simulate(placement.BestFitStrategy(), recorded,
+                                     hosts=2, host_memory_mb=1024)
+        self.assertEqual(3, results['placed'])
+        self.assertEqual(0, results['failed'])
+        self.assertEqual(2, results['instances'])
+        self.assertEqual(2, results['hosts_used'])
+        self.assertEqual(0, results['largest_free_mb'])
+
+    def test_full_fleet_fails_placements(self):
+        events = [{'event': 'create', 'instance_id': i, 'memory_mb': 512}
+                  for i in range(5)]
+        results = simulator.simulate(placement.WorstFitStrategy(), events,
+                                     hosts=2, host_memory_mb=1024)
+        self.assertEqual(4, results['placed'])
+        self.assertEqual(1, results['failed'])
+        self.assertEqual(0, results['largest_free_mb'])
+
+    def test_no_hosts_fails_every_placement(self):
+        events = [{'event': 'create', 'instance_id': 1, 'memory_mb': 512},
+                  {'event': 'delete', 'instance_id': 1}]
+        results = simulator.simulate(placement.BestFitStrategy(), events,
+                                     hosts=0, host_memory_mb=1024)
+        self.assertEqual(0, results['placed'])
+        self.assertEqual(1, results['failed'])
+        self.assertEqual(0, results['hosts_used'])
+        self.assertEqual(0, results['largest_free_mb'])
+
+
+class SimulatorBenchmark(test.TestCase):
+    """Compares the strategies on a generated burst of creates and
+    deletes against a fleet of a hundred hosts."""
+
+    def test_strategies(self):
+        events = simulator.generate_events(2000, seed=1)
+        results = simulator.compare(events, hosts=100,
+                                    host_memory_mb=1024 * 15)
+        creates = len([event for event in events
+                        if event['event'] == 'create'])
+        for name in simulator.STRATEGIES:
+            self.assertEqual(creates, results[name]['placed'] +
+                                      results[name]['failed'])
+        best_fit = results['best-fit']
+        worst_fit = results['worst-fit']
+        self.assertTrue(best_fit['hosts_used'] < worst_fit['hosts_used'])
+        self.assertTrue(best_fit['density'] > worst_fit['density'])
+        self.assertTrue(results['anti-affinity']['colocated'] <=
+                        worst_fit['colocated'])
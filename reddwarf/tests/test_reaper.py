@@ -17,9 +17,12 @@
 
 from datetime import timedelta
 from nova import context
+from nova.compute import vm_states
 from nova.db import api as db_api
 from nova import test
 from nova import utils
+from reddwarf.db import api as reddwarf_db
+from reddwarf.reaper import driver
 from reddwarf.reaper.driver import ReddwarfReaperDriver
 
 
@@ -28,12 +31,36 @@ ORPHAN_TIME_OUT = 24 * 60 * 60
 
 class FakeVolumeApi(object):
 
-    def __init__(self):
+    def __init__(self, fail_on=None):
         self.deleted_volumes = []
+        self.fail_on = fail_on
 
     def delete(self, context, volume):
+        if volume == self.fail_on:
+            raise Exception("volume service is down")
         self.deleted_volumes.append(volume)
-    
+
+
+def create_volume(context, updated_at=None):
+    options = {
+        'size': 1,
+        'user_id': context.user_id,
+        'project_id': context.project_id,
+        'snapshot_id': None,
+        'availability_zone': None,
+        'status': "available",
+        'attach_status': "detached",
+        'display_name': 'blah',
+        'display_description': "test volume",
+        'volume_type_id': None,
+        'metadata': None,
+        }
+    volume = db_api.volume_create(context, options)
+    if updated_at is not None:
+        db_api.volume_update(context, volume['id'],
+                             {'updated_at': updated_at})
+    return volume
+
 
 class TestWhenAVolumeIsOrphaned(test.TestCase):
 
@@ -77,3 +104,143 @@ class TestWhenAVolumeIsOrphaned(test.TestCase):
     def test_an_new_orphan_is_left_alone(self):
         self.reaper_driver.periodic_tasks(self.context)
         self.assertEqual(len(self.reaper_driver.volume_api.deleted_volumes), 0)
+
+
+class TestReapingInBatches(test.TestCase):
+
+    def setUp(self):
+        super(TestReapingInBatches, self).setUp()
+        self.context = context.get_admin_context()
+        self.flags(reddwarf_reaper_batch_size=2,
+                   reddwarf_reaper_max_rate=0)
+        self.notifications = []
+        self.stubs.Set(driver.notifier, 'notify',
+                       lambda *args: self.notifications.append(args))
+        updated_at = utils.utcnow() - timedelta(seconds=ORPHAN_TIME_OUT * 2)
+        self.volumes = [create_volume(self.context, updated_at)
+                        for i in range(3)]
+        self.reaper_driver = ReddwarfReaperDriver(ORPHAN_TIME_OUT)
+        self.reaper_driver.volume_api = FakeVolumeApi()
+
+    def test_runs_carry_on_from_the_last_batch(self):
+        ids = [volume['id'] for volume in self.volumes]
+        summary = self.reaper_driver.periodic_tasks(self.context)[0]
+        self.assertEqual(ids[:2],
+                         self.reaper_driver.volume_api.deleted_volumes)
+        self.assertFalse(summary['finished'])
+        summary = self.reaper_driver.periodic_tasks(self.context)[0]
+        self.assertEqual(ids, self.reaper_driver.volume_api.deleted_volumes)
+        self.assertTrue(summary['finished'])
+
+    def test_failed_volume_does_not_stop_the_batch(self):
+        self.flags(reddwarf_reaper_batch_size=10)
+        volume_api = FakeVolumeApi(fail_on=self.volumes[0]['id'])
+        self.reaper_driver.volume_api = volume_api
+        summary = self.reaper_driver.periodic_tasks(self.context)[0]
+        self.assertEqual({'task': 'volumes', 'scanned': 3, 'reaped': 2,
+                          'failed': 1, 'finished': True}, summary)
+
+    def test_summary_is_notified(self):
+        self.reaper_driver.periodic_tasks(self.context)
+        self.assertEqual(1, len(self.notifications))
+        self.assertEqual('reddwarf.reaper.run', self.notifications[0][1])
+        self.assertEqual(2, self.notifications[0][3]['tasks'][0]['reaped'])
+
+    def test_deletes_are_rate_limited(self):
+        self.flags(reddwarf_reaper_max_rate=2)
+        self.now = 1000.0
+        self.sleeps = []
+
+        def fake_sleep(seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+        self.stubs.Set(driver.time, 'time', lambda: self.now)
+        self.stubs.Set(driver.greenthread, 'sleep', fake_sleep)
+        self.reaper_driver.periodic_tasks(self.context)
+        self.assertEqual([0.5], self.sleeps)
+
+
+class TestWhenAnInstanceIsStuckBuilding(test.TestCase):
+
+    def setUp(self):
+        super(TestWhenAnInstanceIsStuckBuilding, self).setUp()
+        self.context = context.get_admin_context()
+        self.flags(reddwarf_reaper_stuck_building_time=ORPHAN_TIME_OUT)
+        self.reaper_driver = ReddwarfReaperDriver(
+            task_names=['building_instances'])
+
+    def create_instance(self, age):
+        instance = db_api.instance_create(self.context,
+                                          {'vm_state': vm_states.BUILDING})
+        updated_at = utils.utcnow() - timedelta(seconds=age)
+        db_api.instance_update(self.context, instance['id'],
+                               {'updated_at': updated_at})
+        return instance
+
+    def test_an_old_build_is_failed(self):
+        instance = self.create_instance(ORPHAN_TIME_OUT * 2)
+        self.reaper_driver.periodic_tasks(self.context)
+        instance = db_api.instance_get(self.context, instance['id'])
+        self.assertEqual(vm_states.ERROR, instance['vm_state'])
+
+    def test_a_new_build_is_left_alone(self):
+        instance = self.create_instance(0)
+        self.reaper_driver.periodic_tasks(self.context)
+        instance = db_api.instance_get(self.context, instance['id'])
+        self.assertEqual(vm_states.BUILDING, instance['vm_state'])
+
+
+class FakeDnsDriver(object):
+
+    def __init__(self):
+        self.deleted = []
+
+    def delete_entry(self, name, type, dns_zone=None):
+        self.deleted.append(name)
+
+
+class TestWhenADnsRecordIsOrphaned(test.TestCase):
+
+    def setUp(self):
+        super(TestWhenADnsRecordIsOrphaned, self).setUp()
+        self.context = context.get_admin_context()
+        self.flags(dns_instance_entry_factory=
+                   'reddwarf.dns.driver.DnsSimpleInstanceEntryFactory',
+                   reddwarf_reaper_orphan_dns_expiration_time=-60,
+                   reddwarf_reaper_max_rate=0)
+        self.reaper_driver = ReddwarfReaperDriver(task_names=['dns_records'])
+        self.dns_driver = FakeDnsDriver()
+        self.reaper_driver.tasks[0].dns_driver = self.dns_driver
+
+    def test_only_records_without_an_instance_are_reaped(self):
+        instance = db_api.instance_create(self.context, {})
+        reddwarf_db.rsdns_record_create(instance['name'], 'A-1')
+        reddwarf_db.rsdns_record_create('gone.example.com', 'A-2')
+        self.reaper_driver.periodic_tasks(self.context)
+        self.assertEqual(['gone.example.com'], self.dns_driver.deleted)
+
+    def test_instances_are_loaded_once_per_pass(self):
+        loads = []
+
+        def instance_get_all_without_relations(context):
+            loads.append(context)
+            return []
+
+        self.stubs.Set(reddwarf_db, 'instance_get_all_without_relations',
+                       instance_get_all_without_relations)
+        self.flags(reddwarf_reaper_batch_size=1,
+                   reddwarf_reaper_orphan_dns_expiration_time=60)
+        reddwarf_db.rsdns_record_create('gone1.example.com', 'A-1')
+        reddwarf_db.rsdns_record_create('gone2.example.com', 'A-2')
+        later = utils.utcnow() + timedelta(seconds=120)
+        self.stubs.Set(utils, 'utcnow', lambda: later)
+        task = self.reaper_driver.tasks[0]
+        summaries = [self.reaper_driver.run_task(self.context, task)
+                     for i in range(3)]
+        self.assertEqual([False, False, True],
+                         [summary['finished'] for summary in summaries])
+        self.assertEqual(2, len(self.dns_driver.deleted))
+        self.assertEqual(1, len(loads))
+        self.reaper_driver.run_task(self.context, task)
+        self.assertEqual(2, len(loads))
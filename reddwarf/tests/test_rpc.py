@@ -0,0 +1,72 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for reddwarf.rpc.
+"""
+
+from nova import context
+from nova import test
+
+from reddwarf import rpc as reddwarf_rpc
+
+
+class FakeConnectionContext(object):
+
+    declared = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, v, tb):
+        pass
+
+    def declare_topic_consumer(self, topic):
+        self.declared.append(topic)
+
+
+class CastWithConsumerOnceTest(test.TestCase):
+
+    def setUp(self):
+        super(CastWithConsumerOnceTest, self).setUp()
+        self.context = context.get_admin_context()
+        FakeConnectionContext.declared = []
+        self.casts = []
+        self.stubs.Set(reddwarf_rpc, 'DECLARED_TOPICS', set())
+        self.stubs.Set(reddwarf_rpc, 'DECLARED_AT_RECONNECT',
+                       reddwarf_rpc.impl_kombu.RECONNECTS)
+        self.stubs.Set(reddwarf_rpc.impl_kombu, 'ConnectionContext',
+                       FakeConnectionContext)
+        self.stubs.Set(reddwarf_rpc.impl_kombu, 'cast',
+                       lambda ctxt, topic, msg: self.casts.append(topic))
+
+    def test_consumer_declared_once_per_topic(self):
+        for i in range(3):
+            reddwarf_rpc.cast_with_consumer_once(self.context, 'guest.1', {})
+        reddwarf_rpc.cast_with_consumer_once(self.context, 'guest.2', {})
+        self.assertEqual(['guest.1', 'guest.2'],
+                         FakeConnectionContext.declared)
+        self.assertEqual(4, len(self.casts))
+
+    def test_topics_declared_again_after_a_reconnect(self):
+        reddwarf_rpc.cast_with_consumer_once(self.context, 'guest.1', {})
+        self.stubs.Set(reddwarf_rpc.impl_kombu, 'RECONNECTS',
+                       reddwarf_rpc.impl_kombu.RECONNECTS + 1)
+        reddwarf_rpc.cast_with_consumer_once(self.context, 'guest.1', {})
+        reddwarf_rpc.cast_with_consumer_once(self.context, 'guest.1', {})
+        self.assertEqual(['guest.1', 'guest.1'],
+                         FakeConnectionContext.declared)
+        self.assertEqual(3, len(self.casts))
@@ -15,6 +15,7 @@
 from nova import test
 
 from reddwarf import exception
+from reddwarf.utils import LRUCache
 from reddwarf.utils import poll_until
 
 
@@ -44,3 +45,42 @@ class PollUntilTestCase(test.TestCase):
                             sleep_time=0)
         self.assertEqual(60, result)
 
+
+
+class LRUCacheTestCase(test.TestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(1, cache.get_stats()['evictions'])
+
+    def test_expired_entry_is_missing(self):
+        cache = LRUCache(2, ttl=60)
+        cache.set('a', 1, ttl=-1)
+        cache.set('b', 2)
+        self.assertEqual(None, cache.get('a'))
+        self.assertEqual(2, cache.get('b'))
+        self.assertEqual(1, len(cache))
+
+    def test_add_keeps_the_stored_value(self):
+        cache = LRUCache(2, ttl=60)
+        self.assertTrue(cache.add('a', 1))
+        self.assertFalse(cache.add('a', 2))
+        cache.set('b', 2, ttl=-1)
+        self.assertTrue(cache.add('b', 3))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('b'))
+
+    def test_stats(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        self.assertEqual({'hits': 1, 'misses': 1, 'evictions': 0, 'size': 1},
+                         cache.get_stats())
@@ -37,4 +37,111 @@ def poll_until(retriever, condition=lambda value: value,
         if time_out is not None and time.time() > start_time + time_out:
             raise exception.PollTimeOut
     lc = LoopingCall(f=poll_and_check).start(sleep_time, True)
-    return lc.wait()
\ No newline at end of file
+    return lc.wait()
+
+
+class LRUCache(object):
+    """A size bounded cache which evicts the least recently used entry.
+
+    Entries may optionally expire ttl seconds after they were set. Hits,
+    misses and evictions are counted so they can be reported.
+
+    """
+
+    # Indexes into the entries of the linked list.
+    PREV, NEXT, KEY, VALUE, EXPIRES_AT = 0, 1, 2, 3, 4
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._map = {}
+        # The root of a circular doubly linked list ordered from the most to
+        # the least recently used entry.
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None, None]
+
+    def __len__(self):
+        return len(self._map)
+
+    def _unlink(self, link):
+        link[self.PREV][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREV] = link[self.PREV]
+
+    def _push_front(self, link):
+        first = self._root[self.NEXT]
+        link[self.PREV] = self._root
+        link[self.NEXT] = first
+        first[self.PREV] = link
+        self._root[self.NEXT] = link
+
+    def get(self, key, default=None):
+        """Returns the value for the key, or default if missing or expired."""
+        link = self._map.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        expires_at = link[self.EXPIRES_AT]
+        if expires_at is not None and expires_at <= time.time():
+            self.delete(key)
+            self.misses += 1
+            return default
+        self._unlink(link)
+        self._push_front(link)
+        self.hits += 1
+        return link[self.VALUE]
+
+    def set(self, key, value, ttl=None):
+        """Stores the value, evicting the least recently used entry if full.
+
+        The ttl overrides the default ttl of the cache for this entry.
+
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        link = self._map.get(key)
+        if link is not None:
+            self._unlink(link)
+            link[self.VALUE] = value
+            link[self.EXPIRES_AT] = expires_at
+        else:
+            if len(self._map) >= self.max_size:
+                last = self._root[self.PREV]
+                self.delete(last[self.KEY])
+                self.evictions += 1
+            link = [None, None, key, value, expires_at]
+            self._map[key] = link
+        self._push_front(link)
+
+    def add(self, key, value, ttl=None):
+        """Stores the value only if the key is missing or expired.
+
+        Returns True if the value was stored.
+
+        """
+        link = self._map.get(key)
+        if link is not None:
+            expires_at = link[self.EXPIRES_AT]
+            if expires_at is None or expires_at > time.time():
+                return False
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, key):
+        """Removes the key from the cache if present."""
+        link = self._map.pop(key, None)
+        if link is not None:
+            self._unlink(link)
+
+    def clear(self):
+        self._map.clear()
+        self._root[:] = [self._root, self._root, None, None, None]
+
+    def get_stats(self):
+        """Returns the hit, miss and eviction counts and the current size."""
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._map)}
@@ -17,6 +17,7 @@
 Records interface.
 """
 
+import urllib
 import urlparse
 
 from novaclient import base
@@ -103,15 +104,20 @@ class RecordsManager(base.ManagerWithFind):
         """
         Get a list of all records under a domain.
 
+        If a record_type is given the name and address filters are sent to
+        the DNS API, which only searches by name or data along with a type,
+        so only the matching records are downloaded.
+
         :rtype: list of :class:`Record`
         """
         url = "/domains/%s/records" % domain_id
         if record_id:
             url += ("/%s" % record_id)
+        query = self.search_query(record_name, record_address, record_type)
         offset = 0
         list = []
         while offset is not None:
-            next_url = "%s?offset=%d" % (url, offset)
+            next_url = "%s?%soffset=%d" % (url, query, offset)
             partial_list, offset = self.page_list(next_url)
             list += partial_list
         all_records = self.create_from_list(list)
@@ -119,6 +125,17 @@ class RecordsManager(base.ManagerWithFind):
                 if self.match_record(record, record_name, record_address,
                                      record_type)]
 
+    def search_query(self, name=None, address=None, type=None):
+        """Returns the query string prefix searching for the records."""
+        if not type:
+            return ""
+        params = [("type", type)]
+        if name:
+            params.append(("name", name))
+        if address:
+            params.append(("data", address))
+        return urllib.urlencode(params) + "&"
+
     def page_list(self, url):
         """
         Given a URL and an offset, returns a tuple containing a list and the
@@ -0,0 +1,195 @@
+import unittest
+
+from reddwarf.dns import manager
+from reddwarf.dns.driver import DnsEntry
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class FakeJob(object):
+    """Stands in for a FutureRecord; each check of ready is one request."""
+
+    def __init__(self, service, ready_at, error=None):
+        self.service = service
+        self.ready_at = ready_at
+        self.error = error
+
+    @property
+    def ready(self):
+        self.service.requests += 1
+        if self.error:
+            raise RuntimeError(self.error)
+        return self.service.clock.now >= self.ready_at
+
+
+class FakeDNSaaS(object):
+    """Finishes every record creation job latency seconds after it starts."""
+
+    def __init__(self, clock, latency):
+        self.clock = clock
+        self.latency = latency
+        self.requests = 0
+
+    def create(self, entry, error=None):
+        self.requests += 1
+        return FakeJob(self, self.clock.now + self.latency, error)
+
+
+class FakeDriver(object):
+
+    def __init__(self, service):
+        self.service = service
+        self.finished = []
+        self.abandoned = []
+        self.abandon_errors = 0
+
+    def submit_entry(self, entry, error=None):
+        return self.service.create(entry, error)
+
+    def finish_entry(self, entry, job):
+        self.finished.append(entry.name)
+
+    def abandon_entry(self, entry, job):
+        if self.abandon_errors:
+            self.abandon_errors -= 1
+            raise RuntimeError("database is away")
+        self.abandoned.append(entry.name)
+
+
+def fake_entry(index):
+    return DnsEntry(name="%d.example.com" % index, content="10.0.0.1",
+                    type="A", ttl=300)
+
+
+class DnsJobTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.old_time = manager.time
+        manager.time = self.clock
+        self.service = FakeDNSaaS(self.clock, latency=5)
+        self.driver = FakeDriver(self.service)
+        self.tracker = manager.DnsJobTracker(self.driver)
+
+    def tearDown(self):
+        manager.time = self.old_time
+
+    def submit(self, count, error=None):
+        for index in range(count):
+            entry = fake_entry(index)
+            self.tracker.add(entry, self.driver.submit_entry(entry, error))
+
+    def run_until_done(self, time_limit=60 * 60):
+        start = self.clock.now
+        while self.tracker.pending:
+            self.clock.now += manager.FLAGS.dns_job_poll_interval
+            self.tracker.poll()
+            self.assertTrue(self.clock.now - start < time_limit)
+        return self.clock.now - start
+
+    def test_jobs_finish(self):
+        self.submit(3)
+        self.run_until_done()
+        self.assertEqual(3, len(self.driver.finished))
+        self.assertEqual({'pending': 0, 'completed': 3, 'failed': 0,
+                          'timed_out': 0}, self.tracker.get_metrics())
+
+    def test_polling_backs_off(self):
+        self.service.latency = 60
+        self.submit(1)
+        self.run_until_done()
+        # Polled after 1, 3, 7, 15, 31, 47 and 63 seconds.
+        self.assertEqual(1 + 7, self.service.requests)
+
+    def test_failing_jobs_are_retried_until_they_time_out(self):
+        self.submit(2, error="service unavailable")
+        elapsed = self.run_until_done()
+        self.assertEqual(2, len(self.driver.abandoned))
+        self.assertTrue(elapsed >= manager.FLAGS.dns_job_time_out)
+        metrics = self.tracker.get_metrics()
+        self.assertEqual(2, metrics['timed_out'])
+        self.assertTrue(metrics['failed'] > 2)
+
+    def test_failed_finish_keeps_the_job(self):
+        self.submit(1)
+        finish_entry = self.driver.finish_entry
+        errors = []
+
+        def fail_once(entry, job):
+            if not errors:
+                errors.append(entry.name)
+                raise RuntimeError("database is away")
+            finish_entry(entry, job)
+
+        self.driver.finish_entry = fail_once
+        self.run_until_done()
+        self.assertEqual(["0.example.com"], self.driver.finished)
+        self.assertEqual([], self.driver.abandoned)
+        self.assertEqual(1, self.tracker.get_metrics()['failed'])
+
+    def test_slow_jobs_time_out(self):
+        self.service.latency = manager.FLAGS.dns_job_time_out * 2
+        self.submit(1)
+        self.run_until_done()
+        self.assertEqual(["0.example.com"], self.driver.abandoned)
+        self.assertEqual(1, self.tracker.get_metrics()['timed_out'])
+
+
+    def test_abandoning_is_retried(self):
+        self.driver.abandon_errors = 1
+        self.submit(2, error="validation failed")
+        self.run_until_done()
+        self.assertEqual(["1.example.com", "0.example.com"],
+                         self.driver.abandoned)
+
+    def test_jobs_are_kept_if_polling_is_interrupted(self):
+        self.submit(3)
+
+        class Interrupted(BaseException):
+            pass
+
+        def interrupt(*args, **kwargs):
+            raise Interrupted()
+
+        self.driver.finish_entry = interrupt
+        self.clock.now += self.service.latency
+        self.assertRaises(Interrupted, self.tracker.poll)
+        self.assertEqual(2, len(self.tracker.pending))
+
+
+class DnsJobTrackerThroughput(unittest.TestCase):
+    """Compares creating a burst of records through the tracker with
+    waiting on each job in turn, as create_entry does."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.old_time = manager.time
+        manager.time = self.clock
+
+    def tearDown(self):
+        manager.time = self.old_time
+
+    def test_burst_throughput(self):
+        count = 200
+        latency = 5
+        service = FakeDNSaaS(self.clock, latency)
+        driver = FakeDriver(service)
+        tracker = manager.DnsJobTracker(driver)
+        for index in range(count):
+            entry = fake_entry(index)
+            tracker.add(entry, driver.submit_entry(entry))
+        while tracker.pending:
+            self.clock.now += manager.FLAGS.dns_job_poll_interval
+            tracker.poll()
+        self.assertEqual(count, len(driver.finished))
+        # Each job is created, then polled after 1, 3 and 7 seconds, the
+        # same number of requests as waiting on the jobs one at a time,
+        # but with all of them in flight together.
+        self.assertEqual(count * (1 + 3), service.requests)
@@ -62,6 +62,19 @@ class DNSClientRecordPagination(unittest.TestCase):
         for letter in expected_filtered_list:
             self.assertTrue(letter in actual_list)
 
+    def test_list_searches_by_type(self):
+        dns = FakeDNSaaS(None, None, None)
+        records = RecordsManager(dns)
+        self.mox.StubOutWithMock(records, "page_list")
+        expected_url = "/domains/%s/records?type=A&name=a.com&data=10.0.0.1&" \
+                       "offset=0" % FAKE_DOMAIN_ID
+        records.page_list(expected_url).AndReturn(([], None))
+        self.mox.ReplayAll()
+
+        actual_list = records.list(FAKE_DOMAIN_ID, record_name="a.com",
+                                   record_address="10.0.0.1", record_type="A")
+        self.assertEqual([], actual_list)
+
     def test_page_list(self):
         """Tests grabbing the list and next offset from the RS DNS API."""
         client = self.mox.CreateMock(DNSaasClient)